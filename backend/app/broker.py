@@ -0,0 +1,154 @@
+"""
+Broker local que roteia eventos WebSocket entre os processos (workers) do uvicorn,
+por um socket Unix.
+
+Cada worker se conecta ao broker e informa quais usuários têm WebSocket aberto nele
+(SUB/UNSUB). Um evento para um usuário conectado em outro worker é publicado com SEND
+e entregue (DELIVER) ao worker que mantém o socket do destinatário; BCAST é repassado a
+todos os demais workers.
+
+Um worker que não lê o socket (travado ou sobrecarregado) não faz a memória do broker
+crescer sem limite: acima de `max_buffer_bytes` aguardando envio para ele, os eventos
+são descartados e contados. Um SEND descartado volta ao worker de origem como NOROUTE,
+para que ele o guarde como entrega pendente se for durável.
+
+Uso (a partir do diretório backend/):
+
+    python -m app.broker --socket /tmp/safechat-broker.sock
+    SAFECHAT_DELIVERY_BACKEND=broker uvicorn app.main:app --workers 4 ...
+"""
+import argparse
+import asyncio
+import os
+import struct
+from typing import Dict, Optional, Set, Tuple
+
+# Cabeçalho de cada quadro: operação, flags, ID do usuário (16 bytes) e tamanho do conteúdo
+_HEADER = struct.Struct("!BB16sI")
+
+OP_SUB = 1       # worker -> broker: usuário conectado neste worker
+OP_UNSUB = 2     # worker -> broker: usuário desconectado deste worker
+OP_SEND = 3      # worker -> broker: evento para um usuário
+OP_BCAST = 4     # worker -> broker: evento para todos os usuários
+OP_DELIVER = 5   # broker -> worker: evento para um usuário conectado neste worker
+OP_NOROUTE = 6   # broker -> worker: nenhum worker tem o destinatário de um SEND
+
+# Flags: o worker de origem guarda o evento se o destinatário estiver offline (NOROUTE)
+FLAG_DURABLE = 0x01
+
+NO_USER = bytes(16)
+
+# Bytes aguardando envio para um worker acima dos quais os eventos para ele são descartados
+DEFAULT_MAX_BUFFER_BYTES = 8 * 1024 * 1024
+
+
+def write_frame(writer: asyncio.StreamWriter, op: int, user_id: bytes = NO_USER, payload: bytes = b"", flags: int = 0) -> None:
+    writer.write(_HEADER.pack(op, flags, user_id, len(payload)) + payload)
+
+
+def buffered_bytes(writer: asyncio.StreamWriter) -> int:
+    """Bytes já escritos em `writer` que ainda não foram enviados pelo socket."""
+    return writer.transport.get_write_buffer_size()
+
+
+async def read_frame(reader: asyncio.StreamReader) -> Tuple[int, int, bytes, bytes]:
+    op, flags, user_id, length = _HEADER.unpack(await reader.readexactly(_HEADER.size))
+    payload = await reader.readexactly(length) if length else b""
+    return op, flags, user_id, payload
+
+
+class Broker:
+    def __init__(self, max_buffer_bytes: int = DEFAULT_MAX_BUFFER_BYTES):
+        self.max_buffer_bytes = max_buffer_bytes
+        self.routes: Dict[bytes, Set[asyncio.StreamWriter]] = {}
+        self.workers: Set[asyncio.StreamWriter] = set()
+        self.routed = 0
+        self.unrouted = 0
+        self.broadcasts = 0
+        self.dropped = 0
+
+    def _forward(self, target: asyncio.StreamWriter, op: int, user_id: bytes, payload: bytes, flags: int) -> bool:
+        """Escreve o quadro para `target`, ou o descarta se o worker não estiver lendo o socket."""
+        if buffered_bytes(target) > self.max_buffer_bytes:
+            self.dropped += 1
+            return False
+        write_frame(target, op, user_id, payload, flags)
+        return True
+
+    async def handle_worker(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.workers.add(writer)
+        subscriptions: Set[bytes] = set()
+        try:
+            while True:
+                op, flags, user_id, payload = await read_frame(reader)
+                if op == OP_SUB:
+                    subscriptions.add(user_id)
+                    self.routes.setdefault(user_id, set()).add(writer)
+                elif op == OP_UNSUB:
+                    subscriptions.discard(user_id)
+                    self._unroute(user_id, writer)
+                elif op == OP_SEND:
+                    targets = self.routes.get(user_id, ())
+                    delivered = False
+                    for target in list(targets):
+                        delivered = self._forward(target, OP_DELIVER, user_id, payload, flags) or delivered
+                    if delivered:
+                        self.routed += 1
+                    else:
+                        # A resposta vai ao próprio worker que está enviando: aguardar a drenagem
+                        # apenas o desacelera, sem descartar eventos que ele precisa guardar
+                        self.unrouted += 1
+                        write_frame(writer, OP_NOROUTE, user_id, payload, flags)
+                        await writer.drain()
+                elif op == OP_BCAST:
+                    self.broadcasts += 1
+                    for target in list(self.workers):
+                        if target is not writer:
+                            self._forward(target, OP_BCAST, NO_USER, payload, flags)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            # Worker encerrado: remove todas as rotas dele
+            self.workers.discard(writer)
+            for user_id in subscriptions:
+                self._unroute(user_id, writer)
+            writer.close()
+
+    def _unroute(self, user_id: bytes, writer: asyncio.StreamWriter) -> None:
+        targets = self.routes.get(user_id)
+        if targets is not None:
+            targets.discard(writer)
+            if not targets:
+                del self.routes[user_id]
+
+
+async def serve(socket_path: str, max_buffer_bytes: int = DEFAULT_MAX_BUFFER_BYTES) -> None:
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    broker = Broker(max_buffer_bytes)
+    server = await asyncio.start_unix_server(broker.handle_worker, path=socket_path)
+    print(f"Broker de entrega escutando em {socket_path}")
+    async with server:
+        await server.serve_forever()
+
+
+def main(argv: Optional[list] = None) -> None:
+    from . import config
+
+    parser = argparse.ArgumentParser(description="Broker local de entrega de eventos WebSocket entre workers.")
+    parser.add_argument("--socket", default=config.DELIVERY_BROKER_SOCKET, help="caminho do socket Unix")
+    parser.add_argument(
+        "--max-buffer-bytes",
+        type=int,
+        default=config.DELIVERY_BROKER_MAX_BUFFER_BYTES,
+        help="bytes pendentes por worker acima dos quais os eventos para ele são descartados",
+    )
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args.socket, args.max_buffer_bytes))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+import os
+
+# Configurações da aplicação, lidas de variáveis de ambiente com valores padrão
+# adequados para desenvolvimento local.
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.environ.get(name)
+    return int(value) if value not in (None, "") else default
+
+
+def _env_float(name: str, default: float) -> float:
+    value = os.environ.get(name)
+    return float(value) if value not in (None, "") else default
+
+
+# --- Cache de chaves privadas RSA já carregadas (objetos) ---
+
+# Número máximo de chaves mantidas em memória
+KEY_CACHE_MAX_ENTRIES = _env_int("SAFECHAT_KEY_CACHE_MAX_ENTRIES", 1024)
+# Limite aproximado de memória (soma do tamanho DER das chaves em cache, em bytes)
+KEY_CACHE_MAX_BYTES = _env_int("SAFECHAT_KEY_CACHE_MAX_BYTES", 4 * 1024 * 1024)
+# Tempo de vida de cada entrada em segundos (0 desativa a expiração)
+KEY_CACHE_TTL_SECONDS = _env_float("SAFECHAT_KEY_CACHE_TTL_SECONDS", 15 * 60)
+
+# --- Cache de chaves de sessão AES-GCM (esquema de envelope "aes-gcm") ---
+
+# Número máximo de chaves de sessão desembrulhadas mantidas em memória (0 desativa o cache)
+SESSION_KEY_CACHE_MAX_ENTRIES = _env_int("SAFECHAT_SESSION_KEY_CACHE_MAX_ENTRIES", 4096)
+# Tempo de vida de cada chave de sessão em cache, em segundos (0 desativa a expiração)
+SESSION_KEY_CACHE_TTL_SECONDS = _env_float("SAFECHAT_SESSION_KEY_CACHE_TTL_SECONDS", 60 * 60)
+
+# --- Pool de trabalho para operações criptográficas ---
+
+# "thread" (ThreadPoolExecutor) ou "process" (ProcessPoolExecutor)
+CRYPTO_POOL_KIND = os.environ.get("SAFECHAT_CRYPTO_POOL_KIND", "thread")
+# Número de workers do pool (padrão: número de CPUs)
+CRYPTO_POOL_SIZE = _env_int("SAFECHAT_CRYPTO_POOL_SIZE", os.cpu_count() or 1)
+# Número máximo de tarefas em andamento no pool; as demais aguardam na fila do event loop
+CRYPTO_MAX_PENDING = _env_int("SAFECHAT_CRYPTO_MAX_PENDING", 256)
+# Quantidade de mensagens por lote ao descriptografar históricos
+CRYPTO_CHUNK_SIZE = _env_int("SAFECHAT_CRYPTO_CHUNK_SIZE", 64)
+
+# --- Histórico de mensagens ---
+
+# Tamanho máximo de página aceito pelo parâmetro `limit` de /messages/{user1_id}/{user2_id}
+HISTORY_MAX_PAGE_SIZE = _env_int("SAFECHAT_HISTORY_MAX_PAGE_SIZE", 500)
+# Mensagens lidas do banco (e descriptografadas) por lote em /messages/{user1_id}/{user2_id}/stream
+HISTORY_STREAM_BATCH_SIZE = _env_int("SAFECHAT_HISTORY_STREAM_BATCH_SIZE", 200)
+
+# --- Caixa de entrada (resumo das conversas) ---
+
+# Quantidade padrão e máxima de conversas por página em /conversations/{user_id}
+INBOX_DEFAULT_PAGE_SIZE = _env_int("SAFECHAT_INBOX_DEFAULT_PAGE_SIZE", 50)
+INBOX_MAX_PAGE_SIZE = _env_int("SAFECHAT_INBOX_MAX_PAGE_SIZE", 200)
+
+# --- Reserva de pares de chaves RSA pré-gerados ---
+
+# Quantidade de pares mantidos prontos para novos registros (0 desativa a reserva)
+KEY_POOL_TARGET_SIZE = _env_int("SAFECHAT_KEY_POOL_TARGET_SIZE", 8)
+# Tarefas de reposição gerando pares em paralelo (cada uma ocupa um worker do pool de criptografia)
+KEY_POOL_REFILL_WORKERS = _env_int("SAFECHAT_KEY_POOL_REFILL_WORKERS", 1)
+
+# --- Inicialização ---
+
+# Aquecimento depois da inicialização (o worker só informa /ready ao final): carrega o diretório
+# de usuários, executa uma vez as consultas principais e carrega as chaves privadas dos remetentes
+# mais recentes. "0" desativa (o worker fica pronto assim que o esquema é criado)
+WARMUP_ENABLED = os.environ.get("SAFECHAT_WARMUP", "1") != "0"
+# Remetentes recentes cujas chaves privadas são carregadas no cache durante o aquecimento
+WARMUP_RECENT_USERS = _env_int("SAFECHAT_WARMUP_RECENT_USERS", 256)
+
+# --- Banco de dados SQLite ---
+
+# Modo de journal do SQLite (WAL permite leituras durante a escrita)
+SQLITE_JOURNAL_MODE = os.environ.get("SAFECHAT_SQLITE_JOURNAL_MODE", "WAL")
+# Nível de sincronização com o disco (NORMAL é seguro em WAL e evita um fsync por commit)
+SQLITE_SYNCHRONOUS = os.environ.get("SAFECHAT_SQLITE_SYNCHRONOUS", "NORMAL")
+# Tempo máximo de espera pelo lock de escrita antes de falhar, em milissegundos
+SQLITE_BUSY_TIMEOUT_MS = _env_int("SAFECHAT_SQLITE_BUSY_TIMEOUT_MS", 5000)
+# Conexões mantidas abertas no pool de cada motor, e conexões extras permitidas em picos
+DB_POOL_SIZE = _env_int("SAFECHAT_DB_POOL_SIZE", 8)
+DB_MAX_OVERFLOW = _env_int("SAFECHAT_DB_MAX_OVERFLOW", 16)
+# Quantidade de arquivos (shards) entre os quais as mensagens são distribuídas por conversa.
+# 1 mantém tudo no banco principal; ao mudar o valor com mensagens já gravadas, redistribua
+# o histórico com `python -m app.reshard_messages`
+MESSAGE_SHARDS = _env_int("SAFECHAT_MESSAGE_SHARDS", 1)
+# Caminho de cada shard; {index} é substituído pelo número do shard (0 a MESSAGE_SHARDS - 1)
+MESSAGE_SHARD_PATH = os.environ.get("SAFECHAT_MESSAGE_SHARD_PATH", "./chat-messages-{index}.db")
+
+# --- Escrita de mensagens em lote (group commit) ---
+
+# Quantidade máxima de mensagens gravadas em uma única transação
+MESSAGE_BATCH_MAX_SIZE = _env_int("SAFECHAT_MESSAGE_BATCH_MAX_SIZE", 256)
+# Janela de espera por mais mensagens antes de gravar o lote, em milissegundos. Com 0, o lote
+# reúne as mensagens que chegaram enquanto o commit anterior era gravado (sem latência extra);
+# uma janela maior só compensa quando o fsync é caro (ex.: synchronous=FULL)
+MESSAGE_BATCH_WINDOW_MS = _env_float("SAFECHAT_MESSAGE_BATCH_WINDOW_MS", 0.0)
+
+# --- Lotes de mensagens recebidos via WebSocket (CHAT_BATCH) ---
+
+# Quantidade máxima de mensagens em um único CHAT_BATCH. Com o controle de admissão ativo, o
+# limite efetivo é o menor entre este valor e as rajadas (RATE_LIMIT_*_BURST, padrão 60)
+CHAT_BATCH_MAX_SIZE = _env_int("SAFECHAT_CHAT_BATCH_MAX_SIZE", 500)
+
+# --- Entregas pendentes para destinatários offline ---
+
+# Eventos pendentes por lote (PENDING_BATCH) ao repor após a reconexão
+PENDING_REPLAY_BATCH_SIZE = _env_int("SAFECHAT_PENDING_REPLAY_BATCH_SIZE", 200)
+# Eventos guardados por destinatário; acima disso os mais antigos são descartados (0 desativa o limite)
+PENDING_MAX_PER_RECIPIENT = _env_int("SAFECHAT_PENDING_MAX_PER_RECIPIENT", 1000)
+# Tempo de vida de um evento não confirmado, em segundos (0 desativa a expiração). O cliente
+# sempre pode recarregar o histórico completo por /messages
+PENDING_TTL_SECONDS = _env_float("SAFECHAT_PENDING_TTL_SECONDS", 7 * 24 * 60 * 60)
+
+# --- Controle de admissão das mensagens recebidas via WebSocket ---
+
+# Baldes de fichas medidos em mensagens de chat (uma descriptografia cada): taxa sustentada
+# (mensagens/s) e rajada máxima, por usuário e para o worker inteiro. Taxa 0 desativa o balde.
+RATE_LIMIT_USER_RATE = _env_float("SAFECHAT_RATE_LIMIT_USER_RATE", 20)
+RATE_LIMIT_USER_BURST = _env_float("SAFECHAT_RATE_LIMIT_USER_BURST", 60)
+RATE_LIMIT_GLOBAL_RATE = _env_float("SAFECHAT_RATE_LIMIT_GLOBAL_RATE", 0)
+RATE_LIMIT_GLOBAL_BURST = _env_float("SAFECHAT_RATE_LIMIT_GLOBAL_BURST", 500)
+# Sem fichas: "defer" aguarda até RATE_LIMIT_MAX_DEFER_MS antes de rejeitar; "reject" rejeita na hora
+RATE_LIMIT_POLICY = os.environ.get("SAFECHAT_RATE_LIMIT_POLICY", "defer")
+RATE_LIMIT_MAX_DEFER_MS = _env_int("SAFECHAT_RATE_LIMIT_MAX_DEFER_MS", 1000)
+# Quadros recebidos aguardando processamento por conexão; acima disso são rejeitados
+WS_INBOUND_QUEUE_MAX_SIZE = _env_int("SAFECHAT_WS_INBOUND_QUEUE_MAX_SIZE", 32)
+
+# --- Envio de eventos WebSocket ---
+
+# Eventos aguardando envio por conexão antes de aplicar a política de cliente lento
+SEND_QUEUE_MAX_SIZE = _env_int("SAFECHAT_SEND_QUEUE_MAX_SIZE", 256)
+# Política quando a fila de uma conexão está cheia:
+#   "disconnect"  - desconecta o cliente lento (ele pode reconectar e recarregar o histórico)
+#   "drop_oldest" - descarta o evento mais antigo da fila
+#   "drop_newest" - descarta o novo evento
+SEND_QUEUE_POLICY = os.environ.get("SAFECHAT_SEND_QUEUE_POLICY", "disconnect")
+
+# --- Entrega de eventos entre processos ---
+
+# "memory": conexões de um único processo (padrão)
+# "broker": roteia eventos entre vários workers do uvicorn por um broker local (python -m app.broker)
+DELIVERY_BACKEND = os.environ.get("SAFECHAT_DELIVERY_BACKEND", "memory")
+# Socket Unix do broker local
+DELIVERY_BROKER_SOCKET = os.environ.get("SAFECHAT_DELIVERY_BROKER_SOCKET", "/tmp/safechat-broker.sock")
+# Bytes aguardando envio em cada socket do broker (no broker e em cada worker) acima dos quais
+# os eventos são descartados em vez de acumulados em memória; eventos duráveis são guardados
+DELIVERY_BROKER_MAX_BUFFER_BYTES = _env_int("SAFECHAT_DELIVERY_BROKER_MAX_BUFFER_BYTES", 8 * 1024 * 1024)
+
+# --- Logs ---
+
+# Nível dos logs do backend (DEBUG, INFO, WARNING, ERROR)
+LOG_LEVEL = os.environ.get("SAFECHAT_LOG_LEVEL", "INFO")
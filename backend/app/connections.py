@@ -0,0 +1,301 @@
+import asyncio
+import logging
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+from uuid import UUID
+
+from fastapi import WebSocket, status
+
+from . import metrics
+from .delivery import LocalDelivery
+from .pending_deliveries import PendingDeliveryStore
+from .wire import ENCODING_JSON, SUBPROTOCOLS, Frame
+
+logger = logging.getLogger(__name__)
+
+SEND_QUEUE_POLICIES = ("disconnect", "drop_oldest", "drop_newest")
+
+
+class ClientConnection:
+    """
+    Conexão WebSocket de um usuário, com fila de saída limitada e uma tarefa de envio
+    dedicada: quem envia apenas enfileira, e um cliente lento não atrasa os demais.
+    `encoding` é a codificação negociada (JSON em quadros de texto ou msgpack em quadros binários).
+
+    Eventos duráveis guardam o Frame original na fila: se forem descartados (drop_oldest) ou
+    ainda não tiverem sido enviados quando a conexão parar, são repassados a `on_lost`.
+    """
+
+    def __init__(
+        self,
+        user_id: UUID,
+        websocket: WebSocket,
+        max_queue_size: int,
+        policy: str,
+        encoding: str = ENCODING_JSON,
+        on_lost: Optional[Callable[[UUID, Frame], None]] = None,
+    ):
+        self.user_id = user_id
+        self.websocket = websocket
+        self.policy = policy
+        self.encoding = encoding
+        self.on_lost = on_lost
+        self.queue: "asyncio.Queue[Tuple[float, Union[str, bytes], Optional[Frame]]]" = asyncio.Queue(
+            maxsize=max_queue_size
+        )
+        self.writer_task: Optional[asyncio.Task] = None
+        self.closed = False
+
+        self.sent = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self.send_seconds_total = 0.0
+        self.send_seconds_max = 0.0
+        self.queue_wait_seconds_total = 0.0
+        self.queue_wait_seconds_max = 0.0
+
+    def start(self, on_failure: Callable[["ClientConnection"], None]) -> None:
+        self.writer_task = asyncio.create_task(self._writer(on_failure))
+
+    def enqueue(self, data: Union[str, bytes], durable: Optional[Frame] = None) -> bool:
+        """
+        Enfileira um evento já serializado, sem bloquear. Retorna False se o evento não
+        foi enfileirado (conexão fechada, ou fila cheia com política "drop_newest"/"disconnect").
+        `durable` é o Frame de um evento durável, devolvido a `on_lost` se ele não for enviado.
+        """
+        if self.closed:
+            return False
+        if self.queue.full():
+            self.dropped += 1
+            if self.policy != "drop_oldest":
+                return False
+            self._lost(self.queue.get_nowait())
+        self.queue.put_nowait((time.perf_counter(), data, durable))
+        self.max_depth = max(self.max_depth, self.queue.qsize())
+        return True
+
+    async def put(self, data: Union[str, bytes]) -> bool:
+        """Enfileira aguardando espaço na fila (para reposições, que não devem ser descartadas)."""
+        if self.closed:
+            return False
+        await self.queue.put((time.perf_counter(), data, None))
+        self.max_depth = max(self.max_depth, self.queue.qsize())
+        return True
+
+    async def _writer(self, on_failure: Callable[["ClientConnection"], None]) -> None:
+        try:
+            while True:
+                enqueued_at, data, _ = await self.queue.get()
+                started = time.perf_counter()
+                if isinstance(data, bytes):
+                    await self.websocket.send_bytes(data)
+                else:
+                    await self.websocket.send_text(data)
+                finished = time.perf_counter()
+
+                self.sent += 1
+                send_seconds = finished - started
+                queue_wait_seconds = started - enqueued_at
+                self.send_seconds_total += send_seconds
+                self.send_seconds_max = max(self.send_seconds_max, send_seconds)
+                self.queue_wait_seconds_total += queue_wait_seconds
+                self.queue_wait_seconds_max = max(self.queue_wait_seconds_max, queue_wait_seconds)
+                metrics.WS_SEND_SECONDS.labels("queue_wait").observe(queue_wait_seconds)
+                metrics.WS_SEND_SECONDS.labels("send").observe(send_seconds)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("Erro ao enviar para %s: %s", self.user_id, e)
+            on_failure(self)
+
+    def _lost(self, item: Tuple[float, Union[str, bytes], Optional[Frame]]) -> None:
+        durable = item[2]
+        if durable is not None and self.on_lost is not None:
+            self.on_lost(self.user_id, durable)
+
+    def stop(self) -> None:
+        """Para a tarefa de envio; eventos ainda na fila são descartados (os duráveis vão para `on_lost`)."""
+        if self.closed:
+            return
+        self.closed = True
+        if self.writer_task is not None and self.writer_task is not asyncio.current_task():
+            self.writer_task.cancel()
+        while not self.queue.empty():
+            self._lost(self.queue.get_nowait())
+
+    async def close(self, code: int = status.WS_1000_NORMAL_CLOSURE, reason: str = "") -> None:
+        """Para a tarefa de envio e fecha o WebSocket (ignorando se já estiver fechado)."""
+        self.stop()
+        try:
+            await self.websocket.close(code=code, reason=reason)
+        except Exception:
+            pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "user_id": str(self.user_id),
+            "encoding": self.encoding,
+            "queue_depth": self.queue.qsize(),
+            "max_queue_depth": self.max_depth,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "avg_send_ms": (self.send_seconds_total / self.sent * 1000) if self.sent else 0.0,
+            "max_send_ms": self.send_seconds_max * 1000,
+            "avg_queue_wait_ms": (self.queue_wait_seconds_total / self.sent * 1000) if self.sent else 0.0,
+            "max_queue_wait_ms": self.queue_wait_seconds_max * 1000,
+        }
+
+
+# Gerenciador de Conexões WebSocket
+class ConnectionManager:
+    """
+    Mantém as conexões WebSocket deste processo. Eventos para usuários sem conexão local
+    são repassados ao backend de entrega (`delivery`), que pode encaminhá-los a outro worker.
+    Eventos duráveis para usuários offline são guardados em `pending` até a reconexão.
+    """
+
+    def __init__(
+        self,
+        max_queue_size: int,
+        policy: str,
+        delivery: Optional[LocalDelivery] = None,
+        pending: Optional[PendingDeliveryStore] = None,
+    ):
+        if policy not in SEND_QUEUE_POLICIES:
+            raise ValueError(f"Política de fila de envio inválida: {policy}")
+        self.max_queue_size = max_queue_size
+        self.policy = policy
+        self.delivery = delivery or LocalDelivery()
+        self.pending = pending
+        self.active_connections: Dict[UUID, ClientConnection] = {}
+        self.evicted = 0
+
+    async def start(self) -> None:
+        await self.delivery.start(self)
+
+    async def stop(self) -> None:
+        await self.delivery.stop()
+
+    async def connect(self, user_id: UUID, websocket: WebSocket, subprotocol: Optional[str] = None):
+        """Aceita o WebSocket com o subprotocolo negociado (define a codificação dos eventos)."""
+        await websocket.accept(subprotocol=subprotocol)
+        previous = self.active_connections.get(user_id)
+        encoding = SUBPROTOCOLS.get(subprotocol, ENCODING_JSON)
+        connection = ClientConnection(
+            user_id, websocket, self.max_queue_size, self.policy, encoding, on_lost=self.store_offline
+        )
+        connection.start(self._on_writer_failure)
+        self.active_connections[user_id] = connection
+        self.delivery.subscribe(user_id)
+        if previous is not None:
+            # O usuário reconectou: a conexão antiga deixa de receber eventos
+            await previous.close()
+        logger.info("WebSocket conectado para o usuário %s", user_id)
+
+    def disconnect(self, user_id: UUID, websocket: Optional[WebSocket] = None):
+        """
+        Remove a conexão do usuário. Se `websocket` for informado, só remove se ainda for a
+        conexão registrada (evita que o fim de uma conexão antiga derrube a nova).
+        """
+        connection = self.active_connections.get(user_id)
+        if connection is None or (websocket is not None and connection.websocket is not websocket):
+            return
+        del self.active_connections[user_id]
+        self.delivery.unsubscribe(user_id)
+        connection.stop()
+        logger.info("WebSocket desconectado para o usuário %s", user_id)
+
+    def _on_writer_failure(self, connection: ClientConnection) -> None:
+        self.disconnect(connection.user_id, connection.websocket)
+
+    def _deliver(self, connection: ClientConnection, frame: Frame, durable: bool = False) -> bool:
+        # O Frame guarda cada codificação gerada: várias conexões reaproveitam a mesma serialização
+        if connection.enqueue(frame.encode(connection.encoding), frame if durable else None):
+            return True
+        if self.policy == "disconnect" and not connection.closed:
+            # Cliente lento: fila de saída cheia. Ele pode reconectar e recarregar o histórico.
+            self.evicted += 1
+            logger.warning("Desconectando %s: fila de envio cheia (%d eventos)", connection.user_id, self.max_queue_size)
+            self.disconnect(connection.user_id, connection.websocket)
+            asyncio.ensure_future(connection.close(
+                code=status.WS_1013_TRY_AGAIN_LATER, reason="Fila de envio cheia"
+            ))
+        # Guardado depois dos duráveis que estavam na fila da conexão, preservando a ordem
+        if durable:
+            self.store_offline(connection.user_id, frame)
+        return False
+
+    def deliver_local(self, recipient_id: UUID, frame: Frame, durable: bool = False) -> bool:
+        """
+        Enfileira um evento para um usuário conectado neste processo. Com `durable`, um evento
+        que não pôde ser enfileirado (ou o usuário já desconectou) é guardado para a reconexão.
+        """
+        connection = self.active_connections.get(recipient_id)
+        if connection is None:
+            if durable:
+                self.store_offline(recipient_id, frame)
+            return False
+        return self._deliver(connection, frame, durable)
+
+    def broadcast_local(self, frame: Frame) -> None:
+        """Enfileira um evento para todas as conexões deste processo."""
+        for connection in list(self.active_connections.values()):
+            self._deliver(connection, frame)
+
+    async def send_personal_message(
+        self, message: Union[str, dict, Frame], recipient_id: UUID, durable: bool = False
+    ) -> bool:
+        """
+        Enfileira a mensagem para o destinatário, sem aguardar o envio. Para enviar o mesmo
+        evento a vários destinatários, passe um Frame: ele é serializado uma única vez.
+        Com `durable`, se o destinatário estiver offline (ou a fila dele estiver cheia) o evento
+        é guardado para a reconexão.
+        """
+        frame = message if isinstance(message, Frame) else Frame(message)
+        if recipient_id in self.active_connections:
+            return self.deliver_local(recipient_id, frame, durable)
+        # Sem conexão neste processo: o backend de entrega decide (outro worker ou offline)
+        if await self.delivery.route(recipient_id, frame, durable):
+            return True
+        if durable:
+            self.store_offline(recipient_id, frame)
+        return False
+
+    def store_offline(self, recipient_id: UUID, frame: Frame) -> None:
+        """Guarda um evento para um destinatário que não está conectado em nenhum worker."""
+        if self.pending is not None:
+            self.pending.store(recipient_id, frame)
+
+    async def replay_pending(self, user_id: UUID, last_seq: int) -> None:
+        """
+        Confirma os eventos até `last_seq` e envia os pendentes posteriores à conexão do
+        usuário, em lotes, aguardando espaço na fila de envio (sem descartar eventos).
+        """
+        if self.pending is None:
+            return
+        if last_seq > 0:
+            await self.pending.ack(user_id, last_seq)
+        async for _, frame in self.pending.replay(user_id, last_seq):
+            connection = self.active_connections.get(user_id)
+            if connection is None or not await connection.put(frame.encode(connection.encoding)):
+                return
+
+    async def broadcast(self, message: Union[dict, Frame]):
+        # Serializa uma única vez (por codificação) e enfileira para todas as conexões,
+        # locais e de outros workers
+        frame = message if isinstance(message, Frame) else Frame(message)
+        self.broadcast_local(frame)
+        await self.delivery.publish_broadcast(frame)
+
+    def stats(self) -> Dict[str, Any]:
+        connections: List[Dict[str, Any]] = [c.stats() for c in self.active_connections.values()]
+        return {
+            "active_connections": len(connections),
+            "max_queue_size": self.max_queue_size,
+            "policy": self.policy,
+            "evicted": self.evicted,
+            "total_queue_depth": sum(c["queue_depth"] for c in connections),
+            "dropped": sum(c["dropped"] for c in connections),
+            "delivery": self.delivery.stats(),
+            "connections": connections,
+        }
@@ -1,66 +1,180 @@
+import uuid
 from uuid import UUID
-from sqlalchemy.orm import Session
-from sqlalchemy import or_ # Para consultas com OR
+from sqlalchemy import Select, String, and_, case, literal_column, or_, select, type_coerce, update
+from sqlalchemy.dialects.sqlite import Insert, insert as sqlite_insert
 from . import models, schemas
-from typing import List, Tuple
-
-# --- Operações de Usuário ---
-
-def get_user_by_username(db: Session, username: str):
-    """Busca um usuário pelo nome de usuário."""
-    return db.query(models.User).filter(models.User.username == username).first()
-
-def get_user_by_id(db: Session, user_id: UUID):
-    """Busca um usuário pelo ID."""
-    return db.query(models.User).filter(models.User.id == user_id.bytes).first()
-
-def get_all_users_for_list(db: Session) -> List[schemas.UserInList]:
-    """Retorna todos os usuários com seus IDs, usernames e chaves públicas."""
-    users = db.query(models.User).all()
-    return [schemas.UserInList(id=UUID(bytes=u.id), username=u.username, public_key=u.public_key) for u in users if u.public_key]
-
-def create_user(db: Session, user_data: schemas.UserCreate, public_key_pem: str, private_key_pem_encrypted: str):
-    """Cria um novo usuário, salvando suas chaves."""
-    db_user = models.User(
-        username=user_data.username,
-        password=user_data.password, # Lembre-se de HASHEAR em prod!
-        public_key=public_key_pem,
-        private_key_encrypted=private_key_pem_encrypted # EM PROD: CRIPTOGRAFE ISSO DE VERDADE!
-    )
-    db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
-    return db_user
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# Consultas e valores compartilhados pelas operações assíncronas (crud_async), pela escrita
+# de mensagens em lote (message_writer) e pelas ferramentas de benchmark.
 
 # --- Operações de Mensagem ---
 
-def create_message(db: Session, message: schemas.MessageEncryptedIn):
-    """Cria e salva uma nova mensagem cifrada no banco de dados."""
-    db_message = models.Message(
-        encrypted_content=message.encrypted_content,
-        message_hash=message.message_hash,
-        sender_id=message.sender_id.bytes,
-        recipient_id=message.recipient_id.bytes
+def build_message_values(message: schemas.MessageEncryptedIn) -> Dict[str, Any]:
+    """
+    Monta os valores de uma nova linha de mensagem, com ID e data de criação gerados
+    na aplicação: assim nenhum SELECT (refresh) é necessário depois do INSERT.
+    """
+    return {
+        "id": uuid.uuid4().bytes,
+        "encrypted_content": message.encrypted_content,
+        "message_hash": message.message_hash or b"",
+        "scheme": message.scheme,
+        "wrapped_key": message.wrapped_key,
+        "nonce": message.nonce,
+        "created_at": models.utc_now(),
+        "sender_id": message.sender_id.bytes,
+        "recipient_id": message.recipient_id.bytes,
+        "conversation_key": models.conversation_key_for(message.sender_id.bytes, message.recipient_id.bytes),
+    }
+
+# Data de criação comparada como o texto armazenado no SQLite: registros gravados com
+# CURRENT_TIMESTAMP não têm microssegundos, e converter para datetime e de volta
+# alteraria o valor comparado (quebrando a paginação entre mensagens do mesmo segundo).
+_created_at_raw = type_coerce(models.Message.created_at, String)
+
+# Desempate entre mensagens com a mesma data de criação (registros antigos só têm a precisão
+# de segundos): o rowid do SQLite segue a ordem de inserção, enquanto o `id` é um UUID
+# aleatório. Todo índice do SQLite termina implicitamente no rowid, então a ordenação
+# (created_at, rowid) usa o índice (conversation_key, created_at) sem ordenação extra.
+_message_rowid = literal_column("messages.rowid")
+
+# Posição de uma mensagem na ordenação do histórico: (created_at bruto, rowid)
+MessageCursor = Tuple[str, int]
+
+def message_cursor_select(user1_id: UUID, user2_id: UUID, message_id: UUID) -> Select:
+    """Consulta da posição de uma mensagem da conversa (compartilhada com crud_async)."""
+    return select(_created_at_raw, _message_rowid)\
+             .where(
+                 models.Message.id == message_id.bytes,
+                 models.Message.conversation_key == models.conversation_key_for(user1_id.bytes, user2_id.bytes)
+             )
+
+def conversation_select(
+    user1_id: UUID,
+    user2_id: UUID,
+    before: Optional[MessageCursor] = None,
+    after: Optional[MessageCursor] = None,
+    limit: Optional[int] = None,
+) -> Tuple[Select, bool]:
+    """
+    Monta a consulta paginada de uma conversa (compartilhada com crud_async).
+    Retorna a consulta e se o resultado vem em ordem decrescente e precisa ser invertido.
+    """
+    # Todas as mensagens da conversa, nos dois sentidos, compartilham a mesma chave canônica,
+    # o que permite usar o índice (conversation_key, created_at)
+    stmt = select(models.Message)\
+             .where(models.Message.conversation_key == models.conversation_key_for(user1_id.bytes, user2_id.bytes))
+
+    if before is not None:
+        stmt = stmt.where(or_(
+            _created_at_raw < before[0],
+            and_(_created_at_raw == before[0], _message_rowid < before[1])
+        ))
+    if after is not None:
+        stmt = stmt.where(or_(
+            _created_at_raw > after[0],
+            and_(_created_at_raw == after[0], _message_rowid > after[1])
+        ))
+
+    if limit is not None and after is None:
+        # Página mais recente: percorre o índice de trás para frente (o chamador reordena)
+        stmt = stmt.order_by(models.Message.created_at.desc(), _message_rowid.desc()).limit(limit)
+        return stmt, True
+
+    stmt = stmt.order_by(models.Message.created_at, _message_rowid)
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    return stmt, False
+
+def recent_senders_select(scan: int) -> Select:
+    """Remetentes das `scan` mensagens gravadas por último (ordem de inserção, pelo rowid)."""
+    return select(models.Message.sender_id).order_by(_message_rowid.desc()).limit(scan)
+
+# --- Operações de Resumo de Conversas (caixa de entrada) ---
+
+def conversation_updates(rows: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Agrega as mensagens novas (valores de build_message_values) em uma atualização por
+    (usuário, contato): cada mensagem conta nos dois lados da conversa, mas só fica
+    como não lida para o destinatário.
+    """
+    updates: Dict[Tuple[bytes, bytes], Dict[str, Any]] = {}
+
+    def add(user_id: bytes, peer_id: bytes, row: Dict[str, Any], unread: int) -> None:
+        entry = updates.get((user_id, peer_id))
+        if entry is None:
+            entry = updates[(user_id, peer_id)] = {
+                "user_id": user_id,
+                "peer_id": peer_id,
+                "last_message_id": row["id"],
+                "last_message_at": row["created_at"],
+                "message_count": 0,
+                "unread_count": 0,
+            }
+        elif row["created_at"] >= entry["last_message_at"]:
+            entry["last_message_id"] = row["id"]
+            entry["last_message_at"] = row["created_at"]
+        entry["message_count"] += 1
+        entry["unread_count"] += unread
+
+    for row in rows:
+        add(row["sender_id"], row["recipient_id"], row, 0)
+        if row["recipient_id"] != row["sender_id"]:
+            add(row["recipient_id"], row["sender_id"], row, 1)
+    return list(updates.values())
+
+def conversation_upsert() -> Insert:
+    """
+    INSERT ... ON CONFLICT que soma os contadores de conversation_updates aos existentes
+    (compartilhado com crud_async). A última mensagem só é substituída por uma mais recente.
+    """
+    table = models.Conversation.__table__
+    stmt = sqlite_insert(table)
+    is_newer = stmt.excluded.last_message_at >= table.c.last_message_at
+    return stmt.on_conflict_do_update(
+        index_elements=[table.c.user_id, table.c.peer_id],
+        set_={
+            "message_count": table.c.message_count + stmt.excluded.message_count,
+            "unread_count": table.c.unread_count + stmt.excluded.unread_count,
+            "last_message_id": case((is_newer, stmt.excluded.last_message_id), else_=table.c.last_message_id),
+            "last_message_at": case((is_newer, stmt.excluded.last_message_at), else_=table.c.last_message_at),
+        },
     )
-    db.add(db_message)
-    db.commit()
-    db.refresh(db_message)
-    return db_message
 
-def get_messages_between_users(db: Session, user1_id: UUID, user2_id: UUID) -> List[models.Message]:
+# Mesma comparação textual de _created_at_raw, aplicada à data da última mensagem
+_last_message_at_raw = type_coerce(models.Conversation.last_message_at, String)
+
+# Posição de uma conversa na caixa de entrada: (last_message_at bruto, peer_id)
+InboxCursor = Tuple[str, bytes]
+
+def inbox_cursor_select(user_id: UUID, peer_id: UUID) -> Select:
+    """Consulta da posição de uma conversa na caixa de entrada (compartilhada com crud_async)."""
+    return select(_last_message_at_raw, models.Conversation.peer_id)\
+             .where(
+                 models.Conversation.user_id == user_id.bytes,
+                 models.Conversation.peer_id == peer_id.bytes
+             )
+
+def inbox_select(user_id: UUID, before: Optional[InboxCursor], limit: int) -> Select:
     """
-    Busca mensagens trocadas entre dois usuários específicos.
-    Assume que as mensagens são armazenadas independentemente da direção.
+    Página da caixa de entrada de um usuário, da conversa mais recente para a mais antiga,
+    usando o índice (user_id, last_message_at, peer_id). `before` é a posição da última
+    conversa da página anterior.
     """
-    # Consulta mensagens onde user1 é remetente E user2 é destinatário
-    # OU user2 é remetente E user1 é destinatário
-    messages = db.query(models.Message)\
-                 .filter(
-                     or_(
-                         (models.Message.sender_id == user1_id.bytes) & (models.Message.recipient_id == user2_id.bytes),
-                         (models.Message.sender_id == user2_id.bytes) & (models.Message.recipient_id == user1_id.bytes)
-                     )
-                 )\
-                 .order_by(models.Message.created_at)\
-                 .all()
-    return messages
\ No newline at end of file
+    stmt = select(models.Conversation).where(models.Conversation.user_id == user_id.bytes)
+    if before is not None:
+        stmt = stmt.where(or_(
+            _last_message_at_raw < before[0],
+            and_(_last_message_at_raw == before[0], models.Conversation.peer_id < before[1])
+        ))
+    return stmt.order_by(models.Conversation.last_message_at.desc(), models.Conversation.peer_id.desc()).limit(limit)
+
+def mark_conversation_read_update(user_id: UUID, peer_id: UUID):
+    """Zera o contador de não lidas de user_id na conversa com peer_id (compartilhado com crud_async)."""
+    return update(models.Conversation)\
+             .where(
+                 models.Conversation.user_id == user_id.bytes,
+                 models.Conversation.peer_id == peer_id.bytes
+             )\
+             .values(unread_count=0)
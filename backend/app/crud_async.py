@@ -0,0 +1,214 @@
+from datetime import datetime
+from uuid import UUID
+from sqlalchemy import delete, insert, literal_column, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Sequence
+
+from . import models, schemas
+from .crud import (
+    InboxCursor,
+    MessageCursor,
+    build_message_values,
+    conversation_select,
+    conversation_updates,
+    conversation_upsert,
+    inbox_cursor_select,
+    inbox_select,
+    mark_conversation_read_update,
+    message_cursor_select,
+    recent_senders_select,
+)
+
+# Operações com o banco (a partir das consultas compartilhadas de crud.py), usadas pelos
+# endpoints FastAPI e pelo WebSocket para que a espera pelo banco não bloqueie as demais conexões.
+
+# --- Operações de Usuário ---
+
+async def get_user_by_username(db: AsyncSession, username: str) -> Optional[models.User]:
+    """Busca um usuário pelo nome de usuário."""
+    result = await db.execute(select(models.User).where(models.User.username == username))
+    return result.scalars().first()
+
+async def get_user_by_id(db: AsyncSession, user_id: UUID) -> Optional[models.User]:
+    """Busca um usuário pelo ID."""
+    return await db.get(models.User, user_id.bytes)
+
+async def get_users_by_ids(db: AsyncSession, user_ids: Iterable[UUID]) -> Dict[bytes, models.User]:
+    """Busca vários usuários em uma única consulta, indexados pelo ID (bytes)."""
+    ids = {user_id.bytes for user_id in user_ids}
+    if not ids:
+        return {}
+    result = await db.execute(select(models.User).where(models.User.id.in_(ids)))
+    return {u.id: u for u in result.scalars().all()}
+
+async def get_users_added_after(db: AsyncSession, after_rowid: int) -> List[Any]:
+    """
+    Retorna (rowid, id, username, public_key) dos usuários com chave pública inseridos depois
+    de `after_rowid`, em ordem de inserção. O rowid do SQLite só cresce (usuários não são
+    removidos), servindo como versão do diretório de usuários.
+    """
+    result = await db.execute(
+        select(
+            literal_column("users.rowid").label("rowid"),
+            models.User.id,
+            models.User.username,
+            models.User.public_key,
+        )
+        .where(literal_column("users.rowid") > after_rowid, models.User.public_key.is_not(None))
+        .order_by(literal_column("users.rowid"))
+    )
+    return result.all()
+
+async def create_user(db: AsyncSession, user_data: schemas.UserCreate, public_key_pem: bytes, private_key_pem_encrypted: bytes) -> models.User:
+    """Cria um novo usuário, salvando suas chaves."""
+    db_user = models.User(
+        username=user_data.username,
+        password=user_data.password, # Lembre-se de HASHEAR em prod!
+        public_key=public_key_pem,
+        private_key_encrypted=private_key_pem_encrypted # EM PROD: CRIPTOGRAFE ISSO DE VERDADE!
+    )
+    db.add(db_user)
+    await db.commit()
+    await db.refresh(db_user)
+    return db_user
+
+# --- Operações de Mensagem ---
+
+async def create_message(db: AsyncSession, message: schemas.MessageEncryptedIn) -> models.Message:
+    """Cria e salva uma nova mensagem cifrada no banco de dados (e atualiza o resumo da conversa)."""
+    values = build_message_values(message)
+    db_message = models.Message(**values)
+    db.add(db_message)
+    await db.execute(conversation_upsert(), conversation_updates([values]))
+    await db.commit()
+    return db_message
+
+async def insert_messages(db: AsyncSession, rows: Sequence[Dict[str, Any]]) -> None:
+    """
+    Insere várias mensagens (valores de crud.build_message_values) em um único comando,
+    sem commit: a transação é controlada pelo chamador. Os resumos das conversas
+    afetadas são atualizados na mesma transação.
+    """
+    if rows:
+        await db.execute(insert(models.Message), list(rows))
+        await db.execute(conversation_upsert(), conversation_updates(rows))
+
+async def get_message_cursor(db: AsyncSession, user1_id: UUID, user2_id: UUID, message_id: UUID) -> Optional[MessageCursor]:
+    """Retorna a posição de uma mensagem da conversa, para uso como cursor de paginação."""
+    row = (await db.execute(message_cursor_select(user1_id, user2_id, message_id))).first()
+    return (row[0], row[1]) if row else None
+
+async def get_messages_between_users(
+    db: AsyncSession,
+    user1_id: UUID,
+    user2_id: UUID,
+    before: Optional[MessageCursor] = None,
+    after: Optional[MessageCursor] = None,
+    limit: Optional[int] = None,
+) -> List[models.Message]:
+    """Busca mensagens trocadas entre dois usuários, em ordem cronológica (ver crud.get_messages_between_users)."""
+    stmt, reversed_order = conversation_select(user1_id, user2_id, before=before, after=after, limit=limit)
+    messages = list((await db.execute(stmt)).scalars().all())
+    if reversed_order:
+        messages.reverse()
+    return messages
+
+async def iter_messages_between_users(
+    db: AsyncSession,
+    user1_id: UUID,
+    user2_id: UUID,
+    batch_size: int,
+    before: Optional[MessageCursor] = None,
+    after: Optional[MessageCursor] = None,
+) -> AsyncIterator[List[models.Message]]:
+    """
+    Percorre as mensagens de uma conversa em ordem cronológica, em lotes de `batch_size`,
+    sem carregar a conversa inteira em memória (yield_per + cursor do servidor).
+    """
+    stmt, _ = conversation_select(user1_id, user2_id, before=before, after=after)
+    result = await db.stream_scalars(stmt.execution_options(yield_per=batch_size))
+    async for batch in result.partitions(batch_size):
+        yield list(batch)
+
+async def get_recent_sender_ids(db: AsyncSession, limit: int, scan: int) -> List[bytes]:
+    """Até `limit` remetentes distintos (IDs em bytes) entre as `scan` mensagens mais recentes."""
+    senders = (await db.execute(recent_senders_select(scan))).scalars().all()
+    return list(dict.fromkeys(senders))[:limit]
+
+# --- Operações de Resumo de Conversas (caixa de entrada) ---
+
+async def get_inbox_cursor(db: AsyncSession, user_id: UUID, peer_id: UUID) -> Optional[InboxCursor]:
+    """Retorna a posição da conversa com peer_id na caixa de entrada, para uso como cursor."""
+    row = (await db.execute(inbox_cursor_select(user_id, peer_id))).first()
+    return (row[0], row[1]) if row else None
+
+async def get_inbox(db: AsyncSession, user_id: UUID, before: Optional[InboxCursor], limit: int) -> List[models.Conversation]:
+    """Página da caixa de entrada (ver crud.inbox_select), lida apenas da tabela de resumos."""
+    return list((await db.execute(inbox_select(user_id, before, limit))).scalars().all())
+
+async def mark_conversation_read(db: AsyncSession, user_id: UUID, peer_id: UUID) -> bool:
+    """Zera as não lidas de user_id na conversa com peer_id. Retorna se a conversa existe."""
+    result = await db.execute(mark_conversation_read_update(user_id, peer_id))
+    await db.commit()
+    return result.rowcount > 0
+
+# --- Operações de Entregas Pendentes (destinatários offline) ---
+
+async def insert_pending_deliveries(db: AsyncSession, rows: Sequence[Dict[str, Any]]) -> None:
+    """Insere vários eventos pendentes (recipient_id, event, created_at), sem commit."""
+    if rows:
+        await db.execute(insert(models.PendingDelivery), list(rows))
+
+async def get_pending_deliveries(db: AsyncSession, recipient_id: UUID, after_seq: int, limit: int) -> List[Any]:
+    """Retorna (seq, event) dos eventos pendentes do destinatário com seq > after_seq, em ordem."""
+    result = await db.execute(
+        select(models.PendingDelivery.seq, models.PendingDelivery.event)
+        .where(models.PendingDelivery.recipient_id == recipient_id.bytes, models.PendingDelivery.seq > after_seq)
+        .order_by(models.PendingDelivery.seq)
+        .limit(limit)
+    )
+    return result.all()
+
+async def delete_pending_deliveries(db: AsyncSession, recipient_id: UUID, up_to_seq: int) -> int:
+    """Remove os eventos confirmados (seq <= up_to_seq) do destinatário, sem commit."""
+    result = await db.execute(
+        delete(models.PendingDelivery)
+        .where(models.PendingDelivery.recipient_id == recipient_id.bytes, models.PendingDelivery.seq <= up_to_seq)
+    )
+    return result.rowcount
+
+async def prune_pending_deliveries(
+    db: AsyncSession, recipient_id: UUID, keep: int, expired_before: Optional[datetime]
+) -> int:
+    """
+    Aplica os limites de retenção aos eventos do destinatário, sem commit: remove os criados
+    antes de `expired_before` e mantém apenas os `keep` mais recentes (0 desativa cada limite).
+    """
+    pending = models.PendingDelivery
+    deleted = 0
+    if expired_before is not None:
+        result = await db.execute(
+            delete(pending).where(pending.recipient_id == recipient_id.bytes, pending.created_at < expired_before)
+        )
+        deleted += result.rowcount
+    if keep > 0:
+        cutoff = await db.scalar(
+            select(pending.seq)
+            .where(pending.recipient_id == recipient_id.bytes)
+            .order_by(pending.seq.desc())
+            .offset(keep)
+            .limit(1)
+        )
+        if cutoff is not None:
+            result = await db.execute(
+                delete(pending).where(pending.recipient_id == recipient_id.bytes, pending.seq <= cutoff)
+            )
+            deleted += result.rowcount
+    return deleted
+
+async def delete_expired_pending_deliveries(db: AsyncSession, expired_before: datetime) -> int:
+    """Remove os eventos de todos os destinatários criados antes de `expired_before`, sem commit."""
+    result = await db.execute(
+        delete(models.PendingDelivery).where(models.PendingDelivery.created_at < expired_before)
+    )
+    return result.rowcount
@@ -0,0 +1,270 @@
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from uuid import UUID
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.asymmetric import rsa, padding
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.backends import default_backend
+
+import hashlib 
+import time
+
+from . import config
+from .key_cache import PrivateKeyCache, SessionKeyCache
+
+# Este módulo concentra as operações criptográficas do backend e não depende da
+# aplicação FastAPI, para que possa ser importado pelos processos do pool de
+# criptografia (ver crypto_pool.py).
+
+# Esquemas de cifragem do conteúdo das mensagens:
+#   "rsa-oaep" - o corpo inteiro é cifrado com RSA-OAEP-SHA256 e a integridade é verificada
+#                pelo hash SHA256 enviado junto (formato original; máx. ~190 bytes de texto)
+#   "aes-gcm"  - envelope híbrido: o corpo é cifrado com AES-GCM e apenas a chave simétrica
+#                (de sessão ou por mensagem) é embrulhada com RSA-OAEP-SHA256. A tag do GCM
+#                garante a integridade, substituindo o hash.
+SCHEME_RSA_OAEP = "rsa-oaep"
+SCHEME_AES_GCM = "aes-gcm"
+MESSAGE_SCHEMES = (SCHEME_RSA_OAEP, SCHEME_AES_GCM)
+
+# --- Funções de Criptografia e Geração de Chaves (Backend-side) ---
+
+def store_private_key_as_is(private_key_der: bytes) -> bytes:
+    """
+    Simplesmente retorna a chave privada (DER) para armazenamento.
+    NÃO HÁ CRIPTOGRAFIA DE PROTEÇÃO AQUI.
+    """
+    return private_key_der
+
+def retrieve_private_key_as_obj(private_key_der: bytes) -> rsa.RSAPrivateKey:
+    """
+    Carrega a chave privada (DER, como guardada no banco) e retorna o objeto RSA PrivateKey.
+    """
+    return serialization.load_der_private_key( 
+        private_key_der, 
+        password=None, 
+        backend=default_backend()
+    )
+
+
+# Cache dos objetos de chave privada já carregados, por ID de usuário.
+# Evita repetir load_der_private_key a cada mensagem.
+# Com o pool de processos, cada processo de trabalho mantém o seu próprio cache.
+private_key_cache: PrivateKeyCache[rsa.RSAPrivateKey] = PrivateKeyCache(
+    loader=retrieve_private_key_as_obj,
+    max_entries=config.KEY_CACHE_MAX_ENTRIES,
+    max_bytes=config.KEY_CACHE_MAX_BYTES,
+    ttl_seconds=config.KEY_CACHE_TTL_SECONDS,
+)
+
+
+def generate_rsa_key_pair() -> Tuple[bytes, bytes]:
+    """Gera um par de chaves RSA e retorna em formato DER (SPKI para pública, PKCS8 para privada)."""
+    private_key = rsa.generate_private_key(
+        public_exponent=65537,
+        key_size=2048,
+        backend=default_backend()
+    )
+    public_key = private_key.public_key()
+
+    # Serializa para formato DER (binário)
+    private_der_bytes = private_key.private_bytes(
+        encoding=serialization.Encoding.DER, # DER é o formato binário
+        format=serialization.PrivateFormat.PKCS8,
+        encryption_algorithm=serialization.NoEncryption()
+    )
+
+    public_der_bytes = public_key.public_bytes(
+        encoding=serialization.Encoding.DER, # DER é o formato binário
+        format=serialization.PublicFormat.SubjectPublicKeyInfo
+    )
+
+    return public_der_bytes, private_der_bytes
+
+
+def rsa_unwrap_backend(encrypted_data: bytes, private_key_obj: rsa.RSAPrivateKey) -> bytes:
+    """
+    Descriptografa dados com o OBJETO da chave privada RSA (no backend) e retorna os bytes.
+    O padding é OAEP para corresponder ao que o frontend (Web Crypto API) usa para criptografia.
+    """
+    return private_key_obj.decrypt( # Usa o objeto de chave, não o formato PEM ou HEX
+        encrypted_data,
+        padding.OAEP(
+            mgf=padding.MGF1(algorithm=hashes.SHA256()),
+            algorithm=hashes.SHA256(),
+            label=None
+        )
+    )
+
+
+def rsa_decrypt_backend(encrypted_data: bytes, private_key_obj: rsa.RSAPrivateKey) -> str:
+    """Descriptografa um texto cifrado com RSA-OAEP (esquema "rsa-oaep")."""
+    return rsa_unwrap_backend(encrypted_data, private_key_obj).decode('utf-8')
+
+
+# Cache das chaves de sessão AES já desembrulhadas, por (remetente, chave embrulhada).
+# Assim como o cache de chaves privadas, é mantido por processo.
+session_key_cache = SessionKeyCache(
+    max_entries=config.SESSION_KEY_CACHE_MAX_ENTRIES,
+    ttl_seconds=config.SESSION_KEY_CACHE_TTL_SECONDS,
+)
+
+
+def message_associated_data(sender_id: UUID, recipient_id: UUID) -> bytes:
+    """
+    Dados associados (AAD) do AES-GCM: IDs do remetente e do destinatário (16 bytes cada).
+    Impedem que um corpo cifrado seja reaproveitado em outra conversa.
+    """
+    return sender_id.bytes + recipient_id.bytes
+
+
+def aes_gcm_decrypt_backend(
+    sender_id: UUID,
+    private_key_der: bytes,
+    wrapped_key: bytes,
+    nonce: bytes,
+    encrypted_data: bytes,
+    associated_data: bytes,
+) -> Optional[str]:
+    """
+    Descriptografa uma mensagem do esquema "aes-gcm". A chave de sessão é desembrulhada com a
+    chave privada do remetente apenas se ainda não estiver no cache.
+    Retorna None se a tag do GCM não conferir (mensagem adulterada ou chave errada).
+    """
+    session_key = session_key_cache.get(sender_id, wrapped_key)
+    if session_key is None:
+        private_key_obj = private_key_cache.get(sender_id, private_key_der)
+        session_key = rsa_unwrap_backend(wrapped_key, private_key_obj)
+        session_key_cache.put(sender_id, wrapped_key, session_key)
+    try:
+        plaintext = AESGCM(session_key).decrypt(nonce, encrypted_data, associated_data)
+    except InvalidTag:
+        return None
+    return plaintext.decode('utf-8')
+
+
+def sha256_digest_backend(data: str) -> bytes:
+    """Gera o hash SHA256 de uma string (no backend), em bytes (como guardado no banco)."""
+    return hashlib.sha256(data.encode('utf-8')).digest()
+
+
+class DecryptItem(NamedTuple):
+    """Mensagem a descriptografar. Os campos opcionais só são usados pelo esquema "aes-gcm"."""
+    sender_id: UUID
+    private_key_der: bytes
+    encrypted_content: bytes
+    message_hash: Optional[bytes]
+    scheme: Optional[str] = None
+    wrapped_key: Optional[bytes] = None
+    nonce: Optional[bytes] = None
+    recipient_id: Optional[UUID] = None
+
+
+# Etapas medidas por decrypt_and_verify_timed (no esquema "aes-gcm", o desembrulho da
+# chave de sessão e a verificação da tag fazem parte da etapa "decrypt")
+STAGE_KEY_LOAD = "key_load"
+STAGE_DECRYPT = "decrypt"
+STAGE_HASH_CHECK = "hash_check"
+
+
+def decrypt_and_verify_timed(
+    sender_id: UUID,
+    private_key_der: bytes,
+    encrypted_content: bytes,
+    message_hash: Optional[bytes],
+    scheme: Optional[str] = None,
+    wrapped_key: Optional[bytes] = None,
+    nonce: Optional[bytes] = None,
+    recipient_id: Optional[UUID] = None,
+) -> Tuple[Optional[str], bool, Dict[str, float]]:
+    """
+    Igual a decrypt_and_verify, retornando também a duração (segundos) de cada etapa.
+    As durações são medidas onde a criptografia executa (inclusive em um processo do pool)
+    e registradas nas métricas pelo chamador.
+    """
+    if scheme == SCHEME_AES_GCM:
+        started = time.perf_counter()
+        content = aes_gcm_decrypt_backend(
+            sender_id,
+            private_key_der,
+            wrapped_key,
+            nonce,
+            encrypted_content,
+            message_associated_data(sender_id, recipient_id),
+        )
+        return content, content is not None, {STAGE_DECRYPT: time.perf_counter() - started}
+
+    started = time.perf_counter()
+    # Obtém o objeto da chave privada (do cache, ou carregado do DER salvo no DB)
+    private_key_obj = private_key_cache.get(sender_id, private_key_der)
+    key_loaded = time.perf_counter()
+
+    # Descriptografa o conteúdo da mensagem com a CHAVE PRIVADA DO REMETENTE
+    decrypted_content = rsa_decrypt_backend(encrypted_content, private_key_obj)
+    decrypted = time.perf_counter()
+
+    # Verifica a integridade (hash)
+    calculated_hash = sha256_digest_backend(decrypted_content)
+    timings = {
+        STAGE_KEY_LOAD: key_loaded - started,
+        STAGE_DECRYPT: decrypted - key_loaded,
+        STAGE_HASH_CHECK: time.perf_counter() - decrypted,
+    }
+    return decrypted_content, calculated_hash == message_hash, timings
+
+
+def decrypt_and_verify(
+    sender_id: UUID,
+    private_key_der: bytes,
+    encrypted_content: bytes,
+    message_hash: Optional[bytes],
+    scheme: Optional[str] = None,
+    wrapped_key: Optional[bytes] = None,
+    nonce: Optional[bytes] = None,
+    recipient_id: Optional[UUID] = None,
+) -> Tuple[Optional[str], bool]:
+    """
+    Descriptografa uma mensagem com a chave privada do remetente e verifica sua integridade.
+    Retorna o conteúdo em texto claro e se a integridade foi confirmada; no esquema "aes-gcm"
+    o conteúdo é None quando a tag não confere (não há texto claro confiável).
+    Mensagens sem esquema (gravadas antes do envelope AES-GCM) usam "rsa-oaep".
+    """
+    content, is_integrity_valid, _ = decrypt_and_verify_timed(
+        sender_id, private_key_der, encrypted_content, message_hash, scheme, wrapped_key, nonce, recipient_id
+    )
+    return content, is_integrity_valid
+
+
+# Resultado de um item: (conteúdo em claro ou None, integridade válida, mensagem de erro ou None)
+DecryptResult = Tuple[Optional[str], bool, Optional[str]]
+
+
+def decrypt_and_verify_chunk(items: List[DecryptItem]) -> List[DecryptResult]:
+    """
+    Descriptografa um lote de mensagens, capturando o erro de cada item individualmente
+    para que uma mensagem corrompida não invalide o lote inteiro.
+    """
+    results: List[DecryptResult] = []
+    for item in items:
+        try:
+            content, is_integrity_valid = decrypt_and_verify(*item)
+            results.append((content, is_integrity_valid, None))
+        except Exception as e:
+            # Retorna o erro como texto: exceções nem sempre podem ser serializadas entre processos
+            results.append((None, False, str(e) or type(e).__name__))
+    return results
+
+
+def preload_private_keys_chunk(items: List[Tuple[UUID, bytes]]) -> List[bool]:
+    """
+    Carrega no cache as chaves privadas (ID do usuário, DER) de um lote, no aquecimento.
+    Com o pool de processos, as chaves ficam no cache do processo que executou o lote.
+    """
+    results = []
+    for user_id, private_key_der in items:
+        try:
+            private_key_cache.get(user_id, private_key_der)
+            results.append(True)
+        except Exception:
+            # Chave corrompida: o erro aparece quando uma mensagem do usuário for processada
+            results.append(False)
+    return results
@@ -0,0 +1,104 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Sequence, TypeVar
+
+from . import config
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class CryptoExecutor:
+    """
+    Executa as operações criptográficas (RSA, hash) fora do event loop do asyncio,
+    em um pool de threads ou de processos.
+
+    O número de tarefas em andamento é limitado por `max_pending`: quando o limite é
+    atingido, novas chamadas aguardam (sem bloquear o event loop) até haver vaga.
+    """
+
+    def __init__(self, kind: str, max_workers: int, max_pending: int, chunk_size: int):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Tipo de pool de criptografia inválido: {kind}")
+        self.kind = kind
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.chunk_size = chunk_size
+        self._executor: Optional[Executor] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.in_flight = 0
+        self.waiting = 0
+        self.completed = 0
+
+    def _ensure_started(self) -> Executor:
+        if self._executor is None:
+            if self.kind == "process":
+                # "spawn" evita herdar o estado do event loop e as threads do processo pai
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix="crypto",
+                )
+            self._semaphore = asyncio.Semaphore(self.max_pending)
+        return self._executor
+
+    async def run(self, fn: Callable[..., R], *args: Any) -> R:
+        """Executa `fn(*args)` no pool e aguarda o resultado."""
+        executor = self._ensure_started()
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(executor, fn, *args)
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+            self._semaphore.release()
+
+    async def map_chunks(self, fn: Callable[[List[T]], List[R]], items: Sequence[T]) -> List[R]:
+        """
+        Divide `items` em lotes de `chunk_size` e processa os lotes em paralelo no pool.
+        `fn` recebe um lote e retorna uma lista de resultados na mesma ordem.
+        """
+        if not items:
+            return []
+        chunks = [list(items[i:i + self.chunk_size]) for i in range(0, len(items), self.chunk_size)]
+        chunk_results = await asyncio.gather(*(self.run(fn, chunk) for chunk in chunks))
+        return [result for chunk_result in chunk_results for result in chunk_result]
+
+    async def shutdown(self) -> None:
+        """
+        Encerra o pool aguardando as tarefas em andamento. A espera (no modo "process",
+        o fim dos processos filhos) é feita em uma thread, sem bloquear o event loop.
+        """
+        executor, self._executor, self._semaphore = self._executor, None, None
+        if executor is not None:
+            await asyncio.to_thread(executor.shutdown, wait=True, cancel_futures=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "kind": self.kind,
+            "max_workers": self.max_workers,
+            "max_pending": self.max_pending,
+            "chunk_size": self.chunk_size,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "completed": self.completed,
+        }
+
+
+crypto_executor = CryptoExecutor(
+    kind=config.CRYPTO_POOL_KIND,
+    max_workers=config.CRYPTO_POOL_SIZE,
+    max_pending=config.CRYPTO_MAX_PENDING,
+    chunk_size=config.CRYPTO_CHUNK_SIZE,
+)
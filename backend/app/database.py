@@ -1,19 +1,60 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+
+from . import config
 
 # Nome do arquivo do banco de dados SQLite
 SQLALCHEMY_DATABASE_URL = "sqlite:///./chat.db"
+# Mesmo arquivo, acessado pelo driver assíncrono (aiosqlite)
+ASYNC_SQLALCHEMY_DATABASE_URL = "sqlite+aiosqlite:///./chat.db"
+
+
+def _configure_sqlite_connection(dbapi_connection, connection_record) -> None:
+    # WAL permite leituras concorrentes com a escrita, e synchronous=NORMAL faz o fsync
+    # apenas nos checkpoints (seguro em WAL: uma queda de energia perde no máximo os
+    # últimos commits, sem corromper o banco).
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={config.SQLITE_JOURNAL_MODE}")
+    cursor.execute(f"PRAGMA synchronous={config.SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA busy_timeout={config.SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.close()
+
+
+def make_engine(url: str) -> Engine:
+    """Cria um motor síncrono para um arquivo SQLite, com os PRAGMAs e o pool configurados."""
+    # check_same_thread é necessário para SQLite com múltiplos threads
+    # como pode acontecer em um servidor web.
+    db_engine = create_engine(
+        url,
+        connect_args={"check_same_thread": False},
+        pool_size=config.DB_POOL_SIZE,
+        max_overflow=config.DB_MAX_OVERFLOW,
+    )
+    event.listen(db_engine, "connect", _configure_sqlite_connection)
+    return db_engine
+
+
+def make_async_engine(url: str) -> AsyncEngine:
+    """Cria um motor assíncrono (aiosqlite) para um arquivo SQLite, com os PRAGMAs e o pool configurados."""
+    db_engine = create_async_engine(
+        url,
+        pool_size=config.DB_POOL_SIZE,
+        max_overflow=config.DB_MAX_OVERFLOW,
+    )
+    event.listen(db_engine.sync_engine, "connect", _configure_sqlite_connection)
+    return db_engine
+
 
-# Cria o motor do SQLAlchemy. check_same_thread é necessário para SQLite com múltiplos threads
-# como pode acontecer em um servidor web.
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
+# Motor síncrono do SQLAlchemy, usado apenas para criação/atualização do esquema.
+engine = make_engine(SQLALCHEMY_DATABASE_URL)
 
-# Cria uma instância de SessionLocal. Cada instância de SessionLocal será uma sessão de banco de dados.
-# A sessão em si é a "conversa" com o banco de dados.
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Motor e sessões assíncronos, usados pelos endpoints FastAPI e pelo WebSocket (crud_async).
+# expire_on_commit=False: os objetos continuam utilizáveis após o commit sem novo SELECT
+# (acesso preguiçoso a atributos não é permitido em sessões assíncronas).
+async_engine = make_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL)
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
 
 # Base para os modelos declarativos do SQLAlchemy.
 # Esta classe será herdada pelos modelos de dados.
@@ -21,9 +62,6 @@ Base = declarative_base()
 
 # Função para obter uma sessão de banco de dados.
 # Usaremos isso com o FastAPI para gerenciar as sessões por requisição.
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
\ No newline at end of file
@@ -0,0 +1,189 @@
+import asyncio
+import logging
+from typing import TYPE_CHECKING, Any, Dict, Optional
+from uuid import UUID
+
+from . import broker
+from .wire import ENCODING_JSON, Frame
+
+if TYPE_CHECKING:
+    from .connections import ConnectionManager
+
+logger = logging.getLogger(__name__)
+
+
+class LocalDelivery:
+    """
+    Entrega apenas às conexões do próprio processo (padrão, um único worker).
+    Um destinatário sem conexão local está offline.
+    """
+
+    name = "memory"
+
+    async def start(self, manager: "ConnectionManager") -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+    def subscribe(self, user_id: UUID) -> None:
+        pass
+
+    def unsubscribe(self, user_id: UUID) -> None:
+        pass
+
+    async def route(self, recipient_id: UUID, frame: Frame, durable: bool = False) -> bool:
+        """
+        Entrega um evento a um destinatário sem conexão local. Retorna se foi encaminhado;
+        se não foi e `durable` for verdadeiro, o gerenciador guarda o evento para a reconexão.
+        """
+        logger.debug("Destinatário %s não está online. Mensagem não enviada via WS.", recipient_id)
+        return False
+
+    async def publish_broadcast(self, frame: Frame) -> None:
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.name}
+
+
+class BrokerDelivery(LocalDelivery):
+    """
+    Entrega entre vários processos por meio do broker local (app/broker.py), via socket Unix.
+    Entre workers os eventos trafegam em JSON; cada worker recodifica para suas conexões.
+
+    O worker informa ao broker os usuários conectados nele; eventos para usuários
+    conectados em outros workers são encaminhados pelo broker. Se a conexão com o broker
+    cair, ela é refeita em segundo plano e as inscrições são reenviadas. Se o broker não
+    acompanhar (mais de `max_buffer_bytes` aguardando envio), os eventos são descartados
+    e contados; as inscrições (SUB/UNSUB) são sempre enviadas.
+    """
+
+    name = "broker"
+
+    def __init__(
+        self,
+        socket_path: str,
+        reconnect_delay: float = 1.0,
+        max_buffer_bytes: int = broker.DEFAULT_MAX_BUFFER_BYTES,
+    ):
+        self.socket_path = socket_path
+        self.reconnect_delay = reconnect_delay
+        self.max_buffer_bytes = max_buffer_bytes
+        self._manager: Optional["ConnectionManager"] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._task: Optional[asyncio.Task] = None
+
+        self.forwarded = 0
+        self.received = 0
+        self.unrouted = 0
+        self.dropped_disconnected = 0
+        self.dropped_backpressure = 0
+        self.reconnects = 0
+
+    async def start(self, manager: "ConnectionManager") -> None:
+        self._manager = manager
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def _send(self, op: int, user_id: bytes = broker.NO_USER, payload: bytes = b"", flags: int = 0) -> bool:
+        if self._writer is None or self._writer.is_closing():
+            return False
+        broker.write_frame(self._writer, op, user_id, payload, flags)
+        return True
+
+    def _backlogged(self) -> bool:
+        """O broker não está lendo o socket: eventos novos seriam apenas acumulados em memória."""
+        if self._writer is None or broker.buffered_bytes(self._writer) <= self.max_buffer_bytes:
+            return False
+        self.dropped_backpressure += 1
+        return True
+
+    def subscribe(self, user_id: UUID) -> None:
+        self._send(broker.OP_SUB, user_id.bytes)
+
+    def unsubscribe(self, user_id: UUID) -> None:
+        self._send(broker.OP_UNSUB, user_id.bytes)
+
+    async def route(self, recipient_id: UUID, frame: Frame, durable: bool = False) -> bool:
+        # Eventos duráveis voltam com a flag no NOROUTE, para serem guardados por este worker
+        flags = broker.FLAG_DURABLE if durable else 0
+        if self._backlogged():
+            logger.debug("Broker de entrega sobrecarregado. Evento para %s não enviado.", recipient_id)
+            return False
+        if not self._send(broker.OP_SEND, recipient_id.bytes, frame.encode(ENCODING_JSON).encode("utf-8"), flags):
+            self.dropped_disconnected += 1
+            logger.warning("Broker de entrega indisponível. Evento para %s não enviado.", recipient_id)
+            return False
+        self.forwarded += 1
+        return True
+
+    async def publish_broadcast(self, frame: Frame) -> None:
+        if self._backlogged():
+            return
+        if not self._send(broker.OP_BCAST, payload=frame.encode(ENCODING_JSON).encode("utf-8")):
+            self.dropped_disconnected += 1
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                reader, self._writer = await asyncio.open_unix_connection(self.socket_path)
+                # (Re)inscreve os usuários já conectados neste worker
+                for user_id in list(self._manager.active_connections):
+                    self.subscribe(user_id)
+                logger.info("Conectado ao broker de entrega em %s", self.socket_path)
+                while True:
+                    op, flags, user_id, payload = await broker.read_frame(reader)
+                    self.received += 1
+                    frame = Frame.from_json(payload.decode("utf-8"))
+                    if op == broker.OP_DELIVER:
+                        # Um evento durável que não couber na fila do destinatário é guardado aqui
+                        self._manager.deliver_local(UUID(bytes=user_id), frame, bool(flags & broker.FLAG_DURABLE))
+                    elif op == broker.OP_BCAST:
+                        self._manager.broadcast_local(frame)
+                    elif op == broker.OP_NOROUTE:
+                        self.unrouted += 1
+                        logger.debug("Destinatário %s não está online. Mensagem não enviada via WS.", UUID(bytes=user_id))
+                        if flags & broker.FLAG_DURABLE:
+                            self._manager.store_offline(UUID(bytes=user_id), frame)
+            except asyncio.CancelledError:
+                raise
+            except (OSError, asyncio.IncompleteReadError) as e:
+                logger.warning("Conexão com o broker de entrega indisponível (%s); tentando novamente.", e)
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+            self.reconnects += 1
+            await asyncio.sleep(self.reconnect_delay)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.name,
+            "socket": self.socket_path,
+            "connected": self._writer is not None and not self._writer.is_closing(),
+            "forwarded": self.forwarded,
+            "received": self.received,
+            "unrouted": self.unrouted,
+            "dropped_disconnected": self.dropped_disconnected,
+            "dropped_backpressure": self.dropped_backpressure,
+            "reconnects": self.reconnects,
+        }
+
+
+def create_delivery_backend(
+    kind: str, socket_path: str, max_buffer_bytes: int = broker.DEFAULT_MAX_BUFFER_BYTES
+) -> LocalDelivery:
+    if kind == "memory":
+        return LocalDelivery()
+    if kind == "broker":
+        return BrokerDelivery(socket_path, max_buffer_bytes=max_buffer_bytes)
+    raise ValueError(f"Backend de entrega inválido: {kind}")
@@ -0,0 +1,194 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Generic, Optional, Tuple, TypeVar
+from uuid import UUID
+
+K = TypeVar("K")
+
+
+class _CacheEntry(Generic[K]):
+    __slots__ = ("key_obj", "fingerprint", "size", "expires_at")
+
+    def __init__(self, key_obj: K, fingerprint: bytes, size: int, expires_at: float):
+        self.key_obj = key_obj
+        self.fingerprint = fingerprint
+        self.size = size
+        self.expires_at = expires_at
+
+
+class PrivateKeyCache(Generic[K]):
+    """
+    Cache LRU com expiração (TTL) dos objetos de chave privada já carregados,
+    indexado pelo ID do usuário.
+
+    Cada entrada guarda a impressão digital (SHA256) da chave serializada que a
+    originou: se a chave armazenada do usuário mudar, a entrada antiga é
+    descartada e a chave é carregada novamente.
+    O limite de memória é aproximado pela soma do tamanho DER das chaves.
+    """
+
+    def __init__(
+        self,
+        loader: Callable[[bytes], K],
+        max_entries: int,
+        max_bytes: int,
+        ttl_seconds: float,
+    ):
+        self._loader = loader
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[UUID, _CacheEntry[K]]" = OrderedDict()
+        self._total_bytes = 0
+        # O cache pode ser acessado a partir de threads de trabalho
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, user_id: UUID, private_key_der: bytes) -> K:
+        """Retorna o objeto da chave privada do usuário, carregando-o se necessário."""
+        fingerprint = hashlib.sha256(private_key_der).digest()
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                if entry.fingerprint != fingerprint:
+                    # A chave do usuário mudou desde que foi colocada no cache
+                    self._remove(user_id)
+                    self.invalidations += 1
+                elif self._ttl_seconds and entry.expires_at <= now:
+                    self._remove(user_id)
+                    self.expirations += 1
+                else:
+                    self._entries.move_to_end(user_id)
+                    self.hits += 1
+                    return entry.key_obj
+            self.misses += 1
+
+        # Carrega fora do lock: a desserialização é a parte cara
+        key_obj = self._loader(private_key_der)
+        size = len(private_key_der)
+
+        with self._lock:
+            if user_id in self._entries:
+                self._remove(user_id)
+            self._entries[user_id] = _CacheEntry(key_obj, fingerprint, size, now + self._ttl_seconds)
+            self._total_bytes += size
+            self._evict()
+        return key_obj
+
+    def invalidate(self, user_id: UUID) -> None:
+        """Remove a chave de um usuário do cache (ex.: após troca de chave)."""
+        with self._lock:
+            if user_id in self._entries:
+                self._remove(user_id)
+                self.invalidations += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+
+    def stats(self) -> Dict[str, float]:
+        """Contadores para dimensionar o cache sob carga."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_entries": self._max_entries,
+                "max_bytes": self._max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": (self.hits / lookups) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+    def _remove(self, user_id: UUID) -> Optional[_CacheEntry[K]]:
+        entry = self._entries.pop(user_id, None)
+        if entry is not None:
+            self._total_bytes -= entry.size
+        return entry
+
+    def _evict(self) -> None:
+        # Remove as entradas menos usadas recentemente até respeitar os limites
+        while self._entries and (
+            len(self._entries) > self._max_entries or self._total_bytes > self._max_bytes
+        ):
+            _, entry = self._entries.popitem(last=False)
+            self._total_bytes -= entry.size
+            self.evictions += 1
+
+
+class SessionKeyCache:
+    """
+    Cache LRU com expiração (TTL) das chaves simétricas de sessão já desembrulhadas.
+
+    A chave do cache é (ID do remetente, chave de sessão embrulhada com RSA), de modo que
+    apenas a primeira mensagem de uma sessão paga a operação RSA com a chave privada;
+    as seguintes custam só a descriptografia simétrica.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self._max_entries = max_entries
+        self._ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Tuple[UUID, bytes], Tuple[bytes, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, sender_id: UUID, wrapped_key: bytes) -> Optional[bytes]:
+        """Retorna a chave de sessão desembrulhada, ou None se não estiver no cache."""
+        cache_key = (sender_id, wrapped_key)
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is not None:
+                session_key, expires_at = entry
+                if self._ttl_seconds and expires_at <= time.monotonic():
+                    del self._entries[cache_key]
+                    self.expirations += 1
+                else:
+                    self._entries.move_to_end(cache_key)
+                    self.hits += 1
+                    return session_key
+            self.misses += 1
+            return None
+
+    def put(self, sender_id: UUID, wrapped_key: bytes, session_key: bytes) -> None:
+        if self._max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[(sender_id, wrapped_key)] = (session_key, time.monotonic() + self._ttl_seconds)
+            self._entries.move_to_end((sender_id, wrapped_key))
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self._max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": (self.hits / lookups) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
@@ -0,0 +1,94 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# (chave pública DER, chave privada DER)
+KeyPair = Tuple[bytes, bytes]
+
+
+class KeyPairPool:
+    """
+    Reserva de pares de chaves RSA pré-gerados, para tirar a geração de chaves do
+    caminho crítico do registro.
+
+    Tarefas de reposição mantêm a reserva em `target_size` pares em segundo plano.
+    Quando a reserva está vazia, `acquire` gera um par na hora (contabilizado em `stalls`).
+    Os pares ficam apenas em memória e são descartados ao encerrar o servidor.
+    """
+
+    def __init__(self, generate: Callable[[], Awaitable[KeyPair]], target_size: int, refill_workers: int):
+        self._generate = generate
+        self.target_size = target_size
+        self.refill_workers = refill_workers
+        self._pairs: "asyncio.Queue[KeyPair]" = asyncio.Queue()
+        self._space_available = asyncio.Event()
+        self._workers: List[asyncio.Task] = []
+        self._generating = 0
+
+        self.hits = 0
+        self.stalls = 0
+        self.generated = 0
+        self.errors = 0
+
+    def start(self) -> None:
+        if self._workers or self.target_size <= 0:
+            return
+        self._space_available.set()
+        self._workers = [asyncio.create_task(self._refill_worker()) for _ in range(self.refill_workers)]
+
+    async def stop(self) -> None:
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def acquire(self) -> KeyPair:
+        """Retorna um par (pública, privada) em DER, da reserva se houver."""
+        try:
+            pair = self._pairs.get_nowait()
+            self.hits += 1
+        except asyncio.QueueEmpty:
+            # Reserva vazia (rajada de registros ou pool desativado): gera na hora
+            self.stalls += 1
+            pair = await self._generate()
+        self._space_available.set()
+        return pair
+
+    async def _refill_worker(self) -> None:
+        while True:
+            # Aguarda até que a reserva (incluindo pares em geração) fique abaixo do alvo
+            while self._pairs.qsize() + self._generating >= self.target_size:
+                self._space_available.clear()
+                await self._space_available.wait()
+
+            self._generating += 1
+            try:
+                pair: Optional[KeyPair] = await self._generate()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.errors += 1
+                logger.error("Erro ao pré-gerar par de chaves RSA: %s", e)
+                pair = None
+            finally:
+                self._generating -= 1
+
+            if pair is None:
+                await asyncio.sleep(1)
+                continue
+            self._pairs.put_nowait(pair)
+            self.generated += 1
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "depth": self._pairs.qsize(),
+            "target_size": self.target_size,
+            "refill_workers": len(self._workers),
+            "generating": self._generating,
+            "hits": self.hits,
+            "stalls": self.stalls,
+            "generated": self.generated,
+            "errors": self.errors,
+        }
@@ -0,0 +1,40 @@
+import atexit
+import logging
+import queue
+import sys
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+from . import config
+
+# Os módulos do backend registram mensagens em loggers "app.*" (logging.getLogger(__name__)).
+# O handler desses loggers apenas coloca o registro em uma fila em memória; a escrita no
+# terminal (E/S síncrona) é feita por uma thread do QueueListener, fora do event loop.
+
+_listener: Optional[QueueListener] = None
+
+
+def configure_logging(level: str = config.LOG_LEVEL) -> None:
+    """Configura o logger "app" com um QueueHandler (não bloqueante). Pode ser chamada mais de uma vez."""
+    global _listener
+    if _listener is not None:
+        return
+    log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler(sys.stderr)
+    stream_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(name)s] %(message)s"))
+    _listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+    app_logger = logging.getLogger(__name__.rpartition(".")[0])
+    app_logger.setLevel(level.upper())
+    app_logger.addHandler(QueueHandler(log_queue))
+    app_logger.propagate = False
+
+
+def stop_logging() -> None:
+    """Escreve os registros pendentes e encerra a thread de escrita."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -1,23 +1,77 @@
-from fastapi import FastAPI, Depends, HTTPException, WebSocket, WebSocketDisconnect, status
+import time
+
+# Início da importação: referência dos tempos de inicialização (GET /stats/startup)
+_import_started = time.perf_counter()
+
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect, status
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-from typing import List, Dict, Union, Tuple
-import json
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import AsyncIterator, List, Dict, Optional, Tuple
+from itertools import chain, zip_longest
+import asyncio
+import logging
 from uuid import UUID # Importação do tipo UUID
-from cryptography.hazmat.primitives.asymmetric import rsa, padding
-from cryptography.hazmat.primitives import hashes, serialization
-from cryptography.hazmat.backends import default_backend
 
-import hashlib 
-import base64 
+from . import config, crud, crud_async, metrics, models, schemas
+from .crypto import (
+    DecryptItem,
+    decrypt_and_verify_timed,
+    decrypt_and_verify_chunk,
+    generate_rsa_key_pair,
+    preload_private_keys_chunk,
+    private_key_cache,
+    session_key_cache,
+    store_private_key_as_is,
+)
+from .connections import ConnectionManager
+from .crypto_pool import crypto_executor
+from .delivery import create_delivery_backend
+from .database import AsyncSessionLocal, engine, get_async_db
+from .keygen_pool import KeyPairPool
+from .logging_setup import configure_logging
+from .message_writer import MessageBatchWriter
+from .pending_deliveries import PendingDeliveryStore
+from .rate_limit import SCOPE_QUEUE, RateLimiter
+from .sharding import create_message_shards
+from .startup import FirstRequestTimer, StartupReport
+from .user_directory import UserDirectory
+from .migrations import ensure_schema
+from .wire import (
+    Frame,
+    chat_batch_event,
+    chat_message_event,
+    chat_message_payload,
+    decode_message,
+    negotiate,
+    rate_limited_event,
+)
+
+# Logs através de uma fila: a escrita no terminal não bloqueia o event loop
+configure_logging()
+logger = logging.getLogger(__name__)
+
+# Tempos de cada fase da inicialização e latência da primeira requisição
+startup_report = StartupReport(started_at=_import_started)
+metrics.READY.set_function(lambda: 1 if startup_report.ready else 0)
+
+# Mensagens e resumos de conversa, distribuídos por conversa entre SAFECHAT_MESSAGE_SHARDS
+# arquivos (com 1, o próprio banco principal). Usuários e entregas pendentes ficam no principal.
+# Os motores só abrem conexões no primeiro uso: o esquema é criado na inicialização (lifespan).
+message_shards = create_message_shards(config.MESSAGE_SHARDS, config.MESSAGE_SHARD_PATH)
+
 
-from . import crud, models, schemas
-from .database import engine, get_db, Base
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await start_background_workers()
+    try:
+        yield
+    finally:
+        await shutdown_background_workers()
 
-# Cria as tabelas no banco de dados se elas não existirem
-Base.metadata.create_all(bind=engine)
 
-app = FastAPI(title="Safe Chat Backend (Chat Individual com Descriptografia no Servidor)")
+app = FastAPI(title="Safe Chat Backend (Chat Individual com Descriptografia no Servidor)", lifespan=lifespan)
 
 # Configuração CORS: Permite todas as origens para desenvolvimento.
 origins = ["*"]
@@ -29,153 +83,105 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(FirstRequestTimer, report=startup_report)
 
-# Gerenciador de Conexões WebSocket
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[UUID, WebSocket] = {}
-
-    async def connect(self, user_id: UUID, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections[user_id] = websocket
-        print(f"WebSocket conectado para o usuário {user_id}")
-
-    def disconnect(self, user_id: UUID):
-        if user_id in self.active_connections:
-            del self.active_connections[user_id]
-            print(f"WebSocket desconectado para o usuário {user_id}")
-
-    async def send_personal_message(self, message: Union[str, dict], recipient_id: UUID):
-        if recipient_id in self.active_connections:
-            websocket = self.active_connections[recipient_id]
-            if isinstance(message, dict):
-                # NOVO: Chamar json.dumps() aqui para garantir serialização
-                await websocket.send_text(json.dumps(message)) 
-            else:
-                await websocket.send_text(message)
-        else:
-            print(f"Destinatário {recipient_id} não está online. Mensagem não enviada via WS.")
-
-    async def broadcast(self, message: dict):
-        # NOVO: Chamar json.dumps() aqui para garantir serialização
-        message_json_string = json.dumps(message) 
-        for user_id, connection in list(self.active_connections.items()):
-            try:
-                await connection.send_text(message_json_string)
-            except RuntimeError as e:
-                print(f"Erro ao transmitir para {user_id}: {e}")
-                self.disconnect(user_id)
-
-
-manager = ConnectionManager()
-
-# --- Funções de Criptografia e Geração de Chaves (Backend-side) ---
-
-def store_private_key_as_is(private_key_hex: str) -> str:
-    """
-    Simplesmente retorna a chave privada em HEX para armazenamento.
-    NÃO HÁ CRIPTOGRAFIA DE PROTEÇÃO AQUI.
-    """
-    return private_key_hex
-
-def retrieve_private_key_as_obj(private_key_hex: str) -> rsa.RSAPrivateKey:
-    """
-    Carrega a chave privada em HEX (que representa um DER) e retorna o objeto RSA PrivateKey.
-    """
-    # Converte de HEX para bytes (DER)
-    private_der_bytes = bytes.fromhex(private_key_hex)
-
-    return serialization.load_der_private_key( 
-        private_der_bytes, 
-        password=None, 
-        backend=default_backend()
-    )
-
-
-def generate_rsa_key_pair() -> Tuple[str, str]:
-    """Gera um par de chaves RSA e retorna em formato HEXADECIMAL (SPKI para pública, PKCS8 para privada)."""
-    private_key = rsa.generate_private_key(
-        public_exponent=65537,
-        key_size=2048,
-        backend=default_backend()
-    )
-    public_key = private_key.public_key()
-
-    # Serializa para formato DER (binário) e depois para HEX
-    private_der_bytes = private_key.private_bytes(
-        encoding=serialization.Encoding.DER, # DER é o formato binário
-        format=serialization.PrivateFormat.PKCS8,
-        encryption_algorithm=serialization.NoEncryption()
-    )
-    private_hex = private_der_bytes.hex()
+# Eventos para destinatários offline, guardados até a reconexão (store-and-forward)
+pending_store = PendingDeliveryStore(
+    session_factory=AsyncSessionLocal,
+    replay_batch_size=config.PENDING_REPLAY_BATCH_SIZE,
+    max_per_recipient=config.PENDING_MAX_PER_RECIPIENT,
+    ttl_seconds=config.PENDING_TTL_SECONDS,
+)
 
-    public_der_bytes = public_key.public_bytes(
-        encoding=serialization.Encoding.DER, # DER é o formato binário
-        format=serialization.PublicFormat.SubjectPublicKeyInfo
-    )
-    public_hex = public_der_bytes.hex()
+manager = ConnectionManager(
+    max_queue_size=config.SEND_QUEUE_MAX_SIZE,
+    policy=config.SEND_QUEUE_POLICY,
+    delivery=create_delivery_backend(
+        config.DELIVERY_BACKEND, config.DELIVERY_BROKER_SOCKET, config.DELIVERY_BROKER_MAX_BUFFER_BYTES
+    ),
+    pending=pending_store,
+)
 
-    return public_hex, private_hex
+# Reserva de pares de chaves pré-gerados (no pool de criptografia) para novos registros
+key_pair_pool = KeyPairPool(
+    generate=lambda: crypto_executor.run(generate_rsa_key_pair),
+    target_size=config.KEY_POOL_TARGET_SIZE,
+    refill_workers=config.KEY_POOL_REFILL_WORKERS,
+)
 
+# Diretório de usuários serializado em memória (GET /users)
+user_directory = UserDirectory()
 
-def rsa_decrypt_backend(encrypted_data_b64: str, private_key_obj: rsa.RSAPrivateKey) -> str:
-    """
-    Descriptografa dados com o OBJETO da chave privada RSA (no backend).
-    O padding é OAEP para corresponder ao que o frontend (Web Crypto API) usa para criptografia.
-    """
-    decrypted_bytes = private_key_obj.decrypt( # Usa o objeto de chave, não o formato PEM ou HEX
-        base64.b64decode(encrypted_data_b64),
-        padding.OAEP(
-            mgf=padding.MGF1(algorithm=hashes.SHA256()),
-            algorithm=hashes.SHA256(),
-            label=None
-        )
-    )
-    return decrypted_bytes.decode('utf-8')
+# Gravação das mensagens de chat em lote (uma transação para várias mensagens)
+message_writer = MessageBatchWriter(
+    shards=message_shards,
+    max_batch_size=config.MESSAGE_BATCH_MAX_SIZE,
+    window_seconds=config.MESSAGE_BATCH_WINDOW_MS / 1000,
+)
 
+# Controle de admissão do trabalho criptográfico recebido via WebSocket (por usuário e global)
+rate_limiter = RateLimiter(
+    user_rate=config.RATE_LIMIT_USER_RATE,
+    user_burst=config.RATE_LIMIT_USER_BURST,
+    global_rate=config.RATE_LIMIT_GLOBAL_RATE,
+    global_burst=config.RATE_LIMIT_GLOBAL_BURST,
+    policy=config.RATE_LIMIT_POLICY,
+    max_defer_seconds=config.RATE_LIMIT_MAX_DEFER_MS / 1000,
+)
+# Tamanho máximo efetivo de um CHAT_BATCH: o lote é admitido de uma vez, então não pode
+# exceder a rajada dos baldes ativos (padrão: SAFECHAT_RATE_LIMIT_USER_BURST)
+CHAT_BATCH_LIMIT = int(min(config.CHAT_BATCH_MAX_SIZE, rate_limiter.max_cost or config.CHAT_BATCH_MAX_SIZE))
 
-def sha256_hash_backend(data: str) -> str:
-    """Gera o hash SHA256 de uma string (no backend)."""
-    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+# Métricas de estado lidas a cada coleta de /metrics
+metrics.ACTIVE_CONNECTIONS.set_function(lambda: len(manager.active_connections))
+metrics.QUEUE_DEPTH.labels("send").set_function(
+    lambda: sum(c.queue.qsize() for c in manager.active_connections.values())
+)
+metrics.QUEUE_DEPTH.labels("message_writer").set_function(lambda: message_writer.stats()["queued"])
+metrics.QUEUE_DEPTH.labels("pending_deliveries").set_function(lambda: pending_store.stats()["queued"])
+metrics.QUEUE_DEPTH.labels("crypto_in_flight").set_function(lambda: crypto_executor.in_flight)
+metrics.QUEUE_DEPTH.labels("crypto_waiting").set_function(lambda: crypto_executor.waiting)
 
 # --- Endpoints REST API ---
 
 @app.post("/register-or-login", response_model=schemas.UserResponse)
-async def register_or_login(user_data: schemas.UserCreate, db: Session = Depends(get_db)):
+async def register_or_login(user_data: schemas.UserCreate, db: AsyncSession = Depends(get_async_db)):
     """
     Endpoint para registrar ou logar um usuário.
     Se o usuário não existir, ele é criado com um novo par de chaves RSA.
     Retorna o UUID, username e chave pública do usuário (em HEX).
     """
-    db_user = crud.get_user_by_username(db, username=user_data.username)
+    db_user = await crud_async.get_user_by_username(db, username=user_data.username)
     if db_user:
         if db_user.password != user_data.password: 
             raise HTTPException(status_code=400, detail="Senha incorreta")
         return schemas.UserResponse(
             id=UUID(bytes=db_user.id),
             username=db_user.username,
-            public_key=db_user.public_key # Retorna a chave pública existente (HEX)
+            public_key=db_user.public_key # Retorna a chave pública existente (convertida para HEX pelo esquema)
         )
     
-    # Usuário não existe, criar novo e gerar chaves RSA
-    public_hex, private_hex = generate_rsa_key_pair()
+    # Usuário não existe, criar novo com um par de chaves RSA da reserva pré-gerada
+    public_der, private_der = await key_pair_pool.acquire()
     
-    # Salva a chave privada diretamente (em HEX) no DB sem criptografia adicional
-    private_key_to_save = store_private_key_as_is(private_hex)
+    # Salva a chave privada diretamente (DER) no DB sem criptografia adicional
+    private_key_to_save = store_private_key_as_is(private_der)
 
-    new_user = crud.create_user(
+    new_user = await crud_async.create_user(
         db=db,
         user_data=user_data,
-        public_key_pem=public_hex, # Salvando o HEX na coluna public_key
-        private_key_pem_encrypted=private_key_to_save # Agora armazena o HEX não criptografado
+        public_key_pem=public_der, # Salvando o DER (bytes) na coluna public_key
+        private_key_pem_encrypted=private_key_to_save # Armazena o DER não criptografado
     )
+    # Garante que nenhuma chave antiga associada a este ID permaneça no cache
+    private_key_cache.invalidate(UUID(bytes=new_user.id))
     
     # Notifica todos os clientes WebSocket sobre o novo usuário
     # NOVO: Converte os campos UUID para string explicitamente aqui
     new_user_data_serializable = {
-        "id": str(new_user.id), # Converte UUID para string
+        "id": str(UUID(bytes=new_user.id)), # Converte UUID para string
         "username": new_user.username,
-        "public_key": new_user.public_key
+        "public_key": new_user.public_key.hex()
     }
     
     # Inclui um tipo de mensagem para o frontend saber o que fazer
@@ -183,184 +189,845 @@ async def register_or_login(user_data: schemas.UserCreate, db: Session = Depends
         "type": "NEW_USER_REGISTERED",
         "user": new_user_data_serializable # Passa o dicionário com UUIDs convertidos
     }
-    # manager.broadcast espera um dicionário, que json.dumps() irá serializar
-    await manager.broadcast(broadcast_message) 
+    # Serializado uma única vez (por codificação) para todas as conexões
+    await manager.broadcast(Frame(broadcast_message))
     
     return schemas.UserResponse(
         id=UUID(bytes=new_user.id),
         username=new_user.username,
-        public_key=new_user.public_key # Retorna a chave pública do novo usuário (HEX)
+        public_key=new_user.public_key # Retorna a chave pública do novo usuário (convertida para HEX pelo esquema)
     )
 
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Verifica se algum ETag do cabeçalho If-None-Match corresponde ao atual."""
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or any(tag.removeprefix("W/") == etag for tag in candidates)
+
+
 @app.get("/users", response_model=List[schemas.UserInList])
-async def list_users(db: Session = Depends(get_db)):
+async def list_users(
+    request: Request,
+    since: Optional[int] = Query(None, ge=0, description="Versão do diretório já conhecida: retorna apenas os usuários adicionados depois dela"),
+    db: AsyncSession = Depends(get_async_db),
+):
     """
     Endpoint para listar todos os usuários com seus IDs, usernames e chaves públicas (em HEX).
+
+    A lista é mantida em memória já serializada. A versão atual do diretório vem no cabeçalho
+    `X-Directory-Version`; com `?since=<versão>` apenas os usuários novos são retornados.
+    Com `If-None-Match` igual ao `ETag` recebido antes, a resposta é 304 sem corpo.
     """
-    return crud.get_all_users_for_list(db)
+    version = await user_directory.refresh(db)
+    etag = user_directory.etag(since)
+    headers = {"ETag": etag, "X-Directory-Version": str(version), "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        user_directory.not_modified += 1
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=user_directory.body(since), media_type="application/json", headers=headers)
 
 
-@app.get("/messages/{user1_id}/{user2_id}", response_model=List[schemas.MessageDecryptedOut])
-async def get_conversation(user1_id: UUID, user2_id: UUID, db: Session = Depends(get_db)):
+# Conteúdo exibido quando a tag do AES-GCM não confere (não há texto claro confiável)
+INTEGRITY_FAILED_CONTENT = "[Mensagem rejeitada - falha na verificação de integridade (AES-GCM)]"
+
+
+async def decrypt_history_batch(
+    messages: List[models.Message], participants: Dict[bytes, models.User]
+) -> List[schemas.MessageDecryptedOut]:
     """
-    Endpoint para listar todas as mensagens trocadas entre dois usuários.
-    As mensagens são DESCRIPTOGRAFADAS pelo servidor usando a CHAVE PRIVADA DO REMETENTE original.
-    A integridade é VERIFICADA.
+    Descriptografa e verifica um lote de mensagens de uma conversa, usando a CHAVE PRIVADA
+    DO REMETENTE original de cada uma. `participants` contém os usuários da conversa.
     """
-    messages = crud.get_messages_between_users(db, user1_id, user2_id)
-    
-    decrypted_messages_out = []
+    def username_of(user_id_bytes: bytes) -> str:
+        user = participants.get(user_id_bytes)
+        return user.username if user else "Desconhecido"
+
+    # Separa as mensagens que podem ser descriptografadas (remetente com chave privada no servidor)
+    decrypt_items = []
+    decryptable_messages = []
     for msg in messages:
         # Pega a chave privada do REMETENTE original para descriptografar a mensagem
-        sender_user = crud.get_user_by_id(db, UUID(bytes=msg.sender_id))
-        
-        if not sender_user or not sender_user.private_key_encrypted:
-            print(f"ATENÇÃO: Remetente {msg.sender_id} ou sua chave privada não encontrada no servidor.")
-            decrypted_messages_out.append(schemas.MessageDecryptedOut(
-                id=UUID(bytes=msg.id),
-                content="[Mensagem cifrada - Não foi possível descriptografar no servidor]",
-                created_at=msg.created_at,
-                sender_id=UUID(bytes=msg.sender_id),
-                sender_username=(crud.get_user_by_id(db, UUID(bytes=msg.sender_id)) or {}).username or "Desconhecido",
-                recipient_id=UUID(bytes=msg.recipient_id),
-                recipient_username=(crud.get_user_by_id(db, UUID(bytes=msg.recipient_id)) or {}).username or "Desconhecido",
-                is_integrity_valid=False
+        sender_user = participants.get(msg.sender_id)
+        if sender_user and sender_user.private_key_encrypted:
+            decrypt_items.append(DecryptItem(
+                UUID(bytes=msg.sender_id),
+                sender_user.private_key_encrypted,
+                msg.encrypted_content,
+                msg.message_hash,
+                msg.scheme,
+                msg.wrapped_key,
+                msg.nonce,
+                UUID(bytes=msg.recipient_id),
             ))
-            continue
+            decryptable_messages.append(msg)
 
-        try:
-            # Carrega a chave privada como objeto, diretamente do HEX salvo no DB
-            sender_private_key_obj = retrieve_private_key_as_obj(sender_user.private_key_encrypted)
-
-            # Descriptografa o conteúdo da mensagem com a CHAVE PRIVADA DO REMETENTE
-            decrypted_content = rsa_decrypt_backend(msg.encrypted_content, sender_private_key_obj)
-
-            # Verifica a integridade (hash)
-            calculated_hash = sha256_hash_backend(decrypted_content)
-            is_integrity_valid = (calculated_hash == msg.message_hash)
-            
-            sender_username_val = sender_user.username
-            recipient_user_obj = crud.get_user_by_id(db, UUID(bytes=msg.recipient_id))
-            recipient_username_val = (recipient_user_obj or {}).username or "Desconhecido"
-
-            decrypted_messages_out.append(schemas.MessageDecryptedOut(
-                id=UUID(bytes=msg.id),
-                content=decrypted_content,
-                created_at=msg.created_at,
-                sender_id=UUID(bytes=msg.sender_id),
-                sender_username=sender_username_val,
-                recipient_id=UUID(bytes=msg.recipient_id),
-                recipient_username=recipient_username_val,
-                is_integrity_valid=is_integrity_valid
-            ))
+    # Descriptografa e verifica em lotes, em paralelo no pool de criptografia
+    decrypt_results = dict(zip(
+        (msg.id for msg in decryptable_messages),
+        await crypto_executor.map_chunks(decrypt_and_verify_chunk, decrypt_items),
+    ))
 
-        except Exception as e:
-            print(f"Erro ao descriptografar/verificar mensagem {msg.id}: {e}")
-            decrypted_messages_out.append(schemas.MessageDecryptedOut(
-                id=UUID(bytes=msg.id),
-                content=f"[Erro de Descriptografia/Verificação no servidor: {e}]",
-                created_at=msg.created_at,
-                sender_id=UUID(bytes=msg.sender_id),
-                sender_username=(crud.get_user_by_id(db, UUID(bytes=msg.sender_id)) or {}).username or "Desconhecido",
-                recipient_id=UUID(bytes=msg.recipient_id),
-                recipient_username=(crud.get_user_by_id(db, UUID(bytes=msg.recipient_id)) or {}).username or "Desconhecido",
-                is_integrity_valid=False
-            ))
+    decrypted_messages_out = []
+    for msg in messages:
+        result = decrypt_results.get(msg.id)
+
+        if result is None:
+            logger.warning("Remetente %s ou sua chave privada não encontrada no servidor.", UUID(bytes=msg.sender_id))
+            content = "[Mensagem cifrada - Não foi possível descriptografar no servidor]"
+            is_integrity_valid = False
+        else:
+            decrypted_content, is_integrity_valid, error = result
+            if error is not None:
+                metrics.DECRYPT_ERRORS.labels("history").inc()
+                logger.warning("Erro ao descriptografar/verificar mensagem %s: %s", UUID(bytes=msg.id), error)
+                content = f"[Erro de Descriptografia/Verificação no servidor: {error}]"
+            elif decrypted_content is None:
+                content = INTEGRITY_FAILED_CONTENT
+            else:
+                content = decrypted_content
+            if error is None and not is_integrity_valid:
+                metrics.INTEGRITY_FAILURES.labels("history").inc()
+
+        decrypted_messages_out.append(schemas.MessageDecryptedOut(
+            id=UUID(bytes=msg.id),
+            content=content,
+            created_at=msg.created_at,
+            sender_id=UUID(bytes=msg.sender_id),
+            sender_username=username_of(msg.sender_id),
+            recipient_id=UUID(bytes=msg.recipient_id),
+            recipient_username=username_of(msg.recipient_id),
+            is_integrity_valid=is_integrity_valid
+        ))
 
     return decrypted_messages_out
 
 
+async def resolve_history_cursors(
+    db: AsyncSession, user1_id: UUID, user2_id: UUID, before: Optional[UUID], after: Optional[UUID]
+) -> Tuple[Optional[crud.MessageCursor], Optional[crud.MessageCursor]]:
+    """Converte os IDs de mensagem recebidos em `before`/`after` em cursores de paginação."""
+    before_cursor = after_cursor = None
+    if before is not None:
+        before_cursor = await crud_async.get_message_cursor(db, user1_id, user2_id, before)
+        if before_cursor is None:
+            raise HTTPException(status_code=400, detail="Cursor 'before' não pertence a esta conversa")
+    if after is not None:
+        after_cursor = await crud_async.get_message_cursor(db, user1_id, user2_id, after)
+        if after_cursor is None:
+            raise HTTPException(status_code=400, detail="Cursor 'after' não pertence a esta conversa")
+    return before_cursor, after_cursor
+
+
+@app.get("/messages/{user1_id}/{user2_id}", response_model=List[schemas.MessageDecryptedOut])
+async def get_conversation(
+    user1_id: UUID,
+    user2_id: UUID,
+    before: Optional[UUID] = Query(None, description="ID de mensagem: retorna apenas mensagens anteriores a ela"),
+    after: Optional[UUID] = Query(None, description="ID de mensagem: retorna apenas mensagens posteriores a ela"),
+    limit: Optional[int] = Query(None, ge=1, le=config.HISTORY_MAX_PAGE_SIZE, description="Quantidade máxima de mensagens"),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """
+    Endpoint para listar as mensagens trocadas entre dois usuários, em ordem cronológica.
+    As mensagens são DESCRIPTOGRAFADAS pelo servidor usando a CHAVE PRIVADA DO REMETENTE original.
+    A integridade é VERIFICADA.
+
+    Paginação por cursor: `limit` sozinho retorna as mensagens mais recentes; `before`/`after`
+    recebem o ID de uma mensagem da conversa (ex.: a primeira/última da página atual).
+    Sem parâmetros, retorna a conversa inteira.
+    """
+    # As mensagens da conversa ficam no shard do par de usuários
+    async with message_shards.session_for_pair(user1_id, user2_id) as shard_db:
+        before_cursor, after_cursor = await resolve_history_cursors(shard_db, user1_id, user2_id, before, after)
+        messages = await crud_async.get_messages_between_users(
+            shard_db, user1_id, user2_id, before=before_cursor, after=after_cursor, limit=limit
+        )
+
+    # Uma conversa envolve apenas os dois participantes: carrega ambos em uma única consulta
+    participants = await crud_async.get_users_by_ids(db, (user1_id, user2_id))
+
+    return await decrypt_history_batch(messages, participants)
+
+
+async def stream_history_ndjson(
+    user1_id: UUID,
+    user2_id: UUID,
+    before_cursor: Optional[crud.MessageCursor],
+    after_cursor: Optional[crud.MessageCursor],
+) -> AsyncIterator[bytes]:
+    """
+    Gera o histórico como NDJSON (uma mensagem por linha), lendo o cursor do banco em lotes.
+    Enquanto um lote é descriptografado no pool, o próximo já é lido do banco.
+    """
+    # Sessão própria: a resposta continua sendo gerada depois que o endpoint retorna
+    async with AsyncSessionLocal() as db:
+        participants = await crud_async.get_users_by_ids(db, (user1_id, user2_id))
+
+    async with message_shards.session_for_pair(user1_id, user2_id) as shard_db:
+        batches = crud_async.iter_messages_between_users(
+            shard_db, user1_id, user2_id, config.HISTORY_STREAM_BATCH_SIZE, before=before_cursor, after=after_cursor
+        )
+
+        pending: Optional[asyncio.Future] = None
+        try:
+            async for batch in batches:
+                decrypting = asyncio.ensure_future(decrypt_history_batch(batch, participants))
+                if pending is not None:
+                    yield "".join(m.model_dump_json() + "\n" for m in await pending).encode("utf-8")
+                pending = decrypting
+            if pending is not None:
+                yield "".join(m.model_dump_json() + "\n" for m in await pending).encode("utf-8")
+                pending = None
+        finally:
+            # Cliente desconectou no meio do envio: não deixa a tarefa de descriptografia órfã
+            if pending is not None:
+                pending.cancel()
+            await batches.aclose()
+
+
+@app.get("/messages/{user1_id}/{user2_id}/stream")
+async def stream_conversation(
+    user1_id: UUID,
+    user2_id: UUID,
+    before: Optional[UUID] = Query(None, description="ID de mensagem: retorna apenas mensagens anteriores a ela"),
+    after: Optional[UUID] = Query(None, description="ID de mensagem: retorna apenas mensagens posteriores a ela"),
+):
+    """
+    Variante em streaming de /messages/{user1_id}/{user2_id}: envia as mensagens DESCRIPTOGRAFADAS
+    em NDJSON (`application/x-ndjson`, um MessageDecryptedOut por linha), em ordem cronológica,
+    à medida que são lidas do banco. O uso de memória não cresce com o tamanho da conversa.
+    """
+    async with message_shards.session_for_pair(user1_id, user2_id) as shard_db:
+        before_cursor, after_cursor = await resolve_history_cursors(shard_db, user1_id, user2_id, before, after)
+    return StreamingResponse(
+        stream_history_ndjson(user1_id, user2_id, before_cursor, after_cursor),
+        media_type="application/x-ndjson",
+    )
+
+
+@app.get("/conversations/{user_id}", response_model=List[schemas.ConversationSummaryOut])
+async def get_inbox(
+    user_id: UUID,
+    before: Optional[UUID] = Query(None, description="ID do contato da última conversa da página anterior"),
+    limit: int = Query(config.INBOX_DEFAULT_PAGE_SIZE, ge=1, le=config.INBOX_MAX_PAGE_SIZE, description="Quantidade máxima de conversas"),
+):
+    """
+    Caixa de entrada do usuário: suas conversas, da mais recente para a mais antiga, com a
+    última mensagem, o total de mensagens e as não lidas. Responde apenas a partir da
+    tabela de resumos (sem ler nem descriptografar mensagens).
+
+    Paginação por cursor: `before` recebe o `peer_id` da última conversa da página atual.
+    Com vários shards, a mesma página é lida de cada um e as páginas são intercaladas.
+    """
+    before_cursor = None
+    if before is not None:
+        async with message_shards.session_for_pair(user_id, before) as shard_db:
+            before_cursor = await crud_async.get_inbox_cursor(shard_db, user_id, before)
+        if before_cursor is None:
+            raise HTTPException(status_code=400, detail="Cursor 'before' não pertence a esta caixa de entrada")
+
+    async def shard_page(index: int) -> List[models.Conversation]:
+        async with message_shards.session(index) as shard_db:
+            return await crud_async.get_inbox(shard_db, user_id, before_cursor, limit)
+
+    pages = await asyncio.gather(*(shard_page(index) for index in range(message_shards.count)))
+    if len(pages) == 1:
+        return pages[0]
+    # Mesma ordem de crud.inbox_select: última mensagem mais recente primeiro, depois peer_id
+    conversations = [conversation for page in pages for conversation in page]
+    conversations.sort(key=lambda c: (c.last_message_at, c.peer_id), reverse=True)
+    return conversations[:limit]
+
+
+@app.post("/conversations/{user_id}/{peer_id}/read", status_code=status.HTTP_204_NO_CONTENT)
+async def mark_conversation_read(user_id: UUID, peer_id: UUID):
+    """Marca como lidas as mensagens recebidas por user_id de peer_id (zera unread_count)."""
+    async with message_shards.session_for_pair(user_id, peer_id) as shard_db:
+        found = await crud_async.mark_conversation_read(shard_db, user_id, peer_id)
+    if not found:
+        raise HTTPException(status_code=404, detail="Conversa não encontrada")
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
+@app.get("/ready")
+async def readiness():
+    """
+    Prontidão do worker: 200 depois da criação do esquema e do aquecimento (cache de chaves,
+    diretório de usuários e consultas); 503 enquanto isso. Para o balanceador/orquestrador.
+    """
+    if not startup_report.ready:
+        return Response(
+            content=b'{"status":"starting"}',
+            media_type="application/json",
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        )
+    return {"status": "ready", "ready_after_seconds": startup_report.ready_after}
+
+
+@app.get("/stats/startup")
+async def startup_stats():
+    """
+    Endpoint com os tempos da inicialização deste worker: importação, criação do esquema,
+    cada etapa do aquecimento, o instante em que ficou pronto e a latência da primeira
+    requisição atendida (sondagens como /ready e /stats/* não contam).
+    """
+    return startup_report.stats()
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """
+    Métricas no formato de texto do Prometheus: duração de cada etapa do processamento de
+    mensagens de chat, contadores de falhas de integridade e de descriptografia, conexões
+    ativas e profundidade das filas internas. Com vários workers, cada um expõe as suas.
+    """
+    return Response(content=metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
+
+@app.get("/stats/key-cache")
+async def key_cache_stats():
+    """
+    Endpoint com os contadores do cache de chaves privadas (acertos, falhas, remoções),
+    usado para dimensionar o cache sob carga. Com SAFECHAT_CRYPTO_POOL_KIND=process, cobre
+    apenas o processo principal (cada processo do pool tem o próprio cache).
+    """
+    return private_key_cache.stats()
+
+
+@app.get("/stats/pending-deliveries")
+async def pending_deliveries_stats():
+    """
+    Endpoint com os contadores das entregas pendentes (eventos guardados para usuários
+    offline, reenviados na reconexão e confirmados).
+    """
+    return pending_store.stats()
+
+
+@app.get("/stats/user-directory")
+async def user_directory_stats():
+    """
+    Endpoint com o estado do diretório de usuários em memória (versão, usuários carregados,
+    respostas completas, deltas e 304).
+    """
+    return user_directory.stats()
+
+
+@app.get("/stats/session-key-cache")
+async def session_key_cache_stats():
+    """
+    Endpoint com os contadores do cache de chaves de sessão AES-GCM já desembrulhadas.
+    Um acerto significa uma mensagem descriptografada sem nenhuma operação RSA.
+    """
+    return session_key_cache.stats()
+
+
+@app.get("/stats/rate-limit")
+async def rate_limit_stats():
+    """
+    Contadores do controle de admissão das mensagens recebidas via WebSocket: mensagens
+    admitidas, limitadas pelo balde do usuário ou pelo global, e quadros adiados/rejeitados
+    (incluindo os rejeitados por fila de entrada cheia).
+    """
+    return {
+        **rate_limiter.stats(),
+        "chat_batch_limit": CHAT_BATCH_LIMIT,
+        "inbound_queue_max_size": config.WS_INBOUND_QUEUE_MAX_SIZE,
+        "rate_limited": {
+            f"{scope}_{action}": int(value)
+            for (scope, action), value in metrics.RATE_LIMITED.values().items()
+        },
+    }
+
+
+@app.get("/stats/crypto-pool")
+async def crypto_pool_stats():
+    """
+    Endpoint com o estado do pool de criptografia (tarefas em andamento e aguardando vaga).
+    """
+    return crypto_executor.stats()
+
+
+@app.get("/stats/key-pool")
+async def key_pool_stats():
+    """
+    Endpoint com o estado da reserva de chaves pré-geradas: profundidade atual (`depth`)
+    e quantas vezes um registro precisou gerar chaves na hora (`stalls`).
+    """
+    return key_pair_pool.stats()
+
+
+@app.get("/stats/connections")
+async def connection_stats():
+    """
+    Endpoint com o estado das conexões WebSocket: profundidade da fila de envio, eventos
+    descartados e latência de envio por conexão, e clientes lentos desconectados.
+    """
+    return manager.stats()
+
+
+@app.get("/stats/message-writer")
+async def message_writer_stats():
+    """
+    Endpoint com os contadores da gravação em lote de mensagens (lotes gravados,
+    tamanho médio e máximo dos lotes, mensagens aguardando gravação).
+    """
+    return message_writer.stats()
+
+
+# --- Inicialização e aquecimento ---
+
+# Mensagens recentes percorridas (por shard) para cada remetente procurado no aquecimento
+WARMUP_SCAN_FACTOR = 8
+# ID que não pertence a nenhum usuário, usado para executar as consultas uma vez no aquecimento
+_WARMUP_ID = UUID(int=0)
+
+warmup_task: Optional[asyncio.Task] = None
+
+
+async def warm_up_queries() -> None:
+    """
+    Executa uma vez as consultas do caminho principal (sem resultados): abre as conexões dos
+    pools, aplica os PRAGMAs e deixa as instruções no cache de compilação do SQLAlchemy.
+    """
+    async with AsyncSessionLocal() as db:
+        await crud_async.get_user_by_username(db, "")
+        await crud_async.get_users_by_ids(db, (_WARMUP_ID,))
+        await crud_async.get_pending_deliveries(db, _WARMUP_ID, 0, 1)
+    for index in range(message_shards.count):
+        async with message_shards.session(index) as shard_db:
+            await crud_async.get_message_cursor(shard_db, _WARMUP_ID, _WARMUP_ID, _WARMUP_ID)
+            await crud_async.get_messages_between_users(shard_db, _WARMUP_ID, _WARMUP_ID, limit=1)
+            await crud_async.get_inbox(shard_db, _WARMUP_ID, None, 1)
+
+
+async def warm_up_private_keys(limit: int) -> int:
+    """Carrega no cache as chaves privadas dos remetentes mais recentes. Retorna quantas."""
+    if limit <= 0:
+        return 0
+
+    async def recent_senders(index: int) -> List[bytes]:
+        async with message_shards.session(index) as shard_db:
+            return await crud_async.get_recent_sender_ids(shard_db, limit, limit * WARMUP_SCAN_FACTOR)
+
+    per_shard = await asyncio.gather(*(recent_senders(index) for index in range(message_shards.count)))
+    # Intercala os shards (a ordem de inserção só é comparável dentro de cada arquivo)
+    sender_ids = list(dict.fromkeys(
+        sender_id for sender_id in chain.from_iterable(zip_longest(*per_shard)) if sender_id is not None
+    ))[:limit]
+    if not sender_ids:
+        return 0
+
+    async with AsyncSessionLocal() as db:
+        users = await crud_async.get_users_by_ids(db, (UUID(bytes=sender_id) for sender_id in sender_ids))
+    items = [(UUID(bytes=u.id), u.private_key_encrypted) for u in users.values() if u.private_key_encrypted]
+    return sum(await crypto_executor.map_chunks(preload_private_keys_chunk, items))
+
+
+async def warm_up() -> None:
+    """
+    Aquecimento em segundo plano: o worker já atende as requisições, mas só responde
+    /ready depois de carregar o estado mais usado. Falhas não impedem que fique pronto.
+    """
+    try:
+        with startup_report.phase("warmup"):
+            with startup_report.phase("warmup_user_directory"):
+                async with AsyncSessionLocal() as db:
+                    await user_directory.warm(db)
+            with startup_report.phase("warmup_queries"):
+                await warm_up_queries()
+            with startup_report.phase("warmup_private_keys"):
+                keys_loaded = await warm_up_private_keys(
+                    min(config.WARMUP_RECENT_USERS, config.KEY_CACHE_MAX_ENTRIES)
+                )
+        startup_report.warmup.update(
+            users_in_directory=user_directory.stats()["users"],
+            private_keys_loaded=keys_loaded,
+            message_shards=message_shards.count,
+        )
+    except Exception as e:
+        logger.warning("Falha no aquecimento (o worker continua sem ele): %s", e)
+    startup_report.mark_ready()
+    logger.info("Worker pronto em %.3fs", startup_report.ready_after)
+
+
+async def start_background_workers():
+    global warmup_task
+    # Cria as tabelas no banco de dados se elas não existirem e adiciona colunas e
+    # índices novos a bancos criados por versões anteriores (fora do event loop)
+    with startup_report.phase("schema"):
+        await asyncio.to_thread(ensure_schema, engine)
+        await asyncio.to_thread(message_shards.ensure_schema)
+    key_pair_pool.start()
+    message_writer.start()
+    pending_store.start()
+    await manager.start()
+    if config.WARMUP_ENABLED:
+        warmup_task = asyncio.create_task(warm_up())
+    else:
+        startup_report.mark_ready()
+
+
+async def shutdown_background_workers():
+    if warmup_task is not None and not warmup_task.done():
+        warmup_task.cancel()
+        await asyncio.gather(warmup_task, return_exceptions=True)
+    await manager.stop()
+    await message_writer.stop()
+    await pending_store.stop()
+    await key_pair_pool.stop()
+    await message_shards.dispose()
+    await crypto_executor.shutdown()
+
+
 # --- Endpoint WebSocket ---
 
+# Tipos de mensagem aceitos pelo WebSocket (os demais são contados como "unknown" nas métricas)
+WS_MESSAGE_TYPES = ("CHAT_MESSAGE", "CHAT_BATCH", "ACK")
+
+async def receive_message(websocket: WebSocket) -> Dict:
+    """Recebe a próxima mensagem do cliente: quadros de texto em JSON ou binários em msgpack."""
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", status.WS_1000_NORMAL_CLOSURE))
+    text = message.get("text")
+    with metrics.CHAT_STAGE_SECONDS.labels("parse").time():
+        return decode_message(text if text is not None else message.get("bytes"))
+
+
+async def handle_chat_batch(user_id: UUID, payload: Dict) -> None:
+    """
+    Processa um CHAT_BATCH: valida e descriptografa todas as mensagens em lote, grava as
+    aceitas em um único INSERT/commit e envia a cada destinatário um único evento CHAT_BATCH
+    com as suas mensagens. O remetente recebe todas as mensagens aceitas e a lista de erros
+    por item (`index` na lista recebida).
+    """
+    raw_messages = payload.get("messages") if isinstance(payload, dict) else None
+    if not isinstance(raw_messages, list):
+        await manager.send_personal_message({"error": "CHAT_BATCH requer payload.messages (lista)"}, user_id)
+        return
+    if len(raw_messages) > CHAT_BATCH_LIMIT:
+        await manager.send_personal_message(
+            {"error": f"CHAT_BATCH excede o limite de {CHAT_BATCH_LIMIT} mensagens"}, user_id
+        )
+        return
+
+    errors: List[Dict] = []
+    parsed: List[Tuple[int, schemas.MessageEncryptedIn]] = []
+    with metrics.CHAT_STAGE_SECONDS.labels("batch_validate").time():
+        for index, raw in enumerate(raw_messages):
+            try:
+                parsed.append((index, schemas.MessageEncryptedIn(**raw)))
+            except Exception as e:
+                metrics.VALIDATION_ERRORS.inc()
+                errors.append({"index": index, "error": f"Erro de validação da mensagem de chat: {e}"})
+
+    # Remetentes e destinatários de todo o lote em uma única consulta
+    with metrics.CHAT_STAGE_SECONDS.labels("batch_user_lookup").time():
+        async with AsyncSessionLocal() as db:
+            participants = await crud_async.get_users_by_ids(
+                db, {uid for _, m in parsed for uid in (m.sender_id, m.recipient_id)}
+            )
+
+    decrypt_items = []
+    decryptable: List[Tuple[int, schemas.MessageEncryptedIn]] = []
+    for index, message in parsed:
+        sender_user = participants.get(message.sender_id.bytes)
+        if not sender_user or not sender_user.private_key_encrypted:
+            metrics.VALIDATION_ERRORS.inc()
+            errors.append({"index": index, "error": "Remetente ou sua chave privada não encontrada no servidor para descriptografia."})
+            continue
+        decrypt_items.append(DecryptItem(
+            message.sender_id,
+            sender_user.private_key_encrypted,
+            message.encrypted_content,
+            message.message_hash,
+            message.scheme,
+            message.wrapped_key,
+            message.nonce,
+            message.recipient_id,
+        ))
+        decryptable.append((index, message))
+
+    # Descriptografa em blocos no pool de criptografia; o erro de um item não afeta os demais
+    accepted: List[Tuple[schemas.MessageEncryptedIn, Optional[str], bool]] = []
+    with metrics.CHAT_STAGE_SECONDS.labels("batch_decrypt").time():
+        decrypt_results = await crypto_executor.map_chunks(decrypt_and_verify_chunk, decrypt_items)
+    for (index, message), (content, is_integrity_valid, error) in zip(decryptable, decrypt_results):
+        if error is not None:
+            metrics.DECRYPT_ERRORS.labels("batch").inc()
+            errors.append({"index": index, "error": f"Erro de Descriptografia/Verificação no servidor: {error}"})
+            continue
+        if not is_integrity_valid:
+            metrics.INTEGRITY_FAILURES.labels("batch").inc()
+        accepted.append((message, content if content is not None else INTEGRITY_FAILED_CONTENT, is_integrity_valid))
+
+    # Grava todas as mensagens aceitas juntas (mesmo INSERT e mesma transação)
+    with metrics.CHAT_STAGE_SECONDS.labels("batch_db_commit").time():
+        db_messages = await message_writer.submit_many([message for message, _, _ in accepted])
+
+    def username_of(user_id_bytes: bytes) -> str:
+        user = participants.get(user_id_bytes)
+        return user.username if user else "Desconhecido"
+
+    # Agrupa as mensagens por destinatário: cada um recebe um único evento
+    by_recipient: Dict[UUID, List[Dict]] = {}
+    all_payloads: List[Dict] = []
+    for db_message, (message, content, is_integrity_valid) in zip(db_messages, accepted):
+        message_payload = chat_message_payload(
+            db_message.id,
+            content,
+            db_message.created_at,
+            db_message.sender_id,
+            username_of(db_message.sender_id),
+            db_message.recipient_id,
+            username_of(db_message.recipient_id),
+            is_integrity_valid,
+        )
+        all_payloads.append(message_payload)
+        if message.recipient_id != user_id:
+            by_recipient.setdefault(message.recipient_id, []).append(message_payload)
+
+    errors.sort(key=lambda item: item["index"])
+    with metrics.CHAT_STAGE_SECONDS.labels("batch_enqueue").time():
+        await manager.send_personal_message(Frame(chat_batch_event(all_payloads, errors)), user_id)
+        for recipient_id, recipient_payloads in by_recipient.items():
+            await manager.send_personal_message(Frame(chat_batch_event(recipient_payloads)), recipient_id, durable=True)
+
+
+async def handle_chat_message(user_id: UUID, payload: Dict) -> None:
+    """
+    Processa um CHAT_MESSAGE: descriptografa com a CHAVE PRIVADA DO REMETENTE, verifica a
+    integridade, grava a mensagem cifrada e a retransmite em CLARO ao remetente e ao destinatário.
+    """
+    try:
+        # Valida a mensagem cifrada recebida do cliente
+        with metrics.CHAT_STAGE_SECONDS.labels("validate").time():
+            parsed_message = schemas.MessageEncryptedIn(**payload)
+    except Exception as e:
+        metrics.VALIDATION_ERRORS.inc()
+        await manager.send_personal_message(f"Erro de validação da mensagem de chat: {e}", user_id)
+        return
+
+    # Pega o REMETENTE (para acessar sua chave privada e descriptografar) e o
+    # DESTINATÁRIO em uma única consulta
+    with metrics.CHAT_STAGE_SECONDS.labels("user_lookup").time():
+        async with AsyncSessionLocal() as db:
+            participants = await crud_async.get_users_by_ids(db, (parsed_message.sender_id, parsed_message.recipient_id))
+    sender_user = participants.get(parsed_message.sender_id.bytes)
+    if not sender_user or not sender_user.private_key_encrypted:
+        metrics.VALIDATION_ERRORS.inc()
+        await manager.send_personal_message("Erro: Remetente ou sua chave privada não encontrada no servidor para descriptografia.", user_id)
+        return
+
+
+    # Descriptografa com a CHAVE PRIVADA DO REMETENTE e verifica a integridade (hash),
+    # no pool de criptografia para não bloquear as demais conexões. As etapas
+    # (carga da chave, descriptografia, hash) são medidas onde executam.
+    try:
+        decrypted_content, is_integrity_valid, crypto_timings = await crypto_executor.run(
+            decrypt_and_verify_timed,
+            parsed_message.sender_id,
+            sender_user.private_key_encrypted,
+            parsed_message.encrypted_content,
+            parsed_message.message_hash,
+            parsed_message.scheme,
+            parsed_message.wrapped_key,
+            parsed_message.nonce,
+            parsed_message.recipient_id,
+        )
+    except Exception:
+        metrics.DECRYPT_ERRORS.labels("message").inc()
+        raise
+    for stage, seconds in crypto_timings.items():
+        metrics.CHAT_STAGE_SECONDS.labels(stage).observe(seconds)
+    if not is_integrity_valid:
+        metrics.INTEGRITY_FAILURES.labels("message").inc()
+    if decrypted_content is None:
+        decrypted_content = INTEGRITY_FAILED_CONTENT
+
+    # Salva a mensagem cifrada original no banco de dados (o backend não guarda plaintext),
+    # no mesmo commit das demais mensagens que chegaram na mesma janela
+    with metrics.CHAT_STAGE_SECONDS.labels("db_commit").time():
+        db_message = await message_writer.submit(parsed_message)
+
+    # Prepara a mensagem DESCRIPTOGRAFADA para envio ao destinatário E remetente
+    recipient_user_obj = participants.get(parsed_message.recipient_id.bytes)
+    recipient_username_val = recipient_user_obj.username if recipient_user_obj else "Desconhecido"
+
+    # Um único Frame para os dois envios: o evento é serializado uma vez por codificação
+    chat_broadcast_message = Frame(chat_message_event(
+        db_message.id,
+        decrypted_content,
+        db_message.created_at,
+        db_message.sender_id,
+        sender_user.username,
+        db_message.recipient_id,
+        recipient_username_val,
+        is_integrity_valid,
+    ))
+
+    # Só o enfileiramento: o envio pelo socket é medido pela tarefa de cada conexão (WS_SEND_SECONDS)
+    with metrics.CHAT_STAGE_SECONDS.labels("enqueue").time():
+        # Envia a mensagem DESCRIPTOGRAFADA para o remetente (para ele ver sua própria mensagem enviada)
+        await manager.send_personal_message(chat_broadcast_message, user_id)
+
+        # Envia a mensagem DESCRIPTOGRAFADA para o destinatário
+        if parsed_message.sender_id != parsed_message.recipient_id: 
+            await manager.send_personal_message(chat_broadcast_message, parsed_message.recipient_id, durable=True)
+
+
+def crypto_cost(message_type: Optional[str], payload: Dict) -> int:
+    """Descriptografias exigidas por uma mensagem recebida (unidade dos baldes do rate limiter)."""
+    if message_type == "CHAT_MESSAGE":
+        return 1
+    if message_type == "CHAT_BATCH" and isinstance(payload, dict) and isinstance(payload.get("messages"), list):
+        return len(payload["messages"])
+    return 0
+
+
+async def reject_frame(user_id: UUID, message_type: Optional[str], scope: str, retry_after: float) -> None:
+    """Avisa o cliente de que um quadro foi descartado pelo controle de admissão."""
+    metrics.RATE_LIMITED.labels(scope, "rejected").inc()
+    await manager.send_personal_message(
+        Frame(rate_limited_event(scope, "rejected", retry_after, message_type)), user_id
+    )
+
+
+async def admit(user_id: UUID, message_type: Optional[str], payload: Dict) -> bool:
+    """
+    Controle de admissão do trabalho criptográfico: consome do balde do usuário e do balde
+    global o custo da mensagem. Sem fichas, a política "defer" aguarda (até
+    SAFECHAT_RATE_LIMIT_MAX_DEFER_MS) e a política "reject" descarta a mensagem; em ambos os
+    casos o cliente recebe um evento RATE_LIMITED.
+    """
+    cost = crypto_cost(message_type, payload)
+    if cost == 0 or not rate_limiter.enabled:
+        return True
+    if cost > CHAT_BATCH_LIMIT:
+        # Lote acima do limite: recusado por handle_chat_batch sem consumir fichas
+        return True
+    deferred = 0.0
+    notified = False
+    while True:
+        scope, retry_after = rate_limiter.try_acquire(user_id, cost)
+        if scope is None:
+            return True
+        if deferred + retry_after > rate_limiter.max_defer_seconds:
+            await reject_frame(user_id, message_type, scope, retry_after)
+            return False
+        if not notified:
+            # Um aviso por mensagem adiada: o cliente pode reduzir o ritmo de envio
+            metrics.RATE_LIMITED.labels(scope, "deferred").inc()
+            await manager.send_personal_message(
+                Frame(rate_limited_event(scope, "deferred", retry_after, message_type)), user_id
+            )
+            notified = True
+        await asyncio.sleep(retry_after)
+        deferred += retry_after
+
+
+async def handle_ws_message(user_id: UUID, message_data: Dict) -> None:
+    """Despacha uma mensagem recebida pelo WebSocket, após o controle de admissão."""
+    # Verifica o tipo de mensagem recebida pelo WebSocket
+    message_type = message_data.get("type") if isinstance(message_data, dict) else None
+    metrics.WS_MESSAGES_RECEIVED.labels(
+        message_type if message_type in WS_MESSAGE_TYPES else "unknown"
+    ).inc()
+    payload = message_data.get("payload", {}) if isinstance(message_data, dict) else {}
+
+    if not await admit(user_id, message_type, payload):
+        return
+
+    if message_type == "CHAT_MESSAGE":
+        await handle_chat_message(user_id, payload)
+
+    elif message_type == "CHAT_BATCH":
+        await handle_chat_batch(user_id, payload)
+
+    elif message_type == "ACK":
+        # Confirmação de recebimento dos eventos pendentes até o seq informado
+        try:
+            acked_seq = int(payload["seq"])
+        except Exception:
+            await manager.send_personal_message({"error": "ACK requer payload.seq (inteiro)"}, user_id)
+            return
+        await pending_store.ack(user_id, acked_seq)
+
+    else:
+        logger.info("Tipo de mensagem WebSocket desconhecido: %s", message_type)
+        await manager.send_personal_message({"error": f"Tipo de mensagem desconhecido: {message_type}"}, user_id)
+
+
 @app.websocket("/ws/{user_id}")
-async def websocket_endpoint(websocket: WebSocket, user_id: UUID, db: Session = Depends(get_db)):
+async def websocket_endpoint(websocket: WebSocket, user_id: UUID, last_seq: int = Query(0, ge=0)):
     """
     Endpoint WebSocket para comunicação em tempo real de mensagens privadas.
     O servidor DESCRIPTOGRAFA a mensagem usando a CHAVE PRIVADA DO REMETENTE
     e verifica a integridade antes de retransmitir a mensagem em CLARO para o destinatário e remetente.
+
+    O cliente pode negociar a codificação pelo subprotocolo do WebSocket: "safechat.msgpack"
+    (quadros binários MessagePack nos dois sentidos) ou "safechat.json" (padrão).
+
+    Cada mensagem usa uma sessão de banco curta, em vez de uma sessão mantida durante toda
+    a conexão (cujo mapa de identidade cresceria sem limite).
+
+    Ao conectar, os eventos recebidos enquanto o usuário estava offline são reenviados em
+    lotes PENDING_BATCH a partir de `?last_seq=` (último seq confirmado pelo cliente);
+    o cliente confirma o recebimento com {"type": "ACK", "payload": {"seq": N}}.
     """
     
     # Verifica se o usuário que está se conectando existe
-    connecting_user = crud.get_user_by_id(db, user_id)
+    async with AsyncSessionLocal() as db:
+        connecting_user = await crud_async.get_user_by_id(db, user_id)
     if not connecting_user:
         await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="User not found")
         return
 
-    await manager.connect(user_id, websocket)
-    try:
-        while True:
-            data = await websocket.receive_text()
-            
-            message_data: Dict = json.loads(data)
-            
-            # Verifica o tipo de mensagem recebida pelo WebSocket
-            message_type = message_data.get("type")
-            
-            if message_type == "CHAT_MESSAGE":
-                try:
-                    # Valida a mensagem cifrada recebida do cliente
-                    parsed_message = schemas.MessageEncryptedIn(**message_data.get("payload", {}))
-                except Exception as e:
-                    await manager.send_personal_message(f"Erro de validação da mensagem de chat: {e}", user_id)
-                    continue
-                
-                # Pega o usuário REMETENTE para acessar sua chave privada e descriptografar
-                sender_user = crud.get_user_by_id(db, parsed_message.sender_id)
-                if not sender_user or not sender_user.private_key_encrypted:
-                    await manager.send_personal_message("Erro: Remetente ou sua chave privada não encontrada no servidor para descriptografia.", user_id)
+    await manager.connect(user_id, websocket, negotiate(websocket.scope.get("subprotocols", [])))
+    # Quadros recebidos e ainda não processados. O limite é aplicado em read_frames (a fila
+    # em si não tem limite, para que o marcador de fim sempre caiba).
+    inbound: "asyncio.Queue[Optional[Dict]]" = asyncio.Queue()
+
+    async def read_frames() -> None:
+        """Recebe quadros do cliente; com a fila cheia, o quadro é rejeitado com RATE_LIMITED."""
+        try:
+            while True:
+                message_data = await receive_message(websocket)
+                if inbound.qsize() >= config.WS_INBOUND_QUEUE_MAX_SIZE:
+                    message_type = message_data.get("type") if isinstance(message_data, dict) else None
+                    await reject_frame(user_id, message_type, SCOPE_QUEUE, 0.0)
                     continue
+                inbound.put_nowait(message_data)
+        finally:
+            # Os quadros já aceitos ainda são processados antes de encerrar
+            inbound.put_nowait(None)
 
-                
-                # Carrega a chave privada como objeto, diretamente do HEX salvo no DB
-                sender_private_key_obj = retrieve_private_key_as_obj(sender_user.private_key_encrypted)
-                
-                # Descriptografa o conteúdo da mensagem com a CHAVE PRIVADA DO REMETENTE
-                decrypted_content = rsa_decrypt_backend(parsed_message.encrypted_content, sender_private_key_obj)
-
-                # Verifica a integridade (hash)
-                calculated_hash = sha256_hash_backend(decrypted_content)
-                is_integrity_valid = (calculated_hash == parsed_message.message_hash)
-
-                # Salva a mensagem cifrada original no banco de dados (o backend não guarda plaintext)
-                db_message = crud.create_message(db, parsed_message)
-                
-                # Prepara a mensagem DESCRIPTOGRAFADA para envio ao destinatário E remetente
-                sender_username_val = sender_user.username
-                recipient_user_obj = crud.get_user_by_id(db, parsed_message.recipient_id)
-                recipient_username_val = (recipient_user_obj or {}).username or "Desconhecido"
-
-                # NOVO: Converte os campos UUID para string explicitamente aqui antes de model_dump()
-                message_to_send_decrypted_dict = {
-                    "id": str(UUID(bytes=db_message.id)), # Converte UUID para string
-                    "content": decrypted_content,
-                    "created_at": db_message.created_at.isoformat(), # Converte datetime para ISO format string
-                    "sender_id": str(UUID(bytes=db_message.sender_id)), # Converte UUID para string
-                    "sender_username": sender_username_val,
-                    "recipient_id": str(UUID(bytes=db_message.recipient_id)), # Converte UUID para string
-                    "recipient_username": recipient_username_val,
-                    "is_integrity_valid": is_integrity_valid
-                }
-                
-                # Encapsula a mensagem de chat para broadcast
-                chat_broadcast_message = {
-                    "type": "CHAT_MESSAGE",
-                    "payload": message_to_send_decrypted_dict # Passa o dicionário já serializável
-                }
-
-                # Envia a mensagem DESCRIPTOGRAFADA para o remetente (para ele ver sua própria mensagem enviada)
-                await manager.send_personal_message(chat_broadcast_message, user_id)
-                
-                # Envia a mensagem DESCRIPTOGRAFADA para o destinatário
-                if parsed_message.sender_id != parsed_message.recipient_id: 
-                    await manager.send_personal_message(chat_broadcast_message, parsed_message.recipient_id)
-            
-            else:
-                print(f"Tipo de mensagem WebSocket desconhecido: {message_type}")
-                await manager.send_personal_message({"error": f"Tipo de mensagem desconhecido: {message_type}"}, user_id)
+    reader = asyncio.create_task(read_frames())
+    try:
+        # Repõe os eventos perdidos enquanto o usuário estava offline
+        await manager.replay_pending(user_id, last_seq)
+
+        # Processa os quadros em ordem, um de cada vez, enquanto o leitor continua recebendo
+        while True:
+            message_data = await inbound.get()
+            if message_data is None:
+                break
+            await handle_ws_message(user_id, message_data)
+        # O leitor terminou: propaga o motivo (desconexão ou erro de decodificação)
+        await reader
 
     except WebSocketDisconnect:
-        manager.disconnect(user_id)
+        manager.disconnect(user_id, websocket)
     except Exception as e:
-        print(f"WebSocket error for user {user_id}: {e}")
-        manager.disconnect(user_id)
-        await manager.send_personal_message({"error": f"Um erro inesperado ocorreu: {e}"}, user_id)
\ No newline at end of file
+        logger.exception("Erro no WebSocket do usuário %s: %s", user_id, e)
+        manager.disconnect(user_id, websocket)
+        await manager.send_personal_message({"error": f"Um erro inesperado ocorreu: {e}"}, user_id)
+    finally:
+        if not reader.done():
+            reader.cancel()
+            await asyncio.gather(reader, return_exceptions=True)
+
+
+# Fim da importação: o restante da inicialização acontece no lifespan
+startup_report.record("import", time.perf_counter() - _import_started)
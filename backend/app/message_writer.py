@@ -0,0 +1,168 @@
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+from . import crud, crud_async, models, schemas
+from .sharding import MessageShards
+
+logger = logging.getLogger(__name__)
+
+# Grupo de mensagens enviado junto (uma mensagem, ou um CHAT_BATCH inteiro) e o futuro
+# resolvido quando o lote que o contém é gravado. Um grupo nunca é dividido entre lotes.
+_PendingGroup = Tuple[List[Dict[str, Any]], asyncio.Future]
+
+
+class MessageBatchWriter:
+    """
+    Grava mensagens de chat em lote (group commit): as mensagens que chegam dentro de
+    uma pequena janela de tempo, ou até `max_batch_size`, são persistidas em uma única
+    transação, com um único fsync.
+
+    IDs e datas de criação são gerados na aplicação (crud.build_message_values), então
+    `submit` retorna a mensagem completa sem precisar reler a linha do banco.
+
+    Com vários shards, cada lote é dividido por shard e as partes são gravadas em paralelo
+    (uma transação por shard). Um grupo que abrange mais de um shard só é confirmado quando
+    todas as suas partes são gravadas, mas não é atômico entre shards.
+    """
+
+    def __init__(
+        self,
+        shards: MessageShards,
+        max_batch_size: int,
+        window_seconds: float,
+    ):
+        self._shards = shards
+        self.max_batch_size = max_batch_size
+        self.window_seconds = window_seconds
+        self._queue: "asyncio.Queue[_PendingGroup]" = asyncio.Queue()
+        self._queued_messages = 0
+        # Grupo retirado da fila que não coube no lote anterior (abre o próximo lote)
+        self._pending: Optional[_PendingGroup] = None
+        self._task: Optional[asyncio.Task] = None
+
+        self.batches = 0
+        self.messages = 0
+        self.failed_batches = 0
+        self.max_batch_seen = 0
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Encerra o gravador depois de persistir as mensagens já enfileiradas."""
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        remaining = [self._pending] if self._pending is not None else []
+        self._pending = None
+        while not self._queue.empty():
+            remaining.append(self._take(self._queue.get_nowait()))
+        if remaining:
+            await self._flush(remaining)
+
+    async def submit(self, message: schemas.MessageEncryptedIn) -> models.Message:
+        """Enfileira uma mensagem e aguarda o commit do lote que a contém."""
+        return (await self.submit_many([message]))[0]
+
+    async def submit_many(self, messages: List[schemas.MessageEncryptedIn]) -> List[models.Message]:
+        """
+        Enfileira várias mensagens (ex.: um CHAT_BATCH) e aguarda o commit. Elas são gravadas
+        juntas, no mesmo INSERT e na mesma transação, mesmo que excedam `max_batch_size`.
+        """
+        if not messages:
+            return []
+        self.start()
+        rows = [crud.build_message_values(message) for message in messages]
+        done = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((rows, done))
+        self._queued_messages += len(rows)
+        await done
+        return [models.Message(**values) for values in rows]
+
+    def _take(self, group: _PendingGroup) -> _PendingGroup:
+        self._queued_messages -= len(group[0])
+        return group
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch: List[_PendingGroup] = [self._pending or self._take(await self._queue.get())]
+            self._pending = None
+            size = len(batch[0][0])
+            deadline = loop.time() + self.window_seconds
+            while size < self.max_batch_size:
+                # Primeiro consome o que já está na fila, depois espera o fim da janela
+                try:
+                    group = self._take(self._queue.get_nowait())
+                except asyncio.QueueEmpty:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        group = self._take(await asyncio.wait_for(self._queue.get(), timeout))
+                    except asyncio.TimeoutError:
+                        break
+                if size + len(group[0]) > self.max_batch_size:
+                    # Não cabe neste lote: abre o próximo
+                    self._pending = group
+                    break
+                batch.append(group)
+                size += len(group[0])
+            await self._flush(batch)
+
+    async def _flush(self, batch: List[_PendingGroup]) -> None:
+        by_shard: Dict[int, List[Dict[str, Any]]] = {}
+        group_shards = []
+        for group_rows, _ in batch:
+            indexes = set()
+            for values in group_rows:
+                index = self._shards.index_for_key(values["conversation_key"])
+                by_shard.setdefault(index, []).append(values)
+                indexes.add(index)
+            group_shards.append(indexes)
+
+        results = await asyncio.gather(
+            *(self._write_shard(index, rows) for index, rows in by_shard.items()),
+            return_exceptions=True,
+        )
+        errors = {index: result for index, result in zip(by_shard, results) if isinstance(result, Exception)}
+
+        for (_, done), indexes in zip(batch, group_shards):
+            if done.done():
+                continue
+            error = next((errors[index] for index in indexes if index in errors), None)
+            if error is not None:
+                done.set_exception(error)
+            else:
+                done.set_result(None)
+
+    async def _write_shard(self, index: int, rows: List[Dict[str, Any]]) -> None:
+        try:
+            async with self._shards.session(index) as db:
+                await crud_async.insert_messages(db, rows)
+                await db.commit()
+        except Exception as e:
+            self.failed_batches += 1
+            logger.error("Erro ao gravar lote de %d mensagens (shard %d): %s", len(rows), index, e)
+            raise
+
+        self.batches += 1
+        self.messages += len(rows)
+        self.max_batch_seen = max(self.max_batch_seen, len(rows))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": self._queued_messages,
+            "batches": self.batches,
+            "messages": self.messages,
+            "failed_batches": self.failed_batches,
+            "avg_batch_size": (self.messages / self.batches) if self.batches else 0.0,
+            "max_batch_size_seen": self.max_batch_seen,
+            "max_batch_size": self.max_batch_size,
+            "window_ms": self.window_seconds * 1000,
+            "shards": self._shards.count,
+        }
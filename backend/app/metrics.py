@@ -0,0 +1,289 @@
+import bisect
+import math
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Métricas no formato de exposição de texto do Prometheus, sem dependências externas.
+# As atualizações acontecem no event loop (um worker = um registro); com vários workers,
+# cada processo expõe os seus próprios valores em /metrics.
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[LabelValues, object] = {}
+
+    def labels(self, *values: str):
+        """Série com os valores de rótulo informados (criada no primeiro uso)."""
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} espera os rótulos {self.labelnames}")
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            child = self._children[key] = self._new_child()
+        return child
+
+    def _default(self):
+        # Métricas sem rótulos são usadas diretamente (metric.inc(), metric.observe(...))
+        return self.labels()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class _CounterValue:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+
+class Counter(_Metric):
+    """Contador monotônico."""
+    kind = "counter"
+
+    def _new_child(self) -> _CounterValue:
+        return _CounterValue()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self._default().inc(amount)
+
+    def values(self) -> Dict[LabelValues, float]:
+        """Valor atual de cada série, por valores de rótulo."""
+        return {key: child.value for key, child in self._children.items()}
+
+    def _samples(self) -> List[str]:
+        return [
+            f"{self.name}_total{_format_labels(self.labelnames, key)} {_format_value(child.value)}"
+            for key, child in self._children.items()
+        ]
+
+
+class _GaugeValue:
+    __slots__ = ("value", "function")
+
+    def __init__(self):
+        self.value = 0.0
+        self.function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.value -= amount
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        """O valor passa a ser lido de `function` a cada coleta (ex.: profundidade de uma fila)."""
+        self.function = function
+
+    def get(self) -> float:
+        return float(self.function()) if self.function is not None else self.value
+
+
+class Gauge(_Metric):
+    """Valor que sobe e desce (conexões ativas, profundidade de filas)."""
+    kind = "gauge"
+
+    def _new_child(self) -> _GaugeValue:
+        return _GaugeValue()
+
+    def set(self, value: float) -> None:
+        self._default().set(value)
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        self._default().set_function(function)
+
+    def _samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(child.get())}"
+            for key, child in self._children.items()
+        ]
+
+
+# Limites (segundos) adequados a etapas entre dezenas de microssegundos e alguns segundos
+DEFAULT_BUCKETS = (
+    0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+)
+
+
+class _HistogramValue:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.counts):
+            self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        """Observa a duração (segundos) do bloco."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+
+class Histogram(_Metric):
+    """Distribuição de durações em faixas cumulativas (_bucket, _sum, _count)."""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self) -> _HistogramValue:
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self._default().observe(value)
+
+    def time(self):
+        return self._default().time()
+
+    def _samples(self) -> List[str]:
+        lines = []
+        for key, child in self._children.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, child.counts):
+                cumulative += count
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(self.labelnames, key, ('le', _format_value(bound)))} {cumulative}"
+                )
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, ('le', '+Inf'))} {child.count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(child.sum)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {child.count}")
+        return lines
+
+
+class Registry:
+    """Conjunto de métricas expostas por /metrics."""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Métrica já registrada: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+REGISTRY = Registry()
+
+# Tipo de conteúdo do formato de texto do Prometheus
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+# --- Métricas do pipeline de chat ---
+
+# Etapas: parse (JSON/msgpack), validate (pydantic), user_lookup (remetente/destinatário no banco),
+# key_load, decrypt, hash_check (criptografia, medidas no pool), db_commit (gravação em lote) e
+# enqueue (colocação nas filas de envio ou encaminhamento ao broker; o envio em si é WS_SEND_SECONDS)
+CHAT_STAGE_SECONDS = REGISTRY.register(Histogram(
+    "safechat_chat_stage_seconds",
+    "Duração de cada etapa do processamento de mensagens de chat recebidas via WebSocket.",
+    ["stage"],
+))
+# Eventos enviados pelos WebSockets: queue_wait (tempo na fila de envio da conexão) e send
+# (escrita no socket), medidos pela tarefa de envio de cada conexão
+WS_SEND_SECONDS = REGISTRY.register(Histogram(
+    "safechat_ws_send_seconds",
+    "Tempo dos eventos na fila de envio de cada conexão e da escrita no socket.",
+    ["phase"],
+))
+WS_MESSAGES_RECEIVED = REGISTRY.register(Counter(
+    "safechat_ws_messages_received",
+    "Mensagens recebidas via WebSocket, por tipo.",
+    ["type"],
+))
+VALIDATION_ERRORS = REGISTRY.register(Counter(
+    "safechat_validation_errors",
+    "Mensagens de chat rejeitadas na validação (formato, campos ou remetente desconhecido).",
+))
+INTEGRITY_FAILURES = REGISTRY.register(Counter(
+    "safechat_integrity_failures",
+    "Mensagens cuja verificação de integridade falhou (hash ou tag AES-GCM).",
+    ["path"],
+))
+DECRYPT_ERRORS = REGISTRY.register(Counter(
+    "safechat_decrypt_errors",
+    "Mensagens que não puderam ser descriptografadas.",
+    ["path"],
+))
+
+RATE_LIMITED = REGISTRY.register(Counter(
+    "safechat_rate_limited",
+    "Mensagens recebidas via WebSocket adiadas ou rejeitadas pelo controle de admissão.",
+    ["scope", "action"],
+))
+
+# --- Estado do servidor (lido a cada coleta) ---
+
+ACTIVE_CONNECTIONS = REGISTRY.register(Gauge(
+    "safechat_active_connections",
+    "Conexões WebSocket abertas neste worker.",
+))
+STARTUP_SECONDS = REGISTRY.register(Gauge(
+    "safechat_startup_seconds",
+    "Duração de cada fase da inicialização deste worker (ready: do início da importação até ficar pronto).",
+    ["phase"],
+))
+READY = REGISTRY.register(Gauge(
+    "safechat_ready",
+    "1 quando este worker concluiu a inicialização e o aquecimento.",
+))
+QUEUE_DEPTH = REGISTRY.register(Gauge(
+    "safechat_queue_depth",
+    "Itens aguardando em cada fila interna deste worker.",
+    ["queue"],
+))
@@ -0,0 +1,101 @@
+"""
+Converte, em um banco existente, as chaves e conteúdos gravados como texto (HEX/base64)
+por versões anteriores para BLOBs com os bytes crus.
+
+A conversão é feita em lotes curtos (uma transação por lote), então pode rodar com o
+servidor em funcionamento: enquanto isso, as linhas ainda não convertidas continuam sendo
+lidas normalmente (models.CompactBinary decodifica o texto na leitura).
+
+Uso (a partir do diretório backend/):
+
+    python -m app.migrate_binary --db chat.db
+    python -m app.migrate_binary --db chat.db --vacuum   # recupera o espaço liberado (bloqueia o banco)
+"""
+import argparse
+import os
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+from .database import make_engine
+from .models import decode_legacy_text
+
+# (tabela, coluna, codificação antiga)
+BINARY_COLUMNS: List[Tuple[str, str, str]] = [
+    ("users", "public_key", "hex"),
+    ("users", "private_key_encrypted", "hex"),
+    ("messages", "encrypted_content", "base64"),
+    ("messages", "message_hash", "hex"),
+    ("messages", "wrapped_key", "base64"),
+    ("messages", "nonce", "base64"),
+]
+
+
+def _existing_columns(engine: Engine, table: str) -> List[str]:
+    with engine.connect() as conn:
+        return [row[1] for row in conn.execute(text(f"PRAGMA table_info({table})"))]
+
+
+def convert_column(engine: Engine, table: str, column: str, legacy_encoding: str, batch_size: int) -> Dict[str, int]:
+    """Converte uma coluna em lotes, percorrendo a tabela pelo rowid. Retorna os contadores."""
+    converted = failed = 0
+    last_rowid = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(
+                text(
+                    f"SELECT rowid, {column} FROM {table} "
+                    f"WHERE rowid > :last AND typeof({column}) = 'text' ORDER BY rowid LIMIT :limit"
+                ),
+                {"last": last_rowid, "limit": batch_size},
+            ).all()
+            if not rows:
+                return {"converted": converted, "failed": failed}
+            updates = []
+            for rowid, value in rows:
+                try:
+                    updates.append({"rowid": rowid, "value": decode_legacy_text(value, legacy_encoding)})
+                except ValueError:
+                    # Valor corrompido: fica como texto (e é reportado)
+                    failed += 1
+            if updates:
+                conn.execute(text(f"UPDATE {table} SET {column} = :value WHERE rowid = :rowid"), updates)
+            converted += len(updates)
+            last_rowid = rows[-1][0]
+
+
+def migrate(db_path: str, batch_size: int, vacuum: bool) -> Dict[str, Dict[str, int]]:
+    engine = make_engine(f"sqlite:///{db_path}")
+    results = {}
+    try:
+        for table, column, legacy_encoding in BINARY_COLUMNS:
+            if column not in _existing_columns(engine, table):
+                continue
+            results[f"{table}.{column}"] = convert_column(engine, table, column, legacy_encoding, batch_size)
+        if vacuum:
+            with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                conn.execute(text("VACUUM"))
+    finally:
+        engine.dispose()
+    return results
+
+
+def main(argv: Optional[list] = None) -> None:
+    parser = argparse.ArgumentParser(description="Converte chaves e conteúdos em texto (HEX/base64) para BLOBs.")
+    parser.add_argument("--db", default="chat.db", help="arquivo SQLite (padrão: chat.db)")
+    parser.add_argument("--batch-size", type=int, default=1000, help="linhas convertidas por transação")
+    parser.add_argument("--vacuum", action="store_true", help="executa VACUUM ao final para reduzir o arquivo")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.db):
+        parser.error(f"banco não encontrado: {args.db}")
+    size_before = os.path.getsize(args.db)
+    results = migrate(args.db, args.batch_size, args.vacuum)
+    for name, counters in results.items():
+        print(f"{name}: {counters['converted']} convertidas, {counters['failed']} com erro")
+    print(f"Tamanho do arquivo: {size_before} -> {os.path.getsize(args.db)} bytes")
+
+
+if __name__ == "__main__":
+    main()
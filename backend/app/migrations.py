@@ -0,0 +1,111 @@
+import time
+from typing import Optional, Sequence
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+
+from . import models
+from .database import Base
+
+# Atualizações de esquema para bancos criados por versões anteriores.
+# Base.metadata.create_all só cria tabelas inexistentes: colunas e índices novos em
+# tabelas já existentes precisam ser adicionados aqui.
+
+BACKFILL_BATCH_SIZE = 1000
+
+
+def _add_missing_columns(engine: Engine, table, columns) -> None:
+    existing = {c["name"] for c in inspect(engine).get_columns(table.name)}
+    with engine.begin() as conn:
+        for column_name in columns:
+            if column_name not in existing:
+                column = table.c[column_name]
+                column_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column_name} {column_type}"))
+
+
+def _backfill_conversation_keys(engine: Engine) -> None:
+    """Preenche a chave de conversa das mensagens antigas, em lotes."""
+    messages = models.Message.__table__
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(
+                messages.select()
+                .with_only_columns(messages.c.id, messages.c.sender_id, messages.c.recipient_id)
+                .where(messages.c.conversation_key.is_(None))
+                .limit(BACKFILL_BATCH_SIZE)
+            ).all()
+            if not rows:
+                return
+            for row in rows:
+                conn.execute(
+                    messages.update()
+                    .where(messages.c.id == row.id)
+                    .values(conversation_key=models.conversation_key_for(row.sender_id, row.recipient_id))
+                )
+
+
+def _backfill_conversations(engine: Engine) -> None:
+    """
+    Monta os resumos de conversa a partir do histórico quando a tabela acabou de ser criada
+    em um banco que já tinha mensagens. As mensagens antigas entram como lidas.
+    """
+    with engine.begin() as conn:
+        if conn.execute(text("SELECT 1 FROM conversations LIMIT 1")).first() is not None:
+            return
+        if conn.execute(text("SELECT 1 FROM messages LIMIT 1")).first() is None:
+            return
+        # Última mensagem de cada par na ordem do histórico (created_at, rowid): mensagens antigas
+        # do mesmo segundo são desempatadas pela ordem de inserção
+        conn.execute(text(
+            "INSERT OR IGNORE INTO conversations "
+            "(user_id, peer_id, last_message_id, last_message_at, message_count, unread_count) "
+            "SELECT user_id, peer_id, id, created_at, message_count, 0 FROM ("
+            "  SELECT user_id, peer_id, id, created_at,"
+            "    count(*) OVER (PARTITION BY user_id, peer_id) AS message_count,"
+            "    row_number() OVER (PARTITION BY user_id, peer_id ORDER BY created_at DESC, message_rowid DESC) AS position"
+            "  FROM ("
+            "    SELECT sender_id AS user_id, recipient_id AS peer_id, id, created_at, rowid AS message_rowid FROM messages"
+            "    UNION ALL"
+            "    SELECT recipient_id, sender_id, id, created_at, rowid FROM messages WHERE recipient_id != sender_id"
+            "  )"
+            ") WHERE position = 1"
+        ))
+
+
+# Índices substituídos por versões posteriores (removidos ao atualizar o esquema)
+_OBSOLETE_INDEXES = (
+    # (conversation_key, created_at, id): desempatava pelo UUID aleatório; ver ix_messages_conversation_order
+    "ix_messages_conversation_created",
+)
+
+
+def upgrade_schema(engine: Engine) -> None:
+    """Aplica as atualizações de esquema pendentes. Pode ser executada a cada inicialização."""
+    _add_missing_columns(engine, models.Message.__table__, ["conversation_key", "scheme", "wrapped_key", "nonce"])
+    _backfill_conversation_keys(engine)
+    _backfill_conversations(engine)
+    for index in models.Message.__table__.indexes:
+        index.create(bind=engine, checkfirst=True)
+    with engine.begin() as conn:
+        for index_name in _OBSOLETE_INDEXES:
+            conn.execute(text(f"DROP INDEX IF EXISTS {index_name}"))
+
+
+def ensure_schema(engine: Engine, attempts: int = 5, tables: Optional[Sequence] = None) -> None:
+    """
+    Cria as tabelas inexistentes e aplica as atualizações pendentes. `tables` restringe as
+    tabelas criadas (ex.: apenas mensagens e resumos, em um shard de mensagens).
+    Com vários workers iniciando ao mesmo tempo, outro processo pode criar a mesma
+    tabela entre a verificação e o CREATE: nesse caso a operação é repetida.
+    """
+    for attempt in range(attempts):
+        try:
+            Base.metadata.create_all(bind=engine, tables=tables)
+            upgrade_schema(engine)
+            return
+        except OperationalError:
+            if attempt == attempts - 1:
+                raise
+            time.sleep(0.2 * (attempt + 1))
@@ -1,10 +1,57 @@
+import base64
 import uuid
-from sqlalchemy import Column, String, DateTime, ForeignKey, Text, LargeBinary
+from datetime import datetime, timezone
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Index, Text, LargeBinary
+from sqlalchemy.types import TypeDecorator
 from sqlalchemy.dialects.sqlite import BLOB
 from sqlalchemy.orm import relationship
-from sqlalchemy.sql import func
 from .database import Base
 
+
+def utc_now() -> datetime:
+    """
+    Data/hora atual em UTC (sem fuso, como o CURRENT_TIMESTAMP do SQLite), com microssegundos
+    para que mensagens do mesmo segundo mantenham a ordem de envio no histórico.
+    """
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def decode_legacy_text(value: str, legacy_encoding: str) -> bytes:
+    """Converte um valor gravado como texto por versões anteriores ("hex" ou "base64") em bytes."""
+    if legacy_encoding == "hex":
+        return bytes.fromhex(value)
+    return base64.b64decode(value)
+
+
+class CompactBinary(TypeDecorator):
+    """
+    Bytes gravados como BLOB (sem hex/base64, que aumentam o tamanho em 33-100%).
+
+    Bancos criados por versões anteriores guardam o mesmo valor como texto em
+    `legacy_encoding`; essas linhas são decodificadas na leitura, até serem convertidas
+    pela ferramenta `python -m app.migrate_binary`. A codificação em texto fica só na API.
+    """
+
+    impl = LargeBinary
+    cache_ok = True
+
+    def __init__(self, legacy_encoding: str):
+        super().__init__()
+        self.legacy_encoding = legacy_encoding
+
+    def process_result_value(self, value, dialect):
+        if isinstance(value, str):
+            return decode_legacy_text(value, self.legacy_encoding)
+        return value
+
+
+def conversation_key_for(user_a_id: bytes, user_b_id: bytes) -> bytes:
+    """
+    Chave canônica de uma conversa entre dois usuários: os dois IDs (16 bytes cada)
+    concatenados em ordem crescente, independente de quem enviou a mensagem.
+    """
+    return user_a_id + user_b_id if user_a_id <= user_b_id else user_b_id + user_a_id
+
 class User(Base):
     __tablename__ = "users"
 
@@ -12,12 +59,13 @@ class User(Base):
     username = Column(String, unique=True, index=True, nullable=False)
     password = Column(String, nullable=False) # Lembre-se: HASHEAR SENHAS em produção!
     
-    # Chave pública do usuário (em formato PEM) - Usada para criptografar para este usuário no frontend
-    public_key = Column(Text, nullable=True) 
-    # Chave privada do usuário (em formato PEM, criptografada com senha ou chave mestra do servidor)
+    # Chave pública do usuário (DER SPKI, em bytes) - Usada para criptografar para este usuário no frontend
+    # (a API a expõe em HEX)
+    public_key = Column(CompactBinary("hex"), nullable=True)
+    # Chave privada do usuário (DER PKCS8, em bytes)
     # ATENÇÃO: NUNCA SALVE A CHAVE PRIVADA SEM CRIPTOGRAFIA FORTE EM PROD!
     # Esta chave privada será usada pelo SERVIDOR para descriptografar mensagens.
-    private_key_encrypted = Column(Text, nullable=True) 
+    private_key_encrypted = Column(CompactBinary("hex"), nullable=True)
 
     # Relação para mensagens enviadas por este usuário
     sent_messages = relationship("Message", foreign_keys="Message.sender_id", back_populates="sender")
@@ -29,14 +77,22 @@ class Message(Base):
     __tablename__ = "messages"
 
     id = Column(BLOB(16), primary_key=True, default=lambda: uuid.uuid4().bytes)
-    # Conteúdo da mensagem Cifrado (originalmente pelo remetente com a sua PRÓPRIA chave pública)
-    encrypted_content = Column(Text, nullable=False)
+    # Conteúdo da mensagem Cifrado (originalmente pelo remetente com a sua PRÓPRIA chave pública),
+    # em bytes (a API o recebe em base64)
+    encrypted_content = Column(CompactBinary("base64"), nullable=False)
     
-    # Hash da mensagem original (plaintext) para verificação de integridade
-    # Gerado pelo remetente, verificado pelo servidor.
-    message_hash = Column(String, nullable=False) 
+    # Hash SHA256 da mensagem original (plaintext) para verificação de integridade, 32 bytes
+    # Gerado pelo remetente (em HEX na API), verificado pelo servidor.
+    message_hash = Column(CompactBinary("hex"), nullable=False)
+
+    # Esquema de cifragem do conteúdo ("rsa-oaep" ou "aes-gcm"; NULL em mensagens antigas = "rsa-oaep").
+    # No esquema "aes-gcm", message_hash pode ficar vazio: a tag do GCM garante a integridade.
+    scheme = Column(String, nullable=True)
+    # Chave de sessão AES embrulhada com RSA-OAEP e nonce do AES-GCM, em bytes (base64 na API)
+    wrapped_key = Column(CompactBinary("base64"), nullable=True)
+    nonce = Column(CompactBinary("base64"), nullable=True)
     
-    created_at = Column(DateTime, default=func.now())
+    created_at = Column(DateTime, default=utc_now)
     
     # ID do remetente (para identificar quem enviou)
     sender_id = Column(BLOB(16), ForeignKey("users.id"), nullable=False)
@@ -44,4 +100,53 @@ class Message(Base):
 
     # ID do destinatário (para identificar quem deve receber a mensagem)
     recipient_id = Column(BLOB(16), ForeignKey("users.id"), nullable=False)
-    recipient = relationship("User", foreign_keys=[recipient_id], back_populates="received_messages")
\ No newline at end of file
+    recipient = relationship("User", foreign_keys=[recipient_id], back_populates="received_messages")
+
+    # Chave canônica da conversa (ver conversation_key_for), usada para paginar o histórico
+    # por índice em vez de filtrar por (sender_id, recipient_id) nos dois sentidos
+    conversation_key = Column(BLOB(32), nullable=True)
+
+    __table_args__ = (
+        # O rowid, implícito no fim de todo índice do SQLite, desempata mensagens do mesmo instante
+        Index("ix_messages_conversation_order", "conversation_key", "created_at"),
+    )
+
+
+class PendingDelivery(Base):
+    """
+    Evento (já serializado em JSON) destinado a um usuário que estava offline, guardado até
+    que o cliente confirme o recebimento (ACK). `seq` é o número de sequência confirmado
+    pelo cliente; AUTOINCREMENT garante que ele nunca é reutilizado, mesmo após exclusões.
+    """
+    __tablename__ = "pending_deliveries"
+
+    seq = Column(Integer, primary_key=True, autoincrement=True)
+    recipient_id = Column(BLOB(16), ForeignKey("users.id"), nullable=False)
+    event = Column(Text, nullable=False)
+    created_at = Column(DateTime, default=utc_now)
+
+    __table_args__ = (
+        Index("ix_pending_deliveries_recipient_seq", "recipient_id", "seq"),
+        {"sqlite_autoincrement": True},
+    )
+
+
+class Conversation(Base):
+    """
+    Resumo de uma conversa do ponto de vista de um participante (uma linha para cada lado),
+    atualizado na mesma transação que grava as mensagens. Permite montar a caixa de entrada
+    sem percorrer o histórico.
+    """
+    __tablename__ = "conversations"
+
+    user_id = Column(BLOB(16), ForeignKey("users.id"), primary_key=True)
+    peer_id = Column(BLOB(16), ForeignKey("users.id"), primary_key=True)
+    last_message_id = Column(BLOB(16), nullable=False)
+    last_message_at = Column(DateTime, nullable=False)
+    message_count = Column(Integer, nullable=False, default=0)
+    # Mensagens recebidas de peer_id ainda não marcadas como lidas por user_id
+    unread_count = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        Index("ix_conversations_user_last", "user_id", "last_message_at", "peer_id"),
+    )
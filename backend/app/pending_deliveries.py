@@ -0,0 +1,177 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+from uuid import UUID
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import crud_async, models
+from .wire import ENCODING_JSON, Frame
+
+logger = logging.getLogger(__name__)
+
+
+class PendingDeliveryStore:
+    """
+    Fila persistente de eventos para destinatários offline (store-and-forward).
+
+    Eventos que não puderam ser entregues são gravados em `pending_deliveries` com um número
+    de sequência crescente. Ao reconectar, o cliente informa o último `seq` confirmado e
+    recebe apenas os eventos posteriores, em lotes (PENDING_BATCH); cada ACK remove os
+    eventos confirmados. O custo da reconexão depende só do que foi perdido, não do
+    tamanho do histórico.
+
+    A gravação é feita em segundo plano, em lotes (um commit para vários eventos); `flush`
+    aguarda os eventos ainda em memória antes de uma reposição.
+
+    Clientes que nunca confirmam não fazem a tabela crescer sem limite: cada destinatário
+    guarda no máximo `max_per_recipient` eventos (os mais antigos são descartados) e eventos
+    com mais de `ttl_seconds` expiram. O que for descartado continua no histórico (/messages).
+    """
+
+    # Intervalo mínimo entre duas varreduras de eventos expirados de todos os destinatários
+    EXPIRY_SWEEP_INTERVAL_SECONDS = 60.0
+
+    def __init__(
+        self,
+        session_factory: Callable[[], AsyncSession],
+        replay_batch_size: int,
+        max_per_recipient: int = 0,
+        ttl_seconds: float = 0,
+    ):
+        self._session_factory = session_factory
+        self.replay_batch_size = replay_batch_size
+        self.max_per_recipient = max_per_recipient
+        self.ttl_seconds = ttl_seconds
+        self._queue: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+        self._last_sweep = 0.0
+
+        self.stored = 0
+        self.replayed = 0
+        self.acked = 0
+        self.pruned = 0
+        self.failed_batches = 0
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Encerra a gravação em segundo plano depois de persistir os eventos já enfileirados."""
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        remaining = []
+        while not self._queue.empty():
+            remaining.append(self._queue.get_nowait())
+            self._queue.task_done()
+        if remaining:
+            await self._write(remaining)
+
+    def store(self, recipient_id: UUID, frame: Frame) -> None:
+        """Enfileira um evento para gravação, sem bloquear quem o enviou."""
+        self.start()
+        self._queue.put_nowait({
+            "recipient_id": recipient_id.bytes,
+            "event": frame.encode(ENCODING_JSON),
+            "created_at": models.utc_now(),
+        })
+
+    async def flush(self) -> None:
+        """Aguarda a gravação dos eventos já enfileirados neste processo."""
+        if self._task is not None and not self._task.done():
+            await self._queue.join()
+
+    async def _run(self) -> None:
+        while True:
+            rows = [await self._queue.get()]
+            while not self._queue.empty():
+                rows.append(self._queue.get_nowait())
+            try:
+                await self._write(rows)
+            finally:
+                for _ in rows:
+                    self._queue.task_done()
+
+    def _expired_before(self) -> Optional[datetime]:
+        if self.ttl_seconds <= 0:
+            return None
+        return models.utc_now() - timedelta(seconds=self.ttl_seconds)
+
+    async def _write(self, rows: List[Dict[str, Any]]) -> None:
+        expired_before = self._expired_before()
+        sweep = expired_before is not None and (
+            time.monotonic() - self._last_sweep >= self.EXPIRY_SWEEP_INTERVAL_SECONDS
+        )
+        try:
+            async with self._session_factory() as db:
+                await crud_async.insert_pending_deliveries(db, rows)
+                # Limites de retenção dos destinatários do lote, na mesma transação
+                pruned = 0
+                for recipient_id in {row["recipient_id"] for row in rows}:
+                    pruned += await crud_async.prune_pending_deliveries(
+                        db, UUID(bytes=recipient_id), self.max_per_recipient, expired_before
+                    )
+                if sweep:
+                    pruned += await crud_async.delete_expired_pending_deliveries(db, expired_before)
+                await db.commit()
+        except Exception as e:
+            self.failed_batches += 1
+            logger.error("Erro ao gravar %d entregas pendentes: %s", len(rows), e)
+            return
+        if sweep:
+            self._last_sweep = time.monotonic()
+        self.stored += len(rows)
+        self.pruned += pruned
+
+    async def ack(self, recipient_id: UUID, up_to_seq: int) -> int:
+        """Remove os eventos confirmados pelo cliente (seq <= up_to_seq)."""
+        async with self._session_factory() as db:
+            deleted = await crud_async.delete_pending_deliveries(db, recipient_id, up_to_seq)
+            await db.commit()
+        self.acked += deleted
+        return deleted
+
+    async def replay(self, recipient_id: UUID, after_seq: int) -> AsyncIterator[Tuple[int, Frame]]:
+        """
+        Gera os eventos pendentes com seq > after_seq em lotes de `replay_batch_size`, cada um
+        como um Frame PENDING_BATCH (e o último seq do lote). Os eventos já estão serializados
+        no banco: o lote é montado sem decodificá-los.
+        """
+        await self.flush()
+        expired_before = self._expired_before()
+        if expired_before is not None:
+            async with self._session_factory() as db:
+                self.pruned += await crud_async.prune_pending_deliveries(db, recipient_id, 0, expired_before)
+                await db.commit()
+        while True:
+            async with self._session_factory() as db:
+                rows = await crud_async.get_pending_deliveries(db, recipient_id, after_seq, self.replay_batch_size)
+            if not rows:
+                return
+            after_seq = rows[-1].seq
+            events = ",".join(f'{{"seq":{row.seq},"event":{row.event}}}' for row in rows)
+            self.replayed += len(rows)
+            yield after_seq, Frame.from_json(
+                f'{{"type":"PENDING_BATCH","payload":{{"last_seq":{after_seq},"events":[{events}]}}}}'
+            )
+            if len(rows) < self.replay_batch_size:
+                return
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": self._queue.qsize(),
+            "stored": self.stored,
+            "replayed": self.replayed,
+            "acked": self.acked,
+            "pruned": self.pruned,
+            "failed_batches": self.failed_batches,
+            "replay_batch_size": self.replay_batch_size,
+            "max_per_recipient": self.max_per_recipient,
+            "ttl_seconds": self.ttl_seconds,
+        }
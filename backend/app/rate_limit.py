@@ -0,0 +1,159 @@
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+from uuid import UUID
+
+# Escopos de limitação informados ao cliente e nas métricas
+SCOPE_USER = "user"
+SCOPE_GLOBAL = "global"
+SCOPE_QUEUE = "queue"
+
+RATE_LIMIT_POLICIES = ("defer", "reject")
+
+
+class TokenBucket:
+    """
+    Balde de fichas: acumula `rate` fichas por segundo até `capacity`. Uma operação de
+    custo N só é admitida se houver N fichas; custos maiores que a capacidade nunca são
+    admitidos (o chamador limita o custo a RateLimiter.max_cost).
+    """
+
+    __slots__ = ("rate", "capacity", "tokens", "updated_at")
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = now
+
+    def _refill(self, now: float) -> None:
+        if now > self.updated_at:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+
+    def available(self, cost: float, now: float) -> float:
+        """Segundos até haver fichas para `cost` (0 se já houver)."""
+        self._refill(now)
+        missing = cost - self.tokens
+        return missing / self.rate if missing > 0 else 0.0
+
+    def take(self, cost: float) -> None:
+        self.tokens -= cost
+
+    def is_full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class RateLimiter:
+    """
+    Controle de admissão do trabalho criptográfico recebido via WebSocket: um balde por
+    usuário e um balde global do worker, medidos em mensagens (cada mensagem de chat custa
+    uma descriptografia RSA/AES). Uma taxa 0 desativa o respectivo balde. Sem fichas, a
+    política "defer" aguarda até `max_defer_seconds` e "reject" rejeita imediatamente
+    (aplicadas pelo chamador).
+
+    Baldes de usuários cheios equivalem a baldes novos e são descartados periodicamente,
+    de modo que a memória acompanha apenas os usuários ativos (e reconectar não renova
+    o crédito de quem acabou de gastá-lo).
+    """
+
+    def __init__(
+        self,
+        user_rate: float,
+        user_burst: float,
+        global_rate: float,
+        global_burst: float,
+        policy: str = "defer",
+        max_defer_seconds: float = 1.0,
+        clock: Callable[[], float] = time.monotonic,
+        prune_interval: int = 1024,
+    ):
+        if policy not in RATE_LIMIT_POLICIES:
+            raise ValueError(f"Política de limitação inválida: {policy}")
+        self.policy = policy
+        # Espera máxima de uma mensagem adiada (0 com a política "reject")
+        self.max_defer_seconds = max_defer_seconds if policy == "defer" else 0.0
+        self.user_rate = user_rate
+        self.user_burst = max(user_burst, 1.0)
+        self.global_rate = global_rate
+        self.global_burst = max(global_burst, 1.0)
+        self._clock = clock
+        self._prune_interval = prune_interval
+        self._users: Dict[UUID, TokenBucket] = {}
+        self._global: Optional[TokenBucket] = (
+            TokenBucket(global_rate, self.global_burst, clock()) if global_rate > 0 else None
+        )
+        self._calls = 0
+
+        self.admitted = 0
+        self.limited_user = 0
+        self.limited_global = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.user_rate > 0 or self._global is not None
+
+    @property
+    def max_cost(self) -> Optional[float]:
+        """
+        Maior custo que algum dia pode ser admitido (a menor rajada entre os baldes ativos),
+        ou None sem limitação. Um CHAT_BATCH maior nunca teria fichas suficientes.
+        """
+        bursts = []
+        if self.user_rate > 0:
+            bursts.append(self.user_burst)
+        if self._global is not None:
+            bursts.append(self.global_burst)
+        return min(bursts) if bursts else None
+
+    def try_acquire(self, user_id: UUID, cost: float) -> Tuple[Optional[str], float]:
+        """
+        Tenta admitir trabalho de custo `cost` do usuário. Retorna (None, 0) se admitido;
+        senão, o escopo que limitou ("user" ou "global") e os segundos até haver fichas.
+        As fichas só são consumidas quando os dois baldes admitem. O custo é cobrado por
+        inteiro, então não pode exceder as rajadas (ver max_cost).
+        """
+        now = self._clock()
+        self._calls += 1
+        if self._calls % self._prune_interval == 0:
+            self._prune(now)
+
+        user_bucket = None
+        if self.user_rate > 0:
+            user_bucket = self._users.get(user_id)
+            if user_bucket is None:
+                user_bucket = self._users[user_id] = TokenBucket(self.user_rate, self.user_burst, now)
+            wait = user_bucket.available(cost, now)
+            if wait > 0:
+                self.limited_user += 1
+                return SCOPE_USER, wait
+        if self._global is not None:
+            wait = self._global.available(cost, now)
+            if wait > 0:
+                self.limited_global += 1
+                return SCOPE_GLOBAL, wait
+
+        if user_bucket is not None:
+            user_bucket.take(cost)
+        if self._global is not None:
+            self._global.take(cost)
+        self.admitted += 1
+        return None, 0.0
+
+    def _prune(self, now: float) -> None:
+        for user_id in [u for u, bucket in self._users.items() if bucket.is_full(now)]:
+            del self._users[user_id]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "policy": self.policy,
+            "max_defer_ms": self.max_defer_seconds * 1000,
+            "user_rate": self.user_rate,
+            "user_burst": self.user_burst,
+            "global_rate": self.global_rate,
+            "global_burst": self.global_burst,
+            "tracked_users": len(self._users),
+            "admitted": self.admitted,
+            "limited_user": self.limited_user,
+            "limited_global": self.limited_global,
+        }
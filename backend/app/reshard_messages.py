@@ -0,0 +1,165 @@
+"""
+Redistribui as mensagens e os resumos de conversa entre shards (app.sharding): de um banco
+único (chat.db) para N arquivos, de N shards para M, ou de volta para o banco principal.
+
+Cada linha vai para o shard da sua conversa (sharding.shard_index). A cópia é feita em lotes
+(uma transação por lote e por destino) e é idempotente: mensagens já copiadas são ignoradas e
+resumos são sobrescritos, então uma execução interrompida pode ser repetida. Execute com o
+servidor parado e depois inicie-o com SAFECHAT_MESSAGE_SHARDS igual ao valor de --shards.
+
+Uso (a partir do diretório backend/):
+
+    python -m app.reshard_messages --db chat.db --shards 4
+    python -m app.reshard_messages --db chat.db --from-shards 4 --shards 8 --delete-source
+    python -m app.reshard_messages --db chat.db --from-shards 4 --shards 1 --delete-source
+"""
+import argparse
+import os
+from typing import Dict, List, Optional
+
+from sqlalchemy import Table, delete, literal_column, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Engine
+
+from . import config, models
+from .database import make_engine
+from .migrations import ensure_schema
+from .sharding import SHARDED_TABLES, shard_index, shard_paths
+
+
+def _database_paths(db_path: str, path_template: str, count: int) -> List[str]:
+    """Banco principal com 1 shard; senão, os arquivos do modelo."""
+    return [db_path] if count <= 1 else shard_paths(path_template, count)
+
+
+def _conversation_key(table: Table, row) -> bytes:
+    if table is models.Message.__table__:
+        return row.conversation_key or models.conversation_key_for(row.sender_id, row.recipient_id)
+    return models.conversation_key_for(row.user_id, row.peer_id)
+
+
+def move_table(
+    table: Table,
+    source: Engine,
+    source_index: Optional[int],
+    targets: List[Engine],
+    batch_size: int,
+    delete_source: bool,
+) -> Dict[int, int]:
+    """
+    Copia as linhas de `table` de `source` para o shard de destino de cada uma, percorrendo a
+    origem pelo rowid. Linhas cujo destino é a própria origem (`source_index`) ficam onde estão.
+    Retorna a quantidade de linhas copiadas por shard de destino.
+    """
+    rowid = literal_column("rowid")
+    if table is models.Message.__table__:
+        statement = sqlite_insert(table).on_conflict_do_nothing()
+    else:
+        # O resumo da origem substitui o do destino (repetir a cópia não soma contadores)
+        statement = sqlite_insert(table).prefix_with("OR REPLACE")
+
+    copied: Dict[int, int] = {}
+    last_rowid = 0
+    while True:
+        with source.connect() as conn:
+            rows = conn.execute(
+                select(rowid, *table.c).where(rowid > last_rowid).order_by(rowid).limit(batch_size)
+            ).all()
+        if not rows:
+            return copied
+        last_rowid = rows[-1][0]
+
+        by_target: Dict[int, List[Dict]] = {}
+        moved_rowids = []
+        for row in rows:
+            index = shard_index(_conversation_key(table, row), len(targets))
+            if index == source_index:
+                continue
+            values = {column.name: row._mapping[column.name] for column in table.c}
+            if table is models.Message.__table__:
+                values["conversation_key"] = _conversation_key(table, row)
+            by_target.setdefault(index, []).append(values)
+            moved_rowids.append(row[0])
+
+        for index, values in by_target.items():
+            with targets[index].begin() as conn:
+                conn.execute(statement, values)
+            copied[index] = copied.get(index, 0) + len(values)
+        # Só apaga da origem depois que o destino confirmou a gravação
+        if delete_source and moved_rowids:
+            with source.begin() as conn:
+                conn.execute(delete(table).where(rowid.in_(moved_rowids)))
+
+
+def _open(path: str, is_main_db: bool) -> Engine:
+    engine = make_engine(f"sqlite:///{path}")
+    # O banco principal recebe o esquema completo; os shards, apenas mensagens e resumos
+    ensure_schema(engine, tables=None if is_main_db else SHARDED_TABLES)
+    return engine
+
+
+def reshard(
+    db_path: str,
+    path_template: str,
+    from_shards: int,
+    to_shards: int,
+    batch_size: int,
+    delete_source: bool,
+) -> Dict[str, Dict[int, int]]:
+    """Move as mensagens e os resumos de `from_shards` para `to_shards` shards. Retorna os contadores."""
+    source_paths = _database_paths(db_path, path_template, from_shards)
+    target_paths = _database_paths(db_path, path_template, to_shards)
+    targets = [_open(path, to_shards <= 1) for path in target_paths]
+    target_by_path = {os.path.abspath(path): index for index, path in enumerate(target_paths)}
+
+    results: Dict[str, Dict[int, int]] = {}
+    try:
+        for path in source_paths:
+            source_index = target_by_path.get(os.path.abspath(path))
+            source = targets[source_index] if source_index is not None else _open(path, from_shards <= 1)
+            try:
+                for table in SHARDED_TABLES:
+                    copied = move_table(table, source, source_index, targets, batch_size, delete_source)
+                    totals = results.setdefault(table.name, {})
+                    for index, count in copied.items():
+                        totals[index] = totals.get(index, 0) + count
+            finally:
+                if source_index is None:
+                    source.dispose()
+    finally:
+        for engine in targets:
+            engine.dispose()
+    return results
+
+
+def main(argv: Optional[list] = None) -> None:
+    parser = argparse.ArgumentParser(description="Redistribui mensagens e resumos de conversa entre shards.")
+    parser.add_argument("--db", default="chat.db", help="banco principal (padrão: chat.db)")
+    parser.add_argument("--shards", type=int, required=True, help="quantidade de shards de destino (1 = banco principal)")
+    parser.add_argument("--from-shards", type=int, default=1, help="quantidade de shards atual (padrão: 1, banco principal)")
+    parser.add_argument(
+        "--shard-path",
+        default=config.MESSAGE_SHARD_PATH,
+        help=f"modelo do caminho dos shards, com {{index}} (padrão: {config.MESSAGE_SHARD_PATH})",
+    )
+    parser.add_argument("--batch-size", type=int, default=1000, help="linhas lidas da origem por lote")
+    parser.add_argument("--delete-source", action="store_true", help="remove da origem as linhas copiadas")
+    args = parser.parse_args(argv)
+
+    if args.shards < 1 or args.from_shards < 1:
+        parser.error("a quantidade de shards deve ser pelo menos 1")
+    for path in _database_paths(args.db, args.shard_path, args.from_shards):
+        if not os.path.exists(path):
+            parser.error(f"banco não encontrado: {path}")
+
+    results = reshard(args.db, args.shard_path, args.from_shards, args.shards, args.batch_size, args.delete_source)
+    target_paths = _database_paths(args.db, args.shard_path, args.shards)
+    for table_name, copied in results.items():
+        for index, count in sorted(copied.items()):
+            print(f"{table_name}: {count} linhas copiadas para {target_paths[index]}")
+        if not copied:
+            print(f"{table_name}: nenhuma linha a mover")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,25 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, field_validator, model_validator
 from datetime import datetime
 from uuid import UUID
-from typing import Optional, List
+from typing import Any, Literal, Optional, List
+import base64
+
+
+# As chaves e os conteúdos cifrados são guardados em bytes; a codificação em texto
+# (HEX/base64) é aplicada apenas aqui, na fronteira da API.
+
+def _hex_from_bytes(value: Any) -> Any:
+    return value.hex() if isinstance(value, (bytes, bytearray)) else value
+
+def _bytes_from_base64(value: Any) -> Any:
+    # Clientes msgpack podem enviar os bytes diretamente
+    return base64.b64decode(value, validate=True) if isinstance(value, str) else value
+
+def _bytes_from_hex(value: Any) -> Any:
+    return bytes.fromhex(value) if isinstance(value, str) else value
+
+def _uuid_from_bytes(value: Any) -> Any:
+    return UUID(bytes=bytes(value)) if isinstance(value, (bytes, bytearray)) else value
 
 # Esquema para criação de usuário (entrada na API)
 class UserCreate(BaseModel):
@@ -15,16 +33,37 @@ class UserResponse(BaseModel):
     username: str
     public_key: Optional[str] = None # Chave pública do usuário (formato HEXADECIMAL)
 
+    _public_key_hex = field_validator("public_key", mode="before")(_hex_from_bytes)
+
     class Config:
         from_attributes = True
 
 # Esquema para uma mensagem cifrada enviada do frontend para o backend
 # O encrypted_content será cifrado com a chave pública do REMETENTE
+# - scheme "rsa-oaep" (padrão): encrypted_content cifrado diretamente com RSA-OAEP; message_hash obrigatório
+# - scheme "aes-gcm": encrypted_content cifrado com AES-GCM (base64, tag ao final); a chave AES vai em
+#   wrapped_key (base64, cifrada com RSA-OAEP) e o nonce de 12 bytes em nonce (base64).
+#   O message_hash é opcional: a tag do GCM já garante a integridade.
+# Os campos em base64/HEX são decodificados na validação (bytes a partir daqui).
 class MessageEncryptedIn(BaseModel):
-    encrypted_content: str  # Conteúdo cifrado com a chave pública do REMETENTE
-    message_hash: str       # Hash SHA256 do conteúdo original (plaintext)
+    encrypted_content: bytes  # Conteúdo cifrado com a chave pública do REMETENTE
+    message_hash: Optional[bytes] = None  # Hash SHA256 do conteúdo original (plaintext)
     sender_id: UUID
     recipient_id: UUID
+    scheme: Literal["rsa-oaep", "aes-gcm"] = "rsa-oaep"
+    wrapped_key: Optional[bytes] = None  # Chave de sessão AES cifrada com a chave pública do REMETENTE
+    nonce: Optional[bytes] = None        # Nonce do AES-GCM
+
+    _decode_base64 = field_validator("encrypted_content", "wrapped_key", "nonce", mode="before")(_bytes_from_base64)
+    _decode_hex = field_validator("message_hash", mode="before")(_bytes_from_hex)
+
+    @model_validator(mode="after")
+    def check_scheme_fields(self):
+        if self.scheme == "rsa-oaep" and not self.message_hash:
+            raise ValueError("message_hash é obrigatório no esquema rsa-oaep")
+        if self.scheme == "aes-gcm" and not (self.wrapped_key and self.nonce):
+            raise ValueError("wrapped_key e nonce são obrigatórios no esquema aes-gcm")
+        return self
 
 # Esquema para uma mensagem (descriptografada) retornada do backend para o frontend
 class MessageDecryptedOut(BaseModel):
@@ -46,5 +85,21 @@ class UserInList(BaseModel):
     username: str
     public_key: str # Chave pública do usuário (formato HEXADECIMAL)
 
+    _public_key_hex = field_validator("public_key", mode="before")(_hex_from_bytes)
+
+    class Config:
+        from_attributes = True
+
+# Esquema para uma conversa na caixa de entrada (lido apenas da tabela de resumos,
+# sem descriptografar mensagens)
+class ConversationSummaryOut(BaseModel):
+    peer_id: UUID
+    last_message_id: UUID
+    last_message_at: datetime
+    message_count: int
+    unread_count: int # Mensagens recebidas do contato ainda não marcadas como lidas
+
+    _ids_from_bytes = field_validator("peer_id", "last_message_id", mode="before")(_uuid_from_bytes)
+
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
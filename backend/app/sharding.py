@@ -0,0 +1,104 @@
+import asyncio
+import hashlib
+from typing import Callable, List, Optional, Sequence
+from uuid import UUID
+
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker
+
+from . import models
+from .database import AsyncSessionLocal, make_async_engine, make_engine
+from .migrations import ensure_schema
+
+# Tabelas gravadas nos shards: as mensagens e os resumos de conversa ficam no mesmo arquivo,
+# então continuam sendo atualizados na mesma transação. Usuários e entregas pendentes ficam
+# no banco principal (diretório).
+SHARDED_TABLES = (models.Message.__table__, models.Conversation.__table__)
+
+
+def shard_index(conversation_key: bytes, count: int) -> int:
+    """
+    Shard de uma conversa (models.conversation_key_for). O hash é estável entre processos e
+    versões do Python (ao contrário de hash()), então todos os workers e a ferramenta de
+    redistribuição concordam sobre o destino de cada conversa.
+    """
+    if count <= 1:
+        return 0
+    digest = hashlib.blake2b(conversation_key, digest_size=8).digest()
+    return int.from_bytes(digest, "big") % count
+
+
+def shard_paths(path_template: str, count: int) -> List[str]:
+    """Arquivos dos shards, a partir de um modelo com `{index}` (ex.: ./chat-messages-{index}.db)."""
+    if "{index}" not in path_template:
+        raise ValueError(f"O modelo de caminho dos shards precisa conter {{index}}: {path_template}")
+    return [path_template.format(index=index) for index in range(count)]
+
+
+class MessageShards:
+    """
+    Roteia as mensagens (e os resumos de conversa) para N bancos SQLite pela chave canônica
+    da conversa. Cada shard tem o próprio motor, pool e lock de escrita, então conversas em
+    shards diferentes são gravadas em paralelo. As duas direções de uma conversa caem no
+    mesmo shard: o histórico de um par de usuários é sempre lido de um único arquivo.
+
+    Com um único shard, ele é o próprio banco principal (modo padrão, sem particionamento).
+    """
+
+    def __init__(
+        self,
+        session_factories: Sequence[Callable[[], AsyncSession]],
+        engines: Sequence[Engine] = (),
+        async_engines: Sequence[AsyncEngine] = (),
+    ):
+        if not session_factories:
+            raise ValueError("É necessário pelo menos um shard")
+        self._session_factories = list(session_factories)
+        # Motores síncronos (esquema e ferramentas) e assíncronos, descartados em dispose()
+        self.engines = list(engines)
+        self._async_engines = list(async_engines)
+
+    @property
+    def count(self) -> int:
+        return len(self._session_factories)
+
+    def index_for_key(self, conversation_key: bytes) -> int:
+        return shard_index(conversation_key, self.count)
+
+    def index_for_pair(self, user1_id: UUID, user2_id: UUID) -> int:
+        return self.index_for_key(models.conversation_key_for(user1_id.bytes, user2_id.bytes))
+
+    def session(self, index: int) -> AsyncSession:
+        """Nova sessão assíncrona no shard `index`."""
+        return self._session_factories[index]()
+
+    def session_for_pair(self, user1_id: UUID, user2_id: UUID) -> AsyncSession:
+        """Nova sessão no shard da conversa entre os dois usuários (em qualquer ordem)."""
+        return self.session(self.index_for_pair(user1_id, user2_id))
+
+    def ensure_schema(self) -> None:
+        """Cria/atualiza as tabelas de mensagens e de resumos em cada shard."""
+        for shard_engine in self.engines:
+            ensure_schema(shard_engine, tables=SHARDED_TABLES)
+
+    async def dispose(self) -> None:
+        await asyncio.gather(*(async_engine.dispose() for async_engine in self._async_engines))
+        for shard_engine in self.engines:
+            shard_engine.dispose()
+
+
+def create_message_shards(count: int, path_template: Optional[str] = None) -> MessageShards:
+    """
+    Cria os shards de mensagens. Com `count` <= 1 usa o banco principal (motores de
+    database.py); senão, abre um motor síncrono e um assíncrono, cada um com seu pool,
+    para cada arquivo de `path_template`.
+    """
+    if count <= 1:
+        return MessageShards([AsyncSessionLocal])
+    factories, engines, async_engines = [], [], []
+    for path in shard_paths(path_template or "", count):
+        async_engine = make_async_engine(f"sqlite+aiosqlite:///{path}")
+        factories.append(async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False))
+        engines.append(make_engine(f"sqlite:///{path}"))
+        async_engines.append(async_engine)
+    return MessageShards(factories, engines, async_engines)
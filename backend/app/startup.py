@@ -0,0 +1,86 @@
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+from . import metrics
+
+# Caminhos de sondagem e observabilidade: não contam como a primeira requisição da aplicação
+# (o balanceador chama /ready antes de qualquer cliente)
+_PROBE_PATHS = ("/ready", "/metrics", "/stats/")
+
+
+class StartupReport:
+    """
+    Tempos da inicialização do worker, medidos a partir do início da importação de app.main:
+    duração de cada fase (importação, esquema, aquecimento...), o instante em que o worker
+    ficou pronto e a latência da primeira requisição atendida.
+    """
+
+    def __init__(self, started_at: float):
+        self.started_at = started_at
+        self.phases: Dict[str, float] = {}
+        self.ready_after: Optional[float] = None
+        self.warmup: Dict[str, Any] = {}
+        self.first_request: Optional[Dict[str, Any]] = None
+
+    def record(self, name: str, seconds: float) -> None:
+        self.phases[name] = seconds
+        metrics.STARTUP_SECONDS.labels(name).set(seconds)
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Registra a duração do bloco como a fase `name`."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    @property
+    def ready(self) -> bool:
+        return self.ready_after is not None
+
+    def mark_ready(self) -> None:
+        if self.ready_after is None:
+            self.ready_after = time.perf_counter() - self.started_at
+            self.record("ready", self.ready_after)
+
+    def record_first_request(self, path: str, arrived_at: float, latency: float) -> None:
+        self.first_request = {
+            "path": path,
+            "after_start_seconds": arrived_at - self.started_at,
+            "latency_seconds": latency,
+        }
+        self.record("first_request", latency)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "ready_after_seconds": self.ready_after,
+            "phases": dict(self.phases),
+            "warmup": dict(self.warmup),
+            "first_request": self.first_request,
+        }
+
+
+class FirstRequestTimer:
+    """
+    Middleware ASGI que mede a latência da primeira requisição HTTP da aplicação (ignorando
+    as sondagens). Depois dela, apenas repassa as chamadas.
+    """
+
+    def __init__(self, app, report: StartupReport):
+        self.app = app
+        self.report = report
+        self._claimed = False
+
+    async def __call__(self, scope, receive, send) -> None:
+        if self._claimed or scope["type"] != "http" or scope["path"].startswith(_PROBE_PATHS):
+            await self.app(scope, receive, send)
+            return
+        self._claimed = True
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.report.record_first_request(scope["path"], started, time.perf_counter() - started)
@@ -0,0 +1,84 @@
+import asyncio
+import bisect
+from typing import Any, Dict, List, Optional
+from uuid import UUID
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import crud_async, schemas
+
+
+class UserDirectory:
+    """
+    Lista de usuários (id, username, chave pública) mantida em memória já serializada em JSON.
+
+    A versão do diretório é o maior rowid de usuário carregado: como usuários só são
+    adicionados, ela cresce monotonicamente e é a mesma em todos os workers que leem o
+    mesmo banco. A cada consulta, `refresh` busca apenas os usuários inseridos depois da
+    versão atual (em geral nenhum), em vez de recarregar a tabela inteira.
+    """
+
+    def __init__(self):
+        self.version = 0
+        self._rowids: List[int] = []
+        self._fragments: List[bytes] = []
+        self._full_body: Optional[bytes] = None
+        self._lock = asyncio.Lock()
+
+        self.refreshes = 0
+        self.users_loaded = 0
+        self.full_responses = 0
+        self.delta_responses = 0
+        self.not_modified = 0
+
+    async def refresh(self, db: AsyncSession) -> int:
+        """Carrega os usuários novos e retorna a versão atual do diretório."""
+        async with self._lock:
+            rows = await crud_async.get_users_added_after(db, self.version)
+            self.refreshes += 1
+            if rows:
+                for row in rows:
+                    user = schemas.UserInList(id=UUID(bytes=row.id), username=row.username, public_key=row.public_key)
+                    self._rowids.append(row.rowid)
+                    self._fragments.append(user.model_dump_json().encode("utf-8"))
+                self.version = rows[-1].rowid
+                self.users_loaded += len(rows)
+                self._full_body = None
+            return self.version
+
+    async def warm(self, db: AsyncSession) -> int:
+        """Carrega os usuários e pré-serializa a lista completa (aquecimento). Retorna a versão."""
+        version = await self.refresh(db)
+        self._full()
+        return version
+
+    def etag(self, since: Optional[int] = None) -> str:
+        """ETag da representação: muda sempre que a versão muda (e difere entre lista completa e delta)."""
+        if since is None:
+            return f'"users-v{self.version}"'
+        return f'"users-v{self.version}-since-{since}"'
+
+    def body(self, since: Optional[int] = None) -> bytes:
+        """Corpo JSON (lista de UserInList) completo, ou apenas dos usuários adicionados após `since`."""
+        if since is None:
+            self.full_responses += 1
+            return self._full()
+        self.delta_responses += 1
+        start = bisect.bisect_right(self._rowids, since)
+        return b"[" + b",".join(self._fragments[start:]) + b"]"
+
+    def _full(self) -> bytes:
+        if self._full_body is None:
+            self._full_body = b"[" + b",".join(self._fragments) + b"]"
+        return self._full_body
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "version": self.version,
+            "users": len(self._fragments),
+            "refreshes": self.refreshes,
+            "users_loaded": self.users_loaded,
+            "full_responses": self.full_responses,
+            "delta_responses": self.delta_responses,
+            "not_modified": self.not_modified,
+        }
@@ -0,0 +1,153 @@
+import json
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Union
+from uuid import UUID
+
+try:
+    import msgpack
+except ImportError:  # dependência opcional: sem ela, apenas JSON é oferecido
+    msgpack = None
+
+# Codificações de quadros WebSocket. O cliente escolhe a sua pelo subprotocolo do
+# WebSocket (Sec-WebSocket-Protocol); sem negociação, o padrão é JSON em quadros de texto.
+ENCODING_JSON = "json"
+ENCODING_MSGPACK = "msgpack"
+
+SUBPROTOCOLS = {
+    "safechat.json": ENCODING_JSON,
+    "safechat.msgpack": ENCODING_MSGPACK,
+}
+
+
+def available_encodings() -> Dict[str, str]:
+    """Subprotocolos aceitos por este servidor (msgpack só se a biblioteca estiver instalada)."""
+    return {
+        name: encoding
+        for name, encoding in SUBPROTOCOLS.items()
+        if encoding != ENCODING_MSGPACK or msgpack is not None
+    }
+
+
+def negotiate(requested: Iterable[str]) -> Optional[str]:
+    """
+    Escolhe o primeiro subprotocolo pedido pelo cliente que o servidor suporta.
+    Retorna None se nenhum for suportado (o cliente recebe JSON, como antes).
+    """
+    supported = available_encodings()
+    for name in requested:
+        if name in supported:
+            return name
+    return None
+
+
+class Frame:
+    """
+    Evento de saída serializado uma única vez por codificação.
+
+    O mesmo Frame pode ser enfileirado para várias conexões (remetente, destinatário,
+    broadcast): cada codificação é gerada apenas na primeira vez em que é pedida.
+    O evento pode ser um dicionário ou um texto simples (mensagens de erro legadas).
+    """
+
+    __slots__ = ("_event", "_encoded")
+
+    def __init__(self, event: Union[Dict[str, Any], str, None] = None):
+        self._event = event
+        self._encoded: Dict[str, Union[str, bytes]] = {}
+
+    @classmethod
+    def from_json(cls, text: str) -> "Frame":
+        """Frame a partir de um evento já serializado em JSON (ex.: recebido de outro worker)."""
+        frame = cls()
+        frame._encoded[ENCODING_JSON] = text
+        return frame
+
+    @property
+    def event(self) -> Union[Dict[str, Any], str]:
+        if self._event is None:
+            text = self._encoded[ENCODING_JSON]
+            try:
+                self._event = json.loads(text)
+            except ValueError:
+                # Texto simples (não JSON): é repassado como string
+                self._event = text
+        return self._event
+
+    def encode(self, encoding: str = ENCODING_JSON) -> Union[str, bytes]:
+        """Retorna o evento codificado: str (quadro de texto) para JSON, bytes (quadro binário) para msgpack."""
+        data = self._encoded.get(encoding)
+        if data is None:
+            event = self.event
+            if encoding == ENCODING_MSGPACK:
+                data = msgpack.packb(event, use_bin_type=True)
+            elif isinstance(event, str):
+                data = event
+            else:
+                data = json.dumps(event)
+            self._encoded[encoding] = data
+        return data
+
+
+def decode_message(data: Union[str, bytes]) -> Any:
+    """Decodifica uma mensagem recebida: quadros de texto são JSON, quadros binários são msgpack."""
+    if isinstance(data, (bytes, bytearray)):
+        if msgpack is None:
+            raise ValueError("Quadros binários (msgpack) não são suportados por este servidor")
+        return msgpack.unpackb(data, raw=False)
+    return json.loads(data)
+
+
+def chat_message_payload(
+    message_id: bytes,
+    content: Optional[str],
+    created_at: datetime,
+    sender_id: bytes,
+    sender_username: str,
+    recipient_id: bytes,
+    recipient_username: str,
+    is_integrity_valid: bool,
+) -> Dict[str, Any]:
+    """Mensagem descriptografada (MessageDecryptedOut) já com tipos serializáveis."""
+    return {
+        "id": str(UUID(bytes=message_id)),
+        "content": content,
+        "created_at": created_at.isoformat(),
+        "sender_id": str(UUID(bytes=sender_id)),
+        "sender_username": sender_username,
+        "recipient_id": str(UUID(bytes=recipient_id)),
+        "recipient_username": recipient_username,
+        "is_integrity_valid": is_integrity_valid,
+    }
+
+
+def chat_message_event(*args: Any) -> Dict[str, Any]:
+    """Evento CHAT_MESSAGE enviado ao remetente e ao destinatário (argumentos de chat_message_payload)."""
+    return {"type": "CHAT_MESSAGE", "payload": chat_message_payload(*args)}
+
+
+def chat_batch_event(messages: List[Dict[str, Any]], errors: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+    """
+    Evento CHAT_BATCH: várias mensagens (payloads de chat_message_payload) em um único quadro.
+    `errors` só é incluído na resposta ao remetente do lote.
+    """
+    payload: Dict[str, Any] = {"messages": messages}
+    if errors is not None:
+        payload["errors"] = errors
+    return {"type": "CHAT_BATCH", "payload": payload}
+
+
+def rate_limited_event(scope: str, action: str, retry_after: float, message_type: Optional[str]) -> Dict[str, Any]:
+    """
+    Evento RATE_LIMITED: a mensagem do tipo `message_type` foi adiada ("deferred") ou
+    rejeitada ("rejected") pelo controle de admissão. `scope` indica o limite atingido
+    ("user", "global" ou "queue") e `retry_after_ms` quando haverá capacidade.
+    """
+    return {
+        "type": "RATE_LIMITED",
+        "payload": {
+            "scope": scope,
+            "action": action,
+            "retry_after_ms": round(retry_after * 1000),
+            "message_type": message_type,
+        },
+    }
@@ -0,0 +1,508 @@
+"""
+Teste de carga ponta a ponta do backend: inicia o servidor (uvicorn, sem TLS) em um
+diretório temporário e mede, por HTTP e WebSocket reais:
+
+* vazão de registro em /register-or-login (usuários/s);
+* vazão de CHAT_MESSAGE (mensagens/s) e latência de entrega ponta a ponta
+  (envio pelo remetente -> recebimento pelo destinatário: p50/p95/p99), com conteúdo
+  cifrado de verdade em RSA-OAEP com a chave pública do remetente;
+* latência de GET /messages/{user1_id}/{user2_id}?limit=N com a tabela de mensagens
+  populada em tamanhos crescentes;
+* tempo até o servidor responder /ready e latência da primeira requisição (medida pelo
+  cliente e pelo servidor, em /stats/startup).
+
+O controle de admissão do servidor (SAFECHAT_RATE_LIMIT_*) fica desativado e a fila de
+entrada de cada WebSocket comporta todas as mensagens da conexão, para que a medição seja
+da entrega e não do limitador; `--rate-limit` mantém a configuração do ambiente. Mensagens
+limitadas (RATE_LIMITED), eventos de erro e mensagens não entregues contam como erros.
+
+Uso (a partir do diretório backend/):
+
+    python -m bench.load_latency --users 50 --connections 50 --messages 20 --json resultado.json
+    python -m bench.load_latency --history-sizes 1000 10000 100000 --json novo.json --baseline resultado.json
+    python -m bench.load_latency --shards 4 --json shards.json --baseline resultado.json
+
+O resultado em JSON inclui o commit atual, para comparar execuções entre versões
+(`--baseline` imprime a variação das métricas principais). O chat.db do projeto não é alterado.
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import httpx
+import websockets
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding
+from sqlalchemy import insert
+
+from app import crud, models, schemas
+from app.database import make_engine
+from app.sharding import shard_index, shard_paths
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_OAEP = padding.OAEP(mgf=padding.MGF1(algorithm=hashes.SHA256()), algorithm=hashes.SHA256(), label=None)
+
+
+def percentile(samples: Sequence[float], pct: float) -> Optional[float]:
+    """Percentil pelo método do posto mais próximo (None sem amostras)."""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    rank = max(1, round(pct / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def latency_summary(samples_seconds: Sequence[float]) -> Dict[str, Any]:
+    """Resumo de latências em milissegundos."""
+    ms = [s * 1000 for s in samples_seconds]
+    summary: Dict[str, Any] = {"samples": len(ms)}
+    for pct in (50, 95, 99):
+        value = percentile(ms, pct)
+        summary[f"p{pct}_ms"] = round(value, 2) if value is not None else None
+    summary["max_ms"] = round(max(ms), 2) if ms else None
+    return summary
+
+
+def encrypt_for(public_key_hex: str, text: str) -> Dict[str, str]:
+    """Conteúdo e hash como o frontend envia: RSA-OAEP com a chave pública do remetente."""
+    public_key = serialization.load_der_public_key(bytes.fromhex(public_key_hex))
+    return {
+        "encrypted_content": base64.b64encode(public_key.encrypt(text.encode("utf-8"), _OAEP)).decode("ascii"),
+        "message_hash": hashlib.sha256(text.encode("utf-8")).hexdigest(),
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class Server:
+    """Processo uvicorn executando app.main em um diretório de trabalho temporário (banco novo)."""
+
+    def __init__(self, workdir: str, workers: int, shards: int = 1, inbound_queue_size: Optional[int] = None):
+        self.workdir = workdir
+        self.workers = workers
+        self.shards = shards
+        # Sem None: desativa o controle de admissão e usa esta fila de entrada por conexão
+        self.inbound_queue_size = inbound_queue_size
+        self.port = _free_port()
+        self.base_url = f"http://127.0.0.1:{self.port}"
+        self.ws_url = f"ws://127.0.0.1:{self.port}"
+        self.db_path = os.path.join(workdir, "chat.db")
+        self._shard_path = os.path.join(workdir, "chat-messages-{index}.db")
+        # Arquivos onde ficam as mensagens (o próprio chat.db sem particionamento)
+        self.message_db_paths = [self.db_path] if shards <= 1 else shard_paths(self._shard_path, shards)
+        self._log_path = os.path.join(workdir, "server.log")
+        self._process: Optional[subprocess.Popen] = None
+
+    def start(self, timeout: float = 60.0) -> float:
+        """Inicia o servidor e retorna o tempo (s) até ele ficar pronto (GET /ready)."""
+        env = dict(os.environ)
+        env["PYTHONPATH"] = BACKEND_DIR + os.pathsep + env.get("PYTHONPATH", "")
+        env["SAFECHAT_MESSAGE_SHARDS"] = str(self.shards)
+        env["SAFECHAT_MESSAGE_SHARD_PATH"] = self._shard_path
+        if self.inbound_queue_size is not None:
+            env["SAFECHAT_RATE_LIMIT_USER_RATE"] = "0"
+            env["SAFECHAT_RATE_LIMIT_GLOBAL_RATE"] = "0"
+            env["SAFECHAT_WS_INBOUND_QUEUE_MAX_SIZE"] = str(self.inbound_queue_size)
+        command = [
+            sys.executable, "-m", "uvicorn", "app.main:app",
+            "--host", "127.0.0.1", "--port", str(self.port),
+            "--workers", str(self.workers), "--log-level", "warning",
+        ]
+        started = time.perf_counter()
+        with open(self._log_path, "wb") as log:
+            self._process = subprocess.Popen(command, cwd=self.workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+        while time.perf_counter() - started < timeout:
+            if self._process.poll() is not None:
+                raise RuntimeError(f"servidor encerrou ao iniciar:\n{self.log_tail()}")
+            try:
+                if httpx.get(f"{self.base_url}/ready", timeout=1.0).status_code == 200:
+                    return time.perf_counter() - started
+            except httpx.TransportError:
+                pass
+            time.sleep(0.1)
+        raise RuntimeError(f"servidor não respondeu em {timeout}s:\n{self.log_tail()}")
+
+    def log_tail(self, lines: int = 30) -> str:
+        with open(self._log_path, "rb") as f:
+            return b"\n".join(f.read().splitlines()[-lines:]).decode("utf-8", "replace")
+
+    def stop(self) -> None:
+        if self._process is not None and self._process.poll() is None:
+            self._process.terminate()
+            try:
+                self._process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                self._process.kill()
+                self._process.wait()
+        self._process = None
+
+
+async def register_users(client: httpx.AsyncClient, count: int, concurrency: int) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """Registra `count` usuários sintéticos; retorna os usuários e as métricas de registro."""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    run_id = os.urandom(4).hex()
+
+    async def register(index: int) -> Dict[str, Any]:
+        async with semaphore:
+            started = time.perf_counter()
+            response = await client.post(
+                "/register-or-login", json={"username": f"bench-{run_id}-{index}", "password": "bench"}
+            )
+            latencies.append(time.perf_counter() - started)
+            response.raise_for_status()
+            return response.json()
+
+    started = time.perf_counter()
+    users = await asyncio.gather(*(register(i) for i in range(count)))
+    elapsed = time.perf_counter() - started
+    return list(users), {
+        "users": count,
+        "concurrency": concurrency,
+        "users_per_sec": round(count / elapsed, 1),
+        "latency": latency_summary(latencies),
+    }
+
+
+async def chat_traffic(
+    ws_url: str,
+    users: List[Dict[str, Any]],
+    connections: int,
+    messages_per_connection: int,
+    rate: float,
+    timeout: float,
+) -> Dict[str, Any]:
+    """
+    Abre `connections` WebSockets (um por usuário) e cada um envia `messages_per_connection`
+    CHAT_MESSAGE para destinatários conectados escolhidos ao acaso. A latência é medida do
+    envio até o recebimento do evento pelo destinatário (identificado pelo conteúdo).
+    Eventos RATE_LIMITED, eventos de erro e mensagens não entregues contam como erros.
+    """
+    connected = users[:connections]
+    rng = random.Random(42)
+
+    # Os conteúdos são cifrados antes de iniciar a medição: o custo de RSA do cliente não entra na conta
+    plan: List[List[Tuple[str, str]]] = []
+    for index, user in enumerate(connected):
+        outgoing = []
+        for seq in range(messages_per_connection):
+            recipient = connected[rng.randrange(len(connected))] if len(connected) > 1 else user
+            marker = f"bench:{index}:{seq}"
+            payload = {"sender_id": user["id"], "recipient_id": recipient["id"], **encrypt_for(user["public_key"], marker)}
+            outgoing.append((marker, json.dumps({"type": "CHAT_MESSAGE", "payload": payload})))
+        plan.append(outgoing)
+
+    total = len(connected) * messages_per_connection
+    sent_at: Dict[str, float] = {}
+    latencies: List[float] = []
+    errors: List[str] = []
+    rate_limited = {"deferred": 0, "rejected": 0}
+    all_delivered = asyncio.Event()
+    if total == 0:
+        all_delivered.set()
+
+    sockets = [await websockets.connect(f"{ws_url}/ws/{user['id']}", max_size=None) for user in connected]
+
+    async def reader(ws, user_id: str) -> None:
+        async for raw in ws:
+            try:
+                event = json.loads(raw)
+            except ValueError:
+                errors.append(str(raw)[:200])
+                continue
+            if not isinstance(event, dict):
+                errors.append(str(raw)[:200])
+                continue
+            if event.get("type") == "RATE_LIMITED":
+                action = event.get("payload", {}).get("action")
+                rate_limited[action] = rate_limited.get(action, 0) + 1
+                continue
+            if "error" in event or event.get("type") == "ERROR":
+                errors.append(str(raw)[:200])
+                continue
+            if event.get("type") != "CHAT_MESSAGE":
+                continue
+            payload = event["payload"]
+            # O remetente também recebe o evento: a entrega conta no destinatário
+            if payload["recipient_id"] != user_id:
+                continue
+            started = sent_at.get(payload.get("content"))
+            if started is not None:
+                latencies.append(time.perf_counter() - started)
+                if len(latencies) == total:
+                    all_delivered.set()
+
+    # Intervalo entre envios de cada conexão para atingir a taxa total pedida (0 = sem limite)
+    interval = connections / rate if rate > 0 else 0.0
+
+    async def writer(ws, outgoing: List[Tuple[str, str]]) -> None:
+        for marker, frame in outgoing:
+            sent_at[marker] = time.perf_counter()
+            await ws.send(frame)
+            if interval:
+                await asyncio.sleep(interval)
+            else:
+                await asyncio.sleep(0)
+
+    readers = [asyncio.create_task(reader(ws, user["id"])) for ws, user in zip(sockets, connected)]
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(writer(ws, outgoing) for ws, outgoing in zip(sockets, plan)))
+        try:
+            await asyncio.wait_for(all_delivered.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        elapsed = time.perf_counter() - started
+    finally:
+        for ws in sockets:
+            await ws.close()
+        for task in readers:
+            task.cancel()
+        await asyncio.gather(*readers, return_exceptions=True)
+
+    undelivered = total - len(latencies)
+    return {
+        "connections": len(connected),
+        "messages_sent": total,
+        "messages_delivered": len(latencies),
+        "undelivered": undelivered,
+        "rate_limited": rate_limited,
+        "target_rate": rate or None,
+        "messages_per_sec": round(len(latencies) / elapsed, 1) if elapsed > 0 else None,
+        "delivery_latency": latency_summary(latencies),
+        # Mensagens rejeitadas já contam como não entregues; as adiadas chegam com atraso
+        "errors": len(errors) + undelivered + rate_limited["deferred"],
+        "error_samples": errors[:5],
+    }
+
+
+def seed_messages(db_paths: List[str], users: List[Dict[str, Any]], count: int, rng: random.Random) -> None:
+    """
+    Insere `count` mensagens diretamente nos bancos de mensagens do servidor (no shard de
+    cada conversa), entre pares aleatórios de usuários (com conteúdo cifrado de verdade, um
+    ciphertext por remetente), incluindo o resumo das conversas, como o servidor faria.
+    """
+    ciphertexts = {user["id"]: encrypt_for(user["public_key"], "seed") for user in users}
+    engines = [make_engine(f"sqlite:///{db_path}") for db_path in db_paths]
+    try:
+        remaining = count
+        while remaining > 0:
+            by_shard: Dict[int, List[Dict[str, Any]]] = {}
+            batch_size = min(remaining, 1000)
+            for _ in range(batch_size):
+                sender, recipient = rng.sample(users, 2) if len(users) > 1 else (users[0], users[0])
+                values = crud.build_message_values(schemas.MessageEncryptedIn(
+                    sender_id=sender["id"], recipient_id=recipient["id"], **ciphertexts[sender["id"]]
+                ))
+                by_shard.setdefault(shard_index(values["conversation_key"], len(engines)), []).append(values)
+            for index, rows in by_shard.items():
+                with engines[index].begin() as conn:
+                    conn.execute(insert(models.Message), rows)
+                    conn.execute(crud.conversation_upsert(), crud.conversation_updates(rows))
+            remaining -= batch_size
+    finally:
+        for engine in engines:
+            engine.dispose()
+
+
+async def history_latency(
+    client: httpx.AsyncClient,
+    db_paths: List[str],
+    users: List[Dict[str, Any]],
+    sizes: List[int],
+    page_size: int,
+    repetitions: int,
+) -> List[Dict[str, Any]]:
+    """Mede GET /messages/{user1_id}/{user2_id}?limit=page_size com a tabela em cada tamanho pedido."""
+    results = []
+    rng = random.Random(7)
+    seeded = 0
+    pairs = [(users[i], users[(i + 1) % len(users)]) for i in range(len(users))]
+    for size in sorted(sizes):
+        if size > seeded:
+            await asyncio.to_thread(seed_messages, db_paths, users, size - seeded, rng)
+            seeded = size
+        latencies = []
+        returned = 0
+        for repetition in range(repetitions):
+            user1, user2 = pairs[repetition % len(pairs)]
+            started = time.perf_counter()
+            response = await client.get(f"/messages/{user1['id']}/{user2['id']}", params={"limit": page_size})
+            latencies.append(time.perf_counter() - started)
+            response.raise_for_status()
+            returned += len(response.json())
+        results.append({
+            "table_messages": seeded,
+            "page_size": page_size,
+            "avg_messages_returned": round(returned / repetitions, 1) if repetitions else 0,
+            "latency": latency_summary(latencies),
+        })
+        print(
+            f"histórico: tabela={seeded:>8} mensagens  p50={results[-1]['latency']['p50_ms']} ms  "
+            f"p99={results[-1]['latency']['p99_ms']} ms"
+        )
+    return results
+
+
+async def run(args: argparse.Namespace, server: Server, startup_seconds: float) -> Dict[str, Any]:
+    limits = httpx.Limits(max_connections=max(args.register_concurrency, 10))
+    async with httpx.AsyncClient(base_url=server.base_url, timeout=args.timeout, limits=limits) as client:
+        # Primeira requisição da aplicação depois do /ready (caches do servidor ainda frios)
+        started = time.perf_counter()
+        (await client.get("/users")).raise_for_status()
+        first_request_ms = round((time.perf_counter() - started) * 1000, 2)
+        server_startup = (await client.get("/stats/startup")).json()
+        print(f"inicialização: pronto em {startup_seconds:.3f}s  primeira requisição={first_request_ms} ms")
+
+        users, registration = await register_users(client, args.users, args.register_concurrency)
+        print(f"registro: {registration['users_per_sec']} usuários/s  p99={registration['latency']['p99_ms']} ms")
+
+        chat = await chat_traffic(
+            server.ws_url, users, min(args.connections, len(users)), args.messages, args.rate, args.timeout
+        )
+        latency = chat["delivery_latency"]
+        print(
+            f"chat: {chat['messages_delivered']}/{chat['messages_sent']} entregues  {chat['messages_per_sec']} msg/s  "
+            f"p50={latency['p50_ms']} ms  p95={latency['p95_ms']} ms  p99={latency['p99_ms']} ms"
+        )
+        if chat["errors"]:
+            print(
+                f"chat: {chat['errors']} erros  (não entregues={chat['undelivered']}  "
+                f"limitadas={chat['rate_limited']}  amostras={chat['error_samples']})"
+            )
+
+        history = await history_latency(
+            client, server.message_db_paths, users, args.history_sizes, args.history_page_size, args.history_repetitions
+        )
+
+    return {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "workers": args.workers,
+            "message_shards": args.shards,
+            "server_startup_seconds": round(startup_seconds, 3),
+            "parameters": {
+                "users": args.users,
+                "connections": args.connections,
+                "messages_per_connection": args.messages,
+                "rate": args.rate,
+                "rate_limit": args.rate_limit,
+                "history_sizes": args.history_sizes,
+                "history_page_size": args.history_page_size,
+                "history_repetitions": args.history_repetitions,
+            },
+        },
+        "startup": {
+            "ready_seconds": round(startup_seconds, 3),
+            "first_request_ms": first_request_ms,
+            "server": server_startup,
+        },
+        "registration": registration,
+        "chat": chat,
+        "history": history,
+    }
+
+
+def headline_metrics(results: Dict[str, Any]) -> Dict[str, Tuple[Optional[float], bool]]:
+    """Métricas principais de uma execução: nome -> (valor, maior é melhor)."""
+    chat_latency = results["chat"]["delivery_latency"]
+    metrics = {
+        "startup.ready_seconds": (results.get("startup", {}).get("ready_seconds"), False),
+        "startup.first_request_ms": (results.get("startup", {}).get("first_request_ms"), False),
+        "registration.users_per_sec": (results["registration"]["users_per_sec"], True),
+        "chat.messages_per_sec": (results["chat"]["messages_per_sec"], True),
+        "chat.delivery_p50_ms": (chat_latency["p50_ms"], False),
+        "chat.delivery_p95_ms": (chat_latency["p95_ms"], False),
+        "chat.delivery_p99_ms": (chat_latency["p99_ms"], False),
+        "chat.errors": (results["chat"].get("errors"), False),
+    }
+    for entry in results["history"]:
+        metrics[f"history[{entry['table_messages']}].p99_ms"] = (entry["latency"]["p99_ms"], False)
+    return metrics
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold_pct: float = 10.0) -> None:
+    """Imprime a variação das métricas principais em relação a uma execução anterior."""
+    print(f"comparação {baseline['meta'].get('commit')} -> {current['meta'].get('commit')}:")
+    old_metrics = headline_metrics(baseline)
+    for name, (new, higher_is_better) in headline_metrics(current).items():
+        old = old_metrics.get(name, (None, higher_is_better))[0]
+        if not old or new is None:
+            continue
+        change = (new - old) / old * 100
+        worse = change < 0 if higher_is_better else change > 0
+        flag = "  PIOROU" if worse and abs(change) >= threshold_pct else ""
+        print(f"  {name:<32} {old:>10} -> {new:>10}  ({change:+.1f}%){flag}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50, help="usuários sintéticos registrados")
+    parser.add_argument("--register-concurrency", type=int, default=8, help="registros simultâneos")
+    parser.add_argument("--connections", type=int, default=50, help="WebSockets abertos (um por usuário)")
+    parser.add_argument("--messages", type=int, default=20, help="mensagens enviadas por conexão")
+    parser.add_argument("--rate", type=float, default=0, help="taxa total de envio em mensagens/s (0 = sem limite)")
+    parser.add_argument("--history-sizes", type=int, nargs="*", default=[1000, 10000], help="tamanhos da tabela de mensagens")
+    parser.add_argument("--history-page-size", type=int, default=50, help="`limit` usado em /messages")
+    parser.add_argument("--history-repetitions", type=int, default=50, help="requisições de histórico por tamanho")
+    parser.add_argument("--workers", type=int, default=1, help="workers do uvicorn")
+    parser.add_argument("--shards", type=int, default=1, help="arquivos SQLite de mensagens (SAFECHAT_MESSAGE_SHARDS)")
+    parser.add_argument(
+        "--rate-limit",
+        action="store_true",
+        help="mantém o controle de admissão do servidor (SAFECHAT_RATE_LIMIT_* do ambiente)",
+    )
+    parser.add_argument("--timeout", type=float, default=120.0, help="tempo máximo de espera (s) por etapa")
+    parser.add_argument("--json", help="arquivo onde salvar os resultados em JSON")
+    parser.add_argument("--baseline", help="JSON de uma execução anterior para comparação")
+    args = parser.parse_args()
+    if args.users < 2:
+        parser.error("--users deve ser pelo menos 2")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        inbound_queue_size = None if args.rate_limit else max(args.messages, 32)
+        server = Server(workdir, args.workers, args.shards, inbound_queue_size)
+        startup_seconds = server.start()
+        try:
+            results = asyncio.run(run(args, server, startup_seconds))
+        finally:
+            server.stop()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Mede a vazão sustentada (mensagens/s) de gravação de mensagens em diferentes níveis
+de concorrência, comparando o commit por mensagem (crud_async.create_message) com a
+gravação em lote (MessageBatchWriter). Com `--shards N`, as mensagens são distribuídas
+entre N arquivos SQLite por conversa (app.sharding), cada um com seu lock de escrita.
+
+Uso (a partir do diretório backend/):
+
+    python -m bench.writer_throughput --messages 2000 --concurrency 1 8 32 128 --json resultado.json
+    python -m bench.writer_throughput --shards 4
+
+O banco é criado em um diretório temporário; o chat.db do projeto não é alterado.
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import tempfile
+import time
+import uuid
+from typing import Awaitable, Callable, Dict, List
+
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app import config, crud_async, schemas
+from app.database import Base, make_async_engine, make_engine
+from app.message_writer import MessageBatchWriter
+from app.sharding import MessageShards, create_message_shards
+
+
+def _sample_message() -> schemas.MessageEncryptedIn:
+    # Tamanho equivalente a um bloco RSA-OAEP de 2048 bits em base64
+    return schemas.MessageEncryptedIn(
+        encrypted_content=base64.b64encode(os.urandom(256)).decode("ascii"),
+        message_hash=os.urandom(32).hex(),
+        sender_id=uuid.uuid4(),
+        recipient_id=uuid.uuid4(),
+    )
+
+
+async def _drive(write: Callable[[schemas.MessageEncryptedIn], Awaitable[object]], total: int, concurrency: int) -> float:
+    """Executa `total` gravações com `concurrency` produtores e retorna mensagens/s."""
+    messages = [_sample_message() for _ in range(total)]
+    per_worker = [messages[i::concurrency] for i in range(concurrency)]
+
+    async def producer(batch: List[schemas.MessageEncryptedIn]) -> None:
+        for message in batch:
+            await write(message)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(producer(batch) for batch in per_worker))
+    return total / (time.perf_counter() - started)
+
+
+def _create_shards(tmp: str, count: int) -> MessageShards:
+    if count > 1:
+        shards = create_message_shards(count, os.path.join(tmp, "bench-{index}.db"))
+        shards.ensure_schema()
+        return shards
+    # Um único arquivo temporário (create_message_shards usaria o chat.db do projeto)
+    path = os.path.join(tmp, "bench.db")
+    sync_engine = make_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=sync_engine)
+    async_engine = make_async_engine(f"sqlite+aiosqlite:///{path}")
+    session_factory = async_sessionmaker(async_engine, class_=AsyncSession, expire_on_commit=False)
+    return MessageShards([session_factory], [sync_engine], [async_engine])
+
+
+async def run(total: int, levels: List[int], shard_count: int = 1) -> List[Dict[str, object]]:
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        shards = _create_shards(tmp, shard_count)
+
+        async def write_single(message: schemas.MessageEncryptedIn) -> object:
+            async with shards.session_for_pair(message.sender_id, message.recipient_id) as db:
+                return await crud_async.create_message(db, message)
+
+        for concurrency in levels:
+            single_rate = await _drive(write_single, total, concurrency)
+
+            writer = MessageBatchWriter(
+                shards=shards,
+                max_batch_size=config.MESSAGE_BATCH_MAX_SIZE,
+                window_seconds=config.MESSAGE_BATCH_WINDOW_MS / 1000,
+            )
+            writer.start()
+            batched_rate = await _drive(writer.submit, total, concurrency)
+            stats = writer.stats()
+            await writer.stop()
+
+            result = {
+                "shards": shards.count,
+                "concurrency": concurrency,
+                "messages": total,
+                "per_message_commit_msgs_per_sec": round(single_rate, 1),
+                "group_commit_msgs_per_sec": round(batched_rate, 1),
+                "group_commit_avg_batch_size": round(stats["avg_batch_size"], 1),
+            }
+            results.append(result)
+            print(
+                f"concorrência={concurrency:>4}  commit por mensagem={single_rate:>9.1f} msg/s  "
+                f"group commit={batched_rate:>9.1f} msg/s  (lote médio {stats['avg_batch_size']:.1f})"
+            )
+
+        await shards.dispose()
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=2000, help="mensagens gravadas por nível de concorrência")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32, 128])
+    parser.add_argument("--shards", type=int, default=1, help="arquivos SQLite entre os quais as mensagens são distribuídas")
+    parser.add_argument("--json", help="arquivo onde salvar os resultados em JSON")
+    args = parser.parse_args()
+
+    print(
+        f"journal_mode={config.SQLITE_JOURNAL_MODE} synchronous={config.SQLITE_SYNCHRONOUS} "
+        f"lote máx.={config.MESSAGE_BATCH_MAX_SIZE} janela={config.MESSAGE_BATCH_WINDOW_MS}ms shards={args.shards}"
+    )
+    results = asyncio.run(run(args.messages, args.concurrency, args.shards))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
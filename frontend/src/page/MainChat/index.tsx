@@ -108,10 +108,19 @@ interface IMessageEncryptedOut {
 
 // Interface para mensagens WebSocket recebidas do backend (com um tipo e payload)
 interface IWebSocketMessage {
-    type: "CHAT_MESSAGE" | "NEW_USER_REGISTERED" | "ERROR";
+    type: "CHAT_MESSAGE" | "NEW_USER_REGISTERED" | "ERROR" | "CHAT_BATCH" | "PENDING_BATCH";
     payload: any; // Pode ser IMessageDisplay ou IUserInList ou um objeto de erro
 }
 
+// Lote de eventos guardados pelo backend enquanto o usuário estava offline
+interface IPendingBatch {
+    last_seq: number; // Último seq do lote (confirmado com ACK)
+    events: { seq: number; event: IWebSocketMessage }[];
+}
+
+// Chave do localStorage com o último seq de entrega pendente confirmado, por usuário
+const lastSeqStorageKey = (id: string) => `pendingLastSeq:${id}`;
+
 const MainChat: React.FC = () => {
 
     const [isLogged, setLogged] = useState(false);
@@ -331,7 +340,11 @@ const MainChat: React.FC = () => {
             if (!ws.current || ws.current.readyState === WebSocket.CLOSED) {
                 const websocketUrl = `${WEBSOCKET_BASE_URL}/${userId}`;
                 console.log(`Tentando conectar WebSocket para o usuário ${userId} em: ${websocketUrl}`);
-                ws.current = new ReconnectingWebSocket(websocketUrl);
+                // A URL é recalculada a cada reconexão, com o último seq já confirmado: o backend
+                // reenvia apenas os eventos pendentes posteriores a ele
+                ws.current = new ReconnectingWebSocket(
+                    () => `${websocketUrl}?last_seq=${localStorage.getItem(lastSeqStorageKey(userId)) || 0}`
+                );
 
                 ws.current.onopen = () => {
                     console.log(`WebSocket CONECTADO para o usuário ${userId}!`);
@@ -339,10 +352,8 @@ const MainChat: React.FC = () => {
                     handleLoadUsers();
                 };
 
-                ws.current.onmessage = async (event) => {
-                    const wsMessage: IWebSocketMessage = JSON.parse(event.data);
-                    console.log("Mensagem WebSocket recebida:", wsMessage);
-                    
+                // Trata um evento do backend, recebido ao vivo ou reenviado em um PENDING_BATCH
+                const handleServerEvent = async (wsMessage: IWebSocketMessage): Promise<void> => {
                     if (wsMessage.type === "CHAT_MESSAGE") {
                         const receivedMessage: IMessagesDisplay = wsMessage.payload;
                         console.log("Mensagem de chat (já descriptografada pelo backend):", receivedMessage);
@@ -359,6 +370,20 @@ const MainChat: React.FC = () => {
                                 return exists ? prevMessages : [...prevMessages, receivedMessage];
                             });
                         }
+                    } else if (wsMessage.type === "CHAT_BATCH") {
+                        // Várias mensagens em um único evento: tratadas uma a uma, como CHAT_MESSAGE
+                        for (const batchMessage of wsMessage.payload.messages) {
+                            await handleServerEvent({ type: "CHAT_MESSAGE", payload: batchMessage });
+                        }
+                    } else if (wsMessage.type === "PENDING_BATCH") {
+                        const batch: IPendingBatch = wsMessage.payload;
+                        console.log(`Recebidos ${batch.events.length} eventos pendentes (até o seq ${batch.last_seq})`);
+                        for (const pending of batch.events) {
+                            await handleServerEvent(pending.event);
+                        }
+                        // Confirma o lote: o backend remove os eventos e não os reenvia na próxima conexão
+                        localStorage.setItem(lastSeqStorageKey(userId), String(batch.last_seq));
+                        ws.current?.send(JSON.stringify({ type: "ACK", payload: { seq: batch.last_seq } }));
                     } else if (wsMessage.type === "NEW_USER_REGISTERED") {
                         const newUser: IUserInList = wsMessage.payload.user; 
                         console.log("NOVO USUÁRIO REGISTRADO:", newUser);
@@ -383,6 +408,12 @@ const MainChat: React.FC = () => {
                     }
                 };
 
+                ws.current.onmessage = async (event) => {
+                    const wsMessage: IWebSocketMessage = JSON.parse(event.data);
+                    console.log("Mensagem WebSocket recebida:", wsMessage);
+                    await handleServerEvent(wsMessage);
+                };
+
                 ws.current.onclose = (event) => { 
                     console.log('WebSocket DESCONECTADO.', event.code, event.reason);
                 };